@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Throughput benchmark for the record processor lambda
+#
+# Replays Kinesis events through handler.lambda_handler, offline:
+#   - S3 and Kinesis are replaced by the LocalCloudProvider (CLOUD_PROVIDER=local)
+#   - DynamoDB metadata (phase, farm, machine, labels) is replaced by the stand-ins of this file
+#
+# The events are built from the stage file fixtures (tests/stage_files) and from the recorded events
+# (event-all-types-of-messages.json, events-csv.json, ...) whose stage files are available locally.
+# Each datatype runs in its own forked process, so the peak RSS is measured per datatype.
+#
+# Usage:
+#   python benchmark.py                                  # text report
+#   python benchmark.py --iterations 5 --save-baseline benchmark-baseline.json
+#   python benchmark.py --baseline benchmark-baseline.json --threshold 0.2
+#   python benchmark.py --datatype aux --datatype video --format json -o result.json
+#   python benchmark.py --stage-format parquet                     # input stage files converted to parquet
+#   STAGE_OUTPUT_FORMAT=parquet python benchmark.py                # output stage files in parquet
+#
+import argparse
+import base64
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import types
+
+ROOT_FOLDER = os.path.dirname(os.path.realpath(__file__))
+LAMBDA_FOLDER = os.path.join(ROOT_FOLDER, 'lambda')
+RECORDED_EVENT_FILES = ['event-all-types-of-messages.json', 'events-csv.json', 'event-all.json', 'event.json']
+
+# Metrics compared with the baseline: name -> True when higher is better
+BASELINE_METRICS = {
+    'records_per_s': True,
+    'lines_per_s': True,
+    'p95_ms': False,
+    'peak_rss_mb': False,
+}
+
+STAND_IN_CUSTOMER_ID = 'benchmark-customer'
+STAND_IN_FARM_ID = 'benchmark-farm'
+STAND_IN_PHASE_ID = 'benchmark-phase'
+STAND_IN_TIMEZONE = 'America/Toronto'
+STAND_IN_LABELS = {'caterpillars': 'pest', 'whiteflies': 'pest', 'powdery_mildew': 'disease'}
+
+
+# Replace the DynamoDB access of the data module models by in-memory metadata
+# Every tag id is found in the same phase, which has a left and a right row for it.
+def install_metadata_stand_ins():
+    import datamodule.farm_model as farm_model
+    import datamodule.machine_model as machine_model
+    import datamodule.phase_model as phase_model
+    import datamodule.sysconfig_model as sysconfig_model
+
+    def create_row(tag_id, side='left', row_number=1):
+        return {
+            'customer_id': STAND_IN_CUSTOMER_ID,
+            'farm_id': STAND_IN_FARM_ID,
+            'phase_id': STAND_IN_PHASE_ID,
+            'row_key': f"{side}-{row_number}",
+            'row_number': row_number,
+            'tag_id': tag_id,
+            'side': side,
+            'bay': 1,
+            'row': row_number,
+            'crops': [{'side': side, 'crop': 'tomato', 'variation': 'benchmark'}],
+            'margin_left': 0,
+            'margin_right': 0,
+            'max_height': 400,
+            'min_height': 0,
+            'row_length': 5000,
+            'row_width': 160,
+            'row_offset': 0,
+            'rail_distance': 0,
+            'is_active': True,
+            'creation_date': '2019-01-01 00:00:00+00:00',
+        }
+
+    def load_phase_stand_in(phase, tag_id):
+        phase.customer_id = STAND_IN_CUSTOMER_ID
+        phase.farm_id = STAND_IN_FARM_ID
+        phase.phase_id = STAND_IN_PHASE_ID
+        phase.walkway_width = 100
+        phase.posts = [{'side': 'left', 'post_count': 12, 'post_length': 400, 'post_length_cache': 400},
+                       {'side': 'right', 'post_count': 12, 'post_length': 400, 'post_length_cache': 400}]
+        phase.rows = [create_row(tag_id, 'left'), create_row(tag_id, 'right')]
+
+    def find_row(self, tag_id, load_phase=False):
+        row = next(iter([x for x in self.rows if x['tag_id'] == tag_id]), None)
+        if row:
+            return row
+        if load_phase:
+            load_phase_stand_in(self, tag_id)
+        return create_row(tag_id)
+
+    def get_by_id(self, phase_id):
+        if not self.rows:
+            load_phase_stand_in(self, 'benchmark')
+        return self
+
+    def get_by_farm_id(self, farm_id):
+        self.customer_id = STAND_IN_CUSTOMER_ID
+        self.farm_id = farm_id
+        self.timezone = STAND_IN_TIMEZONE
+        return self
+
+    def get_machine_by_id(self, machine_id):
+        self.customer_id = STAND_IN_CUSTOMER_ID
+        self.machine_id = machine_id
+        return self
+
+    phase_model.PhaseModel.find_row = find_row
+    phase_model.PhaseModel.get_by_id = get_by_id
+    phase_model.PhaseModel.data_processed = lambda self: None
+    phase_model.PhaseModel.data_incoming = lambda self: None
+    farm_model.FarmModel.get_by_farm_id = get_by_farm_id
+    machine_model.MachineModel.get_by_id = get_machine_by_id
+    sysconfig_model.SysConfigModel.labels = property(
+        lambda self: [types.SimpleNamespace(label=label, category=category)
+                      for label, category in STAND_IN_LABELS.items()])
+
+
+def create_kinesis_record(message, sequence_number):
+    return {
+        'kinesis': {
+            'kinesisSchemaVersion': '1.0',
+            'partitionKey': message.get('filename', ''),
+            'sequenceNumber': str(sequence_number),
+            'data': base64.b64encode(json.dumps(message).encode('utf-8')).decode('utf-8'),
+            'approximateArrivalTimestamp': 0,
+        },
+        'eventSource': 'aws:kinesis',
+        'eventVersion': '1.0',
+        'eventName': 'aws:kinesis:record',
+    }
+
+
+def decode_record(record):
+    return json.loads(base64.b64decode(record['kinesis']['data']).decode('utf-8'))
+
+
+# Returns the JSON objects of a file, the files may have several objects and base64 lines between them
+def read_json_objects(filepath):
+    decoder = json.JSONDecoder()
+    with open(filepath) as f:
+        content = f.read()
+    index = 0
+    while index < len(content):
+        start = content.find('{', index)
+        if start < 0:
+            break
+        try:
+            obj, index = decoder.raw_decode(content, start)
+            yield obj
+        except ValueError:
+            index = content.find('\n', start) + 1 or len(content)
+
+
+# Returns (records, skipped): the recorded records whose stage files are available locally
+def load_recorded_records(provider):
+    records = []
+    skipped = 0
+    for filename in RECORDED_EVENT_FILES:
+        filepath = os.path.join(ROOT_FOLDER, filename)
+        if not os.path.isfile(filepath):
+            continue
+        for obj in read_json_objects(filepath):
+            if 'Records' in obj:
+                candidates = obj['Records']
+            elif 'type' in obj and 'payload' in obj:
+                candidates = [create_kinesis_record(obj, 0)]
+            else:
+                continue
+            for record in candidates:
+                try:
+                    message = decode_record(record)
+                    files = message['payload']
+                    if (files and isinstance(files, list) and all(isinstance(f, str) for f in files)
+                            and all(provider.find_stage_file(provider.extract_file_key(f)) for f in files)):
+                        records.append(record)
+                        continue
+                except Exception:
+                    pass
+                skipped += 1
+    return records, skipped
+
+
+def load_fixture_records():
+    from events import stage_files_event_generator
+    return [event['Records'][0] for event, _, _ in stage_files_event_generator()]
+
+
+# Returns ({record type: [records]}, number of recorded records skipped)
+def load_records_by_datatype():
+    from providers.local import local
+    records, skipped = load_recorded_records(local())
+    records += load_fixture_records()
+    by_datatype = {}
+    for sequence_number, record in enumerate(records):
+        record = dict(record, kinesis=dict(record['kinesis'], sequenceNumber=str(sequence_number)))
+        by_datatype.setdefault(decode_record(record)['type'], []).append(record)
+    return by_datatype, skipped
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0
+    index = min(len(values) - 1, max(0, int(round(fraction * (len(values) - 1)))))
+    return values[index]
+
+
+# Replays the records of one datatype and sends the measures to the parent (called in a child process)
+def run_datatype(records, iterations, connection):
+    try:
+        import handler
+        latencies = []
+        output_lines = 0
+        errors = 0
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(iterations):
+                for record in records:
+                    record_started = time.perf_counter()
+                    result = handler.lambda_handler({'Records': [record]}, None)
+                    latencies.append((time.perf_counter() - record_started) * 1000)
+                    output_lines += result['records_stats']['output_lines_created']
+                    errors += result['exception_count']
+        elapsed = time.perf_counter() - started
+        connection.send({
+            'records': len(latencies),
+            'errors': errors,
+            'output_lines': output_lines,
+            'seconds': elapsed,
+            'records_per_s': len(latencies) / elapsed if elapsed else 0,
+            'lines_per_s': output_lines / elapsed if elapsed else 0,
+            'p50_ms': percentile(latencies, 0.5),
+            'p95_ms': percentile(latencies, 0.95),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        })
+    except Exception as error:
+        connection.send({'error': f"{error.__class__.__name__}: {error}"})
+    finally:
+        connection.close()
+
+
+# Converts the CSV stage files of stage_root to parquet in output_root (called in a child process)
+def convert_stage_files(stage_root, output_root):
+    from models.stage_file import StageCSVReaderFile, write_parquet
+    import pandas as pd
+    for folder, _, filenames in os.walk(stage_root):
+        for filename in filenames:
+            filepath = os.path.join(folder, filename)
+            header = pd.read_csv(filepath, nrows=0).columns.tolist()
+            rows = list(StageCSVReaderFile(filepath))
+            if header == ['payload']:
+                data_frame = pd.DataFrame({'payload': rows})
+            else:
+                data_frame = pd.DataFrame(rows, columns=header)
+            destination = os.path.join(output_root, os.path.relpath(filepath, stage_root) + '.parquet')
+            write_parquet(data_frame, destination)
+
+
+# Points the stage files of the records to their parquet copy
+def use_parquet_stage_files(by_datatype):
+    from providers.local.local_cloud import DEFAULT_STAGE_ROOT
+    stage_root = os.path.join(os.environ['LOCAL_OUTPUT_DIR'], 'parquet_stage_files')
+    context = multiprocessing.get_context('fork')
+    worker = context.Process(target=convert_stage_files, args=(DEFAULT_STAGE_ROOT, stage_root))
+    worker.start()
+    worker.join()
+    if worker.exitcode:
+        raise Exception(f"Error while converting the stage files to parquet. Exit code: {worker.exitcode}")
+    os.environ['LOCAL_STAGE_ROOT'] = stage_root
+    for datatype, records in by_datatype.items():
+        for index, record in enumerate(records):
+            message = decode_record(record)
+            message['payload'] = [f"{filepath}.parquet" for filepath in message['payload']]
+            records[index] = dict(record, kinesis=dict(
+                record['kinesis'], data=base64.b64encode(json.dumps(message).encode('utf-8')).decode('utf-8')))
+
+
+def run_benchmark(datatypes, iterations, stage_format='csv'):
+    context = multiprocessing.get_context('fork')
+    by_datatype, skipped = load_records_by_datatype()
+    if stage_format == 'parquet':
+        use_parquet_stage_files(by_datatype)
+    results = {}
+    for datatype in sorted(by_datatype):
+        if datatypes and datatype not in datatypes:
+            continue
+        receiver, sender = context.Pipe(duplex=False)
+        worker = context.Process(target=run_datatype, args=(by_datatype[datatype], iterations, sender))
+        worker.start()
+        sender.close()
+        try:
+            results[datatype] = receiver.recv()
+        except EOFError:
+            results[datatype] = {'error': f"The benchmark process exited without result. Exit code: {worker.exitcode}"}
+        worker.join()
+    return {'iterations': iterations, 'stage_format': stage_format, 'recorded_records_skipped': skipped,
+            'datatypes': results}
+
+
+# Returns the list of regressions, a metric regresses when it is worse than the baseline by more than threshold
+def compare_with_baseline(report, baseline, threshold):
+    regressions = []
+    for datatype, result in report['datatypes'].items():
+        expected = baseline.get('datatypes', {}).get(datatype)
+        if not expected or 'error' in result or 'error' in expected:
+            continue
+        for metric, higher_is_better in BASELINE_METRICS.items():
+            value, baseline_value = result[metric], expected[metric]
+            if not baseline_value:
+                continue
+            change = (value - baseline_value) / baseline_value
+            if (higher_is_better and change < -threshold) or (not higher_is_better and change > threshold):
+                regressions.append(f"{datatype}: {metric} {value:.2f} vs baseline {baseline_value:.2f} ({change:+.0%})")
+    return regressions
+
+
+def format_text(report):
+    lines = [
+        f"Iterations: {report['iterations']}, stage files: {report['stage_format']}, recorded records skipped (stage files not available locally): "
+        f"{report['recorded_records_skipped']}",
+        "",
+        f"{'datatype':<34}{'records':>8}{'errors':>8}{'rec/s':>10}{'lines/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'RSS MB':>9}"
+    ]
+    for datatype, result in report['datatypes'].items():
+        if 'error' in result:
+            lines.append(f"{datatype:<34}{result['error']}")
+            continue
+        lines.append(f"{datatype:<34}{result['records']:>8}{result['errors']:>8}{result['records_per_s']:>10.1f}"
+                     f"{result['lines_per_s']:>12.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+                     f"{result['peak_rss_mb']:>9.1f}")
+    if 'regressions' in report:
+        lines += ["", f"Regressions (threshold {report['threshold']:.0%}): {len(report['regressions'])}"]
+        lines += [f"  {regression}" for regression in report['regressions']]
+    return os.linesep.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmark for the record processor lambda")
+    parser.add_argument('--iterations', type=int, default=3, help="number of times each record is replayed")
+    parser.add_argument('--datatype', action='append', help="record type to run (default: all)")
+    parser.add_argument('--stage-format', choices=['csv', 'parquet'], default='csv',
+                        help="format of the input stage files, the CSV fixtures are converted to parquet")
+    parser.add_argument('--format', choices=['text', 'json'], default='text')
+    parser.add_argument('-o', '--output', help="write the report to this file instead of the stdout")
+    parser.add_argument('--baseline', help="baseline report to compare with")
+    parser.add_argument('--threshold', type=float, default=0.2, help="regression threshold (default: 0.2 = 20%%)")
+    parser.add_argument('--save-baseline', help="save the report as a baseline")
+    args = parser.parse_args()
+
+    os.environ['CLOUD_PROVIDER'] = 'local'
+    os.environ.setdefault('LOCAL_OUTPUT_DIR', tempfile.mkdtemp(prefix='b2-record-processor-benchmark-'))
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+    os.environ.setdefault('LOG_LEVEL', 'ERROR')
+    sys.path.insert(0, LAMBDA_FOLDER)
+    os.chdir(LAMBDA_FOLDER)
+    install_metadata_stand_ins()
+
+    report = run_benchmark(args.datatype, args.iterations, args.stage_format)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['threshold'] = args.threshold
+        report['regressions'] = compare_with_baseline(report, baseline, args.threshold)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    content = json.dumps(report, indent=4) if args.format == 'json' else format_text(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(content + os.linesep)
+    else:
+        print(content)
+
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
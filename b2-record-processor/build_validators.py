@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Generates the JSON schema validators of the plugins ahead of time
+#
+# Imports every schema module of the plugins (plugins/*/*schema*.py) and writes the code generated by
+# fastjsonschema for each schema to lambda/generated_validators/<name>.py, so the lambda does not compile
+# the schemas on a cold start. Run it before sam build (see deploy.sh).
+#
+# Usage:
+#   python build_validators.py
+#
+import glob
+import importlib
+import os
+import shutil
+import sys
+
+LAMBDA_FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'lambda')
+
+
+def main():
+    sys.path.insert(0, LAMBDA_FOLDER)
+    from models import schema_validator
+
+    output_folder = os.path.join(LAMBDA_FOLDER, schema_validator.GENERATED_VALIDATORS_PACKAGE)
+    # Removes the validators of the previous build, so the schemas are compiled while they are imported
+    shutil.rmtree(output_folder, ignore_errors=True)
+
+    for filepath in sorted(glob.glob(os.path.join(LAMBDA_FOLDER, 'plugins', '*', '*schema*.py'))):
+        if os.path.basename(filepath).startswith('test_'):
+            continue
+        module_name = os.path.relpath(filepath, LAMBDA_FOLDER)[:-len('.py')].replace(os.sep, '.')
+        importlib.import_module(module_name)
+
+    os.makedirs(output_folder)
+    with open(os.path.join(output_folder, '__init__.py'), 'w') as f:
+        f.write("# Generated by build_validators.py, do not edit.\n")
+
+    for name, definition in sorted(schema_validator.SCHEMAS.items()):
+        with open(os.path.join(output_folder, f"{name}.py"), 'w') as f:
+            f.write("# Generated by build_validators.py, do not edit.\n")
+            f.write(schema_validator.generate_validator_code(definition))
+        print(f"{name}: {os.path.join(schema_validator.GENERATED_VALIDATORS_PACKAGE, name)}.py")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 STACK_NAME="lambda-b2-record-processor"
 
+python build_validators.py
 sam build --use-container
 
 cd .aws-sam/build
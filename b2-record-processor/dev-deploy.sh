@@ -1,5 +1,6 @@
 STACK_NAME="test-record-processor"
 BUCKET_NAME=ecoation-backend-dev
+python build_validators.py
 sam build --use-container
 
 cd .aws-sam/build
@@ -5,13 +5,22 @@
 # Modified by: Fernando Mangussi <fernando@ecoation.com>
 #
 
+import collections
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 from helpers import get_logger
+from models.stage_file import SpooledStageContent, get_memory_size
 
 logger = get_logger(__name__)
 
 
+# Removes the spool file of a fetched stage object which is not read
+def discard_content(content):
+    if content.__class__ is SpooledStageContent:
+        content.discard()
+
+
 class CloudProviderBase(ABC):
     '''
     This is a generic Cloud provider to add an abstraction layer between business rules and physical implementation
@@ -26,6 +35,68 @@ class CloudProviderBase(ABC):
     def download_object(self, obj_address, obj_name, local_file_location):
         raise Exception("Not Implemented")  # Abstract Methods! Remove this line when implementing the method
 
+    # Returns a writable binary file which uploads the stage file while it is written (close() completes the
+    # upload, abort() cancels it), or None when the stage files are uploaded by upload_stage_content
+    def open_stage_upload(self, destination_path):
+        return None
+
+    # Deletes a stage file already uploaded (e.g. a part of an output stage file whose message failed)
+    @abstractmethod
+    def delete_stage_object(self, destination_path):
+        raise Exception("Not Implemented")  # Abstract Methods! Remove this line when implementing the method
+
+    # Cache of the downloaded stage objects (StageObjectCache), None when the provider has no cache
+    stage_cache = None
+
+    def get_stage_cache_stats(self):
+        return self.stage_cache.get_stats() if self.stage_cache else {}
+
+    @abstractmethod
+    def fetch_stage_object(self, obj_name):
+        """Returns the content of a stage object, as it is stored: bytes, or SpooledStageContent when it is bigger
+        than STAGE_FILE_MEMORY_MAX_BYTES."""
+        raise Exception("Not Implemented")  # Abstract Methods! Remove this line when implementing the method
+
+    # Fetches the stage objects concurrently, with at most max_workers downloads at a time
+    # Yields (obj_name, content or the exception raised while fetching it), in the order of obj_names.
+    # At most max_workers objects are fetched ahead of the one being consumed, and no more while the fetched ones
+    # kept in memory, plus held_bytes() (the memory already used by the consumer), reach max_bytes.
+    def fetch_stage_objects(self, obj_names, max_workers=8, max_bytes=None, held_bytes=None):
+        obj_names = iter(obj_names)
+        futures = collections.deque()
+
+        def fetched_bytes():
+            return sum(get_memory_size(future.result()) for _, future in futures
+                       if future.done() and not future.exception())
+
+        def can_fetch():
+            if len(futures) >= max_workers:
+                return False
+            if max_bytes is None or not futures:
+                return True
+            return fetched_bytes() + (held_bytes() if held_bytes else 0) < max_bytes
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            try:
+                while True:
+                    while can_fetch():
+                        obj_name = next(obj_names, None)
+                        if obj_name is None:
+                            break
+                        futures.append((obj_name, executor.submit(self.fetch_stage_object, obj_name)))
+                    if not futures:
+                        return
+                    obj_name, future = futures.popleft()
+                    try:
+                        content = future.result()
+                    except Exception as error:
+                        content = error
+                    yield obj_name, content
+            finally:
+                for _, future in futures:
+                    if not future.cancel() and not future.exception():
+                        discard_content(future.result())
+
     @abstractmethod
     def put_object(self, obj_address, obj_name, obj_content):
         raise Exception("Not Implemented")  # Abstract Methods! Remove this line when implementing the method
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Ecoation RecordProcessorPool
+#
+import threading
+
+from helpers import get_logger
+
+logger = get_logger(__name__)
+
+
+class RecordProcessorPool:
+    """
+    Keeps record processor instances alive across Kinesis records and warm invocations.
+
+    Building a record processor creates its Phase, Farm and Machine models, each one with its own
+    boto3 DynamoDB resource. The pool hands out an idle instance when there is one and only builds
+    a new instance when all of them are busy. The instances are built one at a time, as boto3 creates
+    the resources on its default session, which is not thread safe. The caller must call reset() on
+    the instance before processing a new record.
+    Usage:
+        record_processor = pool.acquire(data_type, processor_class, cloud_provider)
+        try:
+            record_processor.reset()
+            result = record_processor.process(event)
+        finally:
+            pool.release(data_type, record_processor)
+    """
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._instances_built = 0
+        self._instances_reused = 0
+
+    @property
+    def instances_built(self):
+        return self._instances_built
+
+    @property
+    def instances_reused(self):
+        return self._instances_reused
+
+    # Returns an idle instance of the processor, or a new one if there is none available
+    # Parameters:
+    #   data_type: the name used to register the processor
+    #   processor_class: A class of type RecordProcessorBase
+    #   cloud_provider: an instance of CloudProviderBase class
+    def acquire(self, data_type, processor_class, cloud_provider):
+        with self._lock:
+            idle = self._idle.get(data_type)
+            if idle:
+                self._instances_reused += 1
+                return idle.pop()
+            self._instances_built += 1
+        # The idle instances are still handed out while an instance is built
+        with self._build_lock:
+            return processor_class(data_type, cloud_provider)
+
+    # Gives the instance back to the pool, so it can be used by the next record
+    def release(self, data_type, record_processor):
+        with self._lock:
+            self._idle.setdefault(data_type, []).append(record_processor)
+
+    def clear(self):
+        with self._lock:
+            self._idle = {}
+
+    def get_stats(self):
+        return {
+            'instances_built': self._instances_built,
+            'instances_reused': self._instances_reused
+        }
@@ -4,8 +4,14 @@
 # Created by: Farzad Khandan (farzadkhandan@ecoation.com)
 #
 
+import importlib
+import threading
+from datetime import datetime
+
 from base.cloud_provider import CloudProviderBase
+from base.processor_pool import RecordProcessorPool
 from helpers import get_logger
+from models.event_message import InvalidStreamMessage
 from models.record_processor import RecordProcessorBase
 
 logger = get_logger(__name__)
@@ -13,6 +19,17 @@ logger = get_logger(__name__)
 PROCESSOR_PLUGINS_FOLDER = "../plugins/"
 PROCESSOR_PREFIX = "raw_processor_"
 
+# Stats summed up from the results of the processors of a record
+RECORD_STATS_KEYS = [
+    'error_count',
+    'output_lines_created',
+    'input_lines_rejected',
+    'input_lines_tbd_rejected',
+    'stage_files_total',
+    'stage_files_processed',
+    'stage_files_rejected'
+]
+
 
 class RecordProcessorProxy:
     """
@@ -22,7 +39,11 @@ class RecordProcessorProxy:
        RecordProcessorProxyObj =  RecordProcessorProxy.get_instance(cloud_provider_class)
     """
     _processors = {}
+    _processors_by_type = {}
+    _lazy_processors = {}
+    _lazy_lock = threading.Lock()
     _cloud_provider = None
+    _pool = RecordProcessorPool()
 
     @classmethod
     def register_cloud_provider(cls, cloud_provider):
@@ -44,9 +65,55 @@ class RecordProcessorProxy:
             raise Exception("Wrong processor class. The processor class must be a descendent of RecordProcessorBase.")        
         if not issubclass(type(data_type), str):
             raise Exception(f"Wrong data type, expected <string>, provided {str(data_type)}")        
-        if data_type in cls._processors:
+        if data_type in cls._processors or data_type in cls._lazy_processors:
             raise Exception(f"Duplicate processor type: <{data_type}> already exists.")
         cls._processors[data_type] = processor
+        for record_type in processor.types_to_be_processed():
+            cls._processors_by_type.setdefault(record_type, []).append(data_type)
+
+    # Register a Raw Processor that is imported only when the first record of its types is processed
+    # Parameters:
+    #   data_type: the RawDataType of the plugin, must be unique in a project.
+    #   module_path: the plugin module, exporting RawDataType and RecordProcessor (e.g.: plugins.wave)
+    #   record_types: the types of record processed by the plugin (e.g.: ["wave"])
+    @classmethod
+    def register_lazy_processor(cls, data_type, module_path, record_types):
+        if not issubclass(type(data_type), str):
+            raise Exception(f"Wrong data type, expected <string>, provided {str(data_type)}")
+        if data_type in cls._processors or data_type in cls._lazy_processors:
+            raise Exception(f"Duplicate processor type: <{data_type}> already exists.")
+        cls._lazy_processors[data_type] = (module_path, list(record_types))
+        for record_type in record_types:
+            cls._processors_by_type.setdefault(record_type, []).append(data_type)
+
+    # Returns the processor class registered for the data type, importing the plugin module on the first use
+    @classmethod
+    def get_processor(cls, data_type):
+        processor = cls._processors.get(data_type)
+        if processor:
+            return processor
+
+        with cls._lazy_lock:
+            if data_type in cls._processors:
+                return cls._processors[data_type]
+            module_path, record_types = cls._lazy_processors[data_type]
+            module = importlib.import_module(module_path)
+            processor = module.RecordProcessor
+            if module.RawDataType != data_type:
+                raise Exception(f"Wrong plugin module: <{module_path}> implements <{module.RawDataType}>, expected <{data_type}>.")
+            if not issubclass(processor, RecordProcessorBase):
+                raise Exception("Wrong processor class. The processor class must be a descendent of RecordProcessorBase.")
+            if sorted(processor.types_to_be_processed()) != sorted(record_types):
+                raise Exception(f"Wrong record types for <{data_type}>: registered {record_types}, "
+                                f"processed {processor.types_to_be_processed()}.")
+            cls._processors[data_type] = processor
+            logger.info(f"Record processor <{data_type}> loaded from <{module_path}>.")
+        return processor
+
+    # Returns the names of the processors registered for the type of the record (e.g.: wave|video|image|aux|label)
+    @classmethod
+    def get_processors_by_type(cls, record_type):
+        return cls._processors_by_type.get(record_type, [])
 
     # Automatically registers all the processor plugins
     # Looks in <project_root>/plugins to find new processors
@@ -96,34 +163,116 @@ class RecordProcessorProxy:
     def get_logger(name):
         return get_logger(name)
 
+    # Number of processor instances built and reused by the pool
+    @classmethod
+    def get_pool_stats(cls):
+        return cls._pool.get_stats()
+
+    # Send an event that could not be decoded to the invalid data stream
+    # Returns False when the event could not be sent
+    @classmethod
+    def send_to_invalid_data_stream(cls, event, error):
+        try:
+            invalid_event = InvalidStreamMessage()
+            invalid_event.source = ""
+            invalid_event.incoming_timestamp = datetime.now()
+            invalid_event.outgoing_timestamp = datetime.now()
+            invalid_event.type = "event"
+            invalid_event.filename = ""
+            invalid_event.reason = str(error)
+            invalid_event.invalid_source = "record_processor"
+            payload = {
+                "record_processor": cls.__name__,
+                "invalid_event": event
+            }
+            cls._cloud_provider.put_in_invalid_data_stream(payload=invalid_event.get_json(payload))
+        except Exception as ex:
+            logger.error(f"CRITICAL ERROR while sending to invalid stream. Details: event: [{event}] error: [{str(ex)}]")
+            return False
+        return True
+
     # Process event main logic
+    # Returns the number of errors found while processing the event
     @classmethod
     def process(cls, event):
+        return cls.process_with_stats(event)['error_count']
+
+    # Process the event and returns the stats of the processors summed up
+    # stats['retry'] is True when an error was not sent to the invalid stream (e.g. a processor could not be built),
+    # the record must then be retried by Lambda
+    # The event is decoded only once and handed over to the processors registered for its type
+    # event_message: the StreamEventMessage of the event, when it was already created by the caller
+    @classmethod
+    def process_with_stats(cls, event, event_message=None):
         def format_message(messages):
             return f"Record Processor: [{record_processor_name}] - {messages}"
 
+        stats = dict.fromkeys(RECORD_STATS_KEYS, 0)
+        stats['retry'] = False
         error_count = 0
         logger.debug("Processing event: %s", event)
 
-        for record_processor_name, record_processor_class in cls._processors.items():
+        try:
+            if event_message is None:
+                event_message = cls._cloud_provider.create_event_message(event)
+            record_type = event_message.get_event_data_decoded()["type"]
+        except Exception as ex:
+            logger.error(f"Invalid event message. Details: {str(ex)}")
+            stats['retry'] = not cls.send_to_invalid_data_stream(event, ex)
+            stats['error_count'] = 1
+            return stats
+
+        record_processor_names = cls.get_processors_by_type(record_type)
+        if not record_processor_names:
+            logger.info(f"There is no record processor registered for the type <{record_type}>.")
+
+        for record_processor_name in record_processor_names:
+            try:
+                record_processor_class = cls.get_processor(record_processor_name)
+            except Exception as ex:
+                logger.error(format_message(f"Error loading the record processor."))
+                logger.exception(ex)
+                error_count += 1
+                stats['retry'] = True
+                continue
+
             result = {}
+            record_processor = None
             try:
                 #logger.info(format_message("Starting the record processor."))
-                result = record_processor_class(record_processor_name, cls._cloud_provider).process(event)
+                record_processor = cls._pool.acquire(record_processor_name, record_processor_class, cls._cloud_provider)
+                try:
+                    record_processor.reset()
+                except Exception:
+                    # The state of the instance is unknown, it is dropped from the pool
+                    record_processor = None
+                    raise
+                result = record_processor.process(event, event_message=event_message)
             except Exception as ex:
                 logger.error(format_message(f"Error launching event processor."))
                 logger.exception(ex)
+            finally:
+                # An instance whose process() failed is reset before its next record
+                if record_processor is not None:
+                    cls._pool.release(record_processor_name, record_processor)
 
             if result.get('processed', None):
                 logger.info(format_message(f"Result: {result}"))
 
             if not cls.check_process_output(result):
                 logger.error(format_message(f"Processor returned an invalid output: {str(result)}"))
+                stats['retry'] = True
                 continue
 
             for msg in result['messages']:
                 logger.debug(msg)
 
+            for key in RECORD_STATS_KEYS:
+                stats[key] += result.get(key, 0) or 0
+
+            if result.get('retry'):
+                stats['retry'] = True
+
             if result['errors']:
                 error_count += len(result['errors'])
                 #logger.error(format_message(f"Error processing event: [{event}]"))
@@ -136,4 +285,5 @@ class RecordProcessorProxy:
                 if not result['continue']:
                     continue
 
-        return error_count
+        stats['error_count'] = error_count
+        return stats
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Ecoation RecordBatchExecutor
+#
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers import get_logger
+
+logger = get_logger(__name__)
+
+ORDERING_KEY_PARTITION_KEY = 'partition_key'
+ORDERING_KEY_TAG_ID = 'tag_id'
+ORDERING_KEYS = [ORDERING_KEY_PARTITION_KEY, ORDERING_KEY_TAG_ID]
+
+
+# Returns the Kinesis partition key of the record (a StreamEventMessage)
+def get_partition_key(event_message):
+    return event_message.get_event_partition_key()
+
+
+# Returns the tag id of the record, taken from the filename of the message (e.g.: 0438763235890056-20190423-left-191134.label)
+# The data of the record is decoded once, by the event message, and reused by the processors
+# Falls back to the partition key when the record can not be decoded
+def get_tag_id(event_message):
+    try:
+        filename = os.path.basename(event_message.get_event_data_decoded()['filename'])
+        tag_id = filename.split('-')[0]
+        if tag_id:
+            return tag_id
+    except Exception:
+        pass
+    return get_partition_key(event_message)
+
+
+ORDERING_KEY_FUNCTIONS = {
+    ORDERING_KEY_PARTITION_KEY: get_partition_key,
+    ORDERING_KEY_TAG_ID: get_tag_id
+}
+
+
+class RecordBatchExecutor:
+    """
+    Processes the records of a Lambda event (StreamEventMessage) using a bounded pool of worker threads.
+
+    Records are grouped by an ordering key (the Kinesis partition key or the tag id). Each group is
+    processed by a single worker, in the order the records arrived, so records of the same key never
+    run concurrently. With max_workers=1 the records are processed sequentially in the calling thread.
+    Usage:
+        executor = RecordBatchExecutor(process_record, max_workers=8, ordering_key='tag_id')
+        results = executor.run([cloud_provider.create_event_message(r) for r in event['Records']])
+    """
+
+    def __init__(self, process_record, max_workers=1, ordering_key=ORDERING_KEY_PARTITION_KEY):
+        if ordering_key not in ORDERING_KEY_FUNCTIONS:
+            raise ValueError(f"Invalid ordering key <{ordering_key}>, expected one of {ORDERING_KEYS}")
+        self._process_record = process_record
+        self._max_workers = max(1, int(max_workers))
+        self._get_ordering_key = ORDERING_KEY_FUNCTIONS[ordering_key]
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    # Groups the records by the ordering key, keeping the position of each record in the batch
+    def group_records(self, records):
+        groups = OrderedDict()
+        for index, record in enumerate(records):
+            groups.setdefault(self._get_ordering_key(record), []).append((index, record))
+        return groups
+
+    # Process all the records and returns the results in the same order of the records
+    def run(self, records):
+        results = [None] * len(records)
+
+        def process_group(group):
+            for index, record in group:
+                results[index] = self._process_record(record)
+
+        if self._max_workers == 1 or len(records) <= 1:
+            process_group(enumerate(records))
+            return results
+
+        groups = self.group_records(records)
+        with ThreadPoolExecutor(max_workers=min(self._max_workers, len(groups))) as executor:
+            futures = [executor.submit(process_group, group) for group in groups.values()]
+            for future in futures:
+                future.result()
+        return results
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# Ecoation StageObjectCache
+#
+import collections
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+
+from helpers import get_logger
+from models.stage_file import SpooledStageContent, link_or_copy
+
+logger = get_logger(__name__)
+
+
+class StageObjectCache:
+    """
+    Byte-bounded LRU cache of the downloaded stage objects, stored in a folder of /tmp.
+
+    The objects are keyed by bucket, key and ETag, so a retried Kinesis record or a replayed stage file is
+    read from /tmp instead of S3 as long as the object did not change. The cache lives in the cloud provider,
+    so it is shared by the warm invocations, and the files already in the folder are indexed on a cold start.
+    The least recently used objects are evicted when the cache is bigger than max_bytes or when the free space
+    of the folder is less than min_free_bytes (the ephemeral storage of the lambda is limited).
+    The objects bigger than memory_max_bytes are put and got as SpooledStageContent, hard linked to the cached file
+    instead of being read in memory.
+    Usage:
+        etag = cache.get_etag(bucket, key)
+        content = cache.get(bucket, key, etag)  # None when the object is not cached
+        cache.put(bucket, key, etag, content)
+    """
+
+    def __init__(self, directory, max_bytes, min_free_bytes=0, memory_max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self._lock = threading.Lock()
+        # object name -> (etag, filepath, size), the least recently used first
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self.load()
+
+    @property
+    def size(self):
+        return self._size
+
+    @staticmethod
+    def get_object_name(bucket, key):
+        return hashlib.sha256(f"{bucket}/{key}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def normalize_etag(etag):
+        return etag.strip('"')
+
+    # Indexes the objects cached by a previous process, the oldest ones first
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for filename in os.listdir(self.directory):
+            object_name, _, etag = filename.partition('-')
+            filepath = os.path.join(self.directory, filename)
+            if filename.endswith(('.tmp', '.spool')):
+                # Written by a process which stopped before the end of the download, or the end of the read
+                os.remove(filepath)
+                continue
+            if not etag or not os.path.isfile(filepath):
+                continue
+            stat = os.stat(filepath)
+            files.append((stat.st_mtime, object_name, etag, filepath, stat.st_size))
+        for _, object_name, etag, filepath, size in sorted(files):
+            self._entries[object_name] = (etag, filepath, size)
+            self._size += size
+        self.evict()
+
+    # Returns the ETag of the cached version of the object, or None
+    def get_etag(self, bucket, key):
+        entry = self._entries.get(self.get_object_name(bucket, key))
+        return f'"{entry[0]}"' if entry else None
+
+    # Returns the content of the object (bytes or SpooledStageContent), or None when this version of the object is
+    # not cached
+    def get(self, bucket, key, etag):
+        object_name = self.get_object_name(bucket, key)
+        with self._lock:
+            entry = self._entries.get(object_name)
+            if not entry or entry[0] != self.normalize_etag(etag):
+                return None
+            self._entries.move_to_end(object_name)
+        try:
+            if self.memory_max_bytes is not None and entry[2] > self.memory_max_bytes:
+                # The link is removed by the reader, the cached file stays
+                content = SpooledStageContent(f"{entry[1]}.{threading.get_ident()}.{uuid.uuid4().hex}.spool")
+                link_or_copy(entry[1], content.path)
+            else:
+                with open(entry[1], 'rb') as f:
+                    content = f.read()
+        except FileNotFoundError:
+            self.remove(object_name)
+            return None
+        with self._lock:
+            self._hits += 1
+        return content
+
+    # Stores a downloaded object (bytes or SpooledStageContent), it replaces the previous version of the object
+    def put(self, bucket, key, etag, content):
+        object_name = self.get_object_name(bucket, key)
+        etag = self.normalize_etag(etag)
+        with self._lock:
+            self._misses += 1
+        self.remove(object_name)
+        size = content.size if content.__class__ is SpooledStageContent else len(content)
+        if size > self.max_bytes:
+            return
+        filepath = os.path.join(self.directory, f"{object_name}-{etag}")
+        temporary_filepath = f"{filepath}.{threading.get_ident()}.tmp"
+        try:
+            if content.__class__ is SpooledStageContent:
+                link_or_copy(content.path, temporary_filepath)
+            else:
+                with open(temporary_filepath, 'wb') as f:
+                    f.write(content)
+            os.replace(temporary_filepath, filepath)
+        except OSError as error:
+            logger.warning(f"The stage object could not be cached. Details: {error}")
+            if os.path.exists(temporary_filepath):
+                os.remove(temporary_filepath)
+            return
+        with self._lock:
+            self._entries[object_name] = (etag, filepath, size)
+            self._size += size
+        self.evict()
+
+    def remove(self, object_name):
+        with self._lock:
+            entry = self._entries.pop(object_name, None)
+            if entry:
+                self._size -= entry[2]
+        if entry and os.path.exists(entry[1]):
+            os.remove(entry[1])
+
+    def is_full(self):
+        if self._size > self.max_bytes:
+            return True
+        return self.min_free_bytes > 0 and shutil.disk_usage(self.directory).free < self.min_free_bytes
+
+    # Removes the least recently used objects until the cache is under its limits
+    def evict(self):
+        while self._entries and self.is_full():
+            with self._lock:
+                if not self._entries:
+                    break
+                object_name = next(iter(self._entries))
+                self._evictions += 1
+            self.remove(object_name)
+
+    def get_stats(self):
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'objects': len(self._entries),
+            'bytes': self._size
+        }
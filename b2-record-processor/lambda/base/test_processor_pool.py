@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# Unit Test for the RecordProcessorPool
+#
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from base.processor_pool import RecordProcessorPool
+
+
+class FakeProcessor:
+
+    def __init__(self, name, cloud_provider):
+        self.name = name
+        self.cloud_provider = cloud_provider
+
+
+def test_acquire_builds_when_pool_is_empty():
+    pool = RecordProcessorPool()
+    first = pool.acquire('wave', FakeProcessor, 'provider')
+    second = pool.acquire('wave', FakeProcessor, 'provider')
+    assert first is not second
+    assert pool.get_stats() == {'instances_built': 2, 'instances_reused': 0}
+
+
+def test_acquire_reuses_released_instance():
+    pool = RecordProcessorPool()
+    first = pool.acquire('wave', FakeProcessor, 'provider')
+    pool.release('wave', first)
+    assert pool.acquire('wave', FakeProcessor, 'provider') is first
+    assert pool.get_stats() == {'instances_built': 1, 'instances_reused': 1}
+
+
+def test_instances_are_not_shared_between_data_types():
+    pool = RecordProcessorPool()
+    wave = pool.acquire('wave', FakeProcessor, 'provider')
+    pool.release('wave', wave)
+    video = pool.acquire('video', FakeProcessor, 'provider')
+    assert video is not wave
+    assert video.name == 'video'
+
+
+def test_instances_are_built_one_at_a_time():
+    lock = threading.Lock()
+    building = []
+    max_building = []
+
+    class SlowProcessor(FakeProcessor):
+
+        def __init__(self, name, cloud_provider):
+            with lock:
+                building.append(name)
+                max_building.append(len(building))
+            time.sleep(0.01)
+            with lock:
+                building.remove(name)
+            super().__init__(name, cloud_provider)
+
+    pool = RecordProcessorPool()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        instances = list(executor.map(lambda i: pool.acquire('wave', SlowProcessor, 'provider'), range(8)))
+    assert len(set(map(id, instances))) == 8
+    assert max(max_building) == 1
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# Unit Test for the RecordProcessorProxy type router
+#
+
+import base64
+import importlib
+import json
+import sys
+import types
+
+from base.proxy import RecordProcessorProxy
+from models.event_message import AWSKinesisEventMessage
+from models.record_processor import RecordProcessorBase
+
+
+class FakeCloudProvider:
+
+    def __init__(self):
+        self.invalid_payloads = []
+        self.created_messages = 0
+
+    def create_event_message(self, event):
+        self.created_messages += 1
+        return AWSKinesisEventMessage(event)
+
+    def put_in_invalid_data_stream(self, payload):
+        self.invalid_payloads.append(payload)
+
+
+class FakeProcessor:
+
+    def __init__(self, data_type):
+        self.data_type = data_type
+        self.event_messages = []
+
+    def reset(self):
+        pass
+
+    def process(self, event, event_message=None):
+        self.event_messages.append(event_message)
+        return {'processed': True, 'continue': True, 'errors': [], 'messages': []}
+
+
+class FakePool:
+
+    def __init__(self):
+        self.processors = {}
+        self.released = []
+
+    def acquire(self, data_type, processor_class, cloud_provider):
+        return self.processors.setdefault(data_type, FakeProcessor(data_type))
+
+    def release(self, data_type, record_processor):
+        self.released.append(record_processor)
+
+
+def create_proxy():
+    class WaveProcessor(RecordProcessorBase):
+        @staticmethod
+        def types_to_be_processed():
+            return ["wave"]
+
+    class ImageProcessor(RecordProcessorBase):
+        @staticmethod
+        def types_to_be_processed():
+            return ["image"]
+
+    class ProxyUnderTest(RecordProcessorProxy):
+        _processors = {}
+        _processors_by_type = {}
+        _lazy_processors = {}
+        _cloud_provider = FakeCloudProvider()
+        _pool = FakePool()
+
+    ProxyUnderTest.register_processor('wave', WaveProcessor)
+    ProxyUnderTest.register_processor('image', ImageProcessor)
+    return ProxyUnderTest
+
+
+def create_event(content):
+    data = base64.b64encode(json.dumps(content).encode('utf-8')).decode('utf-8')
+    return {"kinesis": {"partitionKey": "key", "sequenceNumber": "1", "data": data}}
+
+
+def test_register_processor_indexes_by_type():
+    proxy = create_proxy()
+    assert proxy.get_processors_by_type('wave') == ['wave']
+    assert proxy.get_processors_by_type('label') == []
+
+
+def test_process_runs_only_the_processors_of_the_type():
+    proxy = create_proxy()
+    assert proxy.process(create_event({"type": "image", "payload": []})) == 0
+    assert list(proxy._pool.processors) == ['image']
+    assert proxy._cloud_provider.created_messages == 1
+    assert isinstance(proxy._pool.processors['image'].event_messages[0], AWSKinesisEventMessage)
+
+
+def test_process_skips_unknown_types():
+    proxy = create_proxy()
+    assert proxy.process(create_event({"type": "label", "payload": []})) == 0
+    assert proxy._pool.processors == {}
+
+
+def test_process_sends_undecodable_event_to_invalid_stream():
+    proxy = create_proxy()
+    stats = proxy.process_with_stats({"kinesis": {"data": "not-base64-json"}})
+    assert stats['error_count'] == 1
+    assert stats['retry'] is False
+    assert len(proxy._cloud_provider.invalid_payloads) == 1
+    assert proxy._pool.processors == {}
+
+
+def test_process_retries_undecodable_event_not_sent_to_invalid_stream():
+    proxy = create_proxy()
+    proxy._cloud_provider.put_in_invalid_data_stream = None
+    assert proxy.process_with_stats({"kinesis": {"data": "not-base64-json"}})['retry'] is True
+
+
+def test_process_retries_when_the_processor_fails():
+    proxy = create_proxy()
+
+    def process(event, event_message=None):
+        raise ConnectionError("DynamoDB is not available")
+
+    record_processor = proxy._pool.acquire('image', None, None)
+    record_processor.process = process
+    stats = proxy.process_with_stats(create_event({"type": "image", "payload": []}))
+    assert stats['retry'] is True
+    assert proxy._pool.released == [record_processor]
+
+
+def test_processor_is_dropped_when_the_reset_fails():
+    proxy = create_proxy()
+
+    def reset():
+        raise ConnectionError("DynamoDB is not available")
+
+    proxy._pool.acquire('image', None, None).reset = reset
+    stats = proxy.process_with_stats(create_event({"type": "image", "payload": []}))
+    assert stats['retry'] is True
+    assert proxy._pool.released == []
+
+
+def test_process_does_not_retry_errors_handled_by_the_processor():
+    proxy = create_proxy()
+
+    def process(event, event_message=None):
+        return {'processed': True, 'continue': True, 'errors': ['invalid stage file'], 'messages': [], 'retry': False}
+
+    proxy._pool.acquire('image', None, None).process = process
+    stats = proxy.process_with_stats(create_event({"type": "image", "payload": []}))
+    assert stats['error_count'] == 1
+    assert stats['retry'] is False
+
+
+def test_lazy_processor_is_imported_on_first_use():
+    class LabelProcessor(RecordProcessorBase):
+        @staticmethod
+        def types_to_be_processed():
+            return ["label"]
+
+    module = types.ModuleType('fake_label_plugin')
+    module.RawDataType = 'label'
+    module.RecordProcessor = LabelProcessor
+    sys.modules['fake_label_plugin'] = module
+    try:
+        proxy = create_proxy()
+        proxy.register_lazy_processor('label', 'fake_label_plugin', ["label"])
+        assert 'label' not in proxy._processors
+        assert proxy.process(create_event({"type": "label", "payload": []})) == 0
+        assert proxy._processors['label'] is LabelProcessor
+        assert list(proxy._pool.processors) == ['label']
+    finally:
+        del sys.modules['fake_label_plugin']
+
+
+def test_manifest_matches_the_plugins():
+    import register
+    for data_type, plugin in register.PROCESSOR_MANIFEST.items():
+        module = importlib.import_module(plugin['module'])
+        assert module.RawDataType == data_type
+        assert module.RecordProcessor.types_to_be_processed() == plugin['types']
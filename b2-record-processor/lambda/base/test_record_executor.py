@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Unit Test for the RecordBatchExecutor
+#
+
+import base64
+import json
+import threading
+import time
+
+import pytest
+
+from base.record_executor import RecordBatchExecutor, get_tag_id
+from models.event_message import AWSKinesisEventMessage
+
+
+def create_record(sequence_number, partition_key, filename=None):
+    data = base64.b64encode(json.dumps({"filename": filename}).encode('utf-8')).decode('utf-8')
+    return AWSKinesisEventMessage(
+        event_content={"kinesis": {"partitionKey": partition_key, "sequenceNumber": sequence_number, "data": data}})
+
+
+def get_sequence_number(record):
+    return record.get_event_content()['kinesis']['sequenceNumber']
+
+
+def test_get_tag_id_from_filename():
+    record = create_record("1", "key", "0438763235890056-20190423-left-191134.label")
+    assert get_tag_id(record) == "0438763235890056"
+
+
+def test_get_tag_id_from_the_path_of_the_filename():
+    record = create_record("1", "key", "aux/894f9442/2019-04-23/0438763235890056-20190423-left-191134.aux")
+    assert get_tag_id(record) == "0438763235890056"
+
+
+def test_get_tag_id_reuses_the_decoded_data():
+    record = create_record("1", "key", "0438763235890056-20190423-left-191134.label")
+    decoded = record.get_event_data_decoded()
+    get_tag_id(record)
+    assert record.get_event_data_decoded() is decoded
+
+
+def test_get_tag_id_falls_back_to_partition_key():
+    record = AWSKinesisEventMessage(event_content={"kinesis": {"partitionKey": "key", "data": "invalid"}})
+    assert get_tag_id(record) == "key"
+
+
+def test_invalid_ordering_key():
+    with pytest.raises(ValueError):
+        RecordBatchExecutor(lambda r: r, ordering_key='unknown')
+
+
+def test_run_keeps_the_order_of_the_results():
+    records = [create_record(str(i), f"key-{i % 3}") for i in range(10)]
+    executor = RecordBatchExecutor(get_sequence_number, max_workers=4)
+    assert executor.run(records) == [str(i) for i in range(10)]
+
+
+def test_run_keeps_records_with_the_same_key_in_order():
+    lock = threading.Lock()
+    running = set()
+    processed = []
+
+    def process_record(record):
+        key = record.get_event_partition_key()
+        with lock:
+            assert key not in running
+            running.add(key)
+        time.sleep(0.01)
+        with lock:
+            running.remove(key)
+            processed.append(get_sequence_number(record))
+        return get_sequence_number(record)
+
+    records = [create_record(str(i), f"key-{i % 2}") for i in range(8)]
+    RecordBatchExecutor(process_record, max_workers=4).run(records)
+    assert [s for s in processed if int(s) % 2 == 0] == ['0', '2', '4', '6']
+    assert [s for s in processed if int(s) % 2 == 1] == ['1', '3', '5', '7']
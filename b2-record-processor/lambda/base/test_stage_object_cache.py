@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Unit Test for the StageObjectCache
+#
+
+import io
+import os
+
+from base.stage_object_cache import StageObjectCache
+from models.stage_file import SpooledStageContent, spool_stream
+
+
+def test_get_returns_the_cached_version(tmp_path):
+    cache = StageObjectCache(directory=str(tmp_path), max_bytes=100)
+    assert cache.get_etag('bucket', 'a.csv.gz') is None
+    cache.put('bucket', 'a.csv.gz', '"etag-1"', b'content')
+    assert cache.get_etag('bucket', 'a.csv.gz') == '"etag-1"'
+    assert cache.get('bucket', 'a.csv.gz', '"etag-1"') == b'content'
+    assert cache.get('bucket', 'a.csv.gz', '"etag-2"') is None
+    assert cache.get('other-bucket', 'a.csv.gz', '"etag-1"') is None
+    assert cache.get_stats() == {'hits': 1, 'misses': 1, 'evictions': 0, 'objects': 1, 'bytes': 7}
+
+
+def test_put_replaces_the_previous_version(tmp_path):
+    cache = StageObjectCache(directory=str(tmp_path), max_bytes=100)
+    cache.put('bucket', 'a.csv.gz', '"etag-1"', b'first')
+    cache.put('bucket', 'a.csv.gz', '"etag-2"', b'second')
+    assert cache.get('bucket', 'a.csv.gz', '"etag-1"') is None
+    assert cache.get('bucket', 'a.csv.gz', '"etag-2"') == b'second'
+    assert cache.size == 6
+    assert len(os.listdir(str(tmp_path))) == 1
+
+
+def test_least_recently_used_objects_are_evicted(tmp_path):
+    cache = StageObjectCache(directory=str(tmp_path), max_bytes=10)
+    cache.put('bucket', 'a', 'etag', b'aaaa')
+    cache.put('bucket', 'b', 'etag', b'bbbb')
+    assert cache.get('bucket', 'a', 'etag') == b'aaaa'
+    cache.put('bucket', 'c', 'etag', b'cccc')
+    assert cache.get('bucket', 'b', 'etag') is None
+    assert cache.get('bucket', 'a', 'etag') == b'aaaa'
+    assert cache.get('bucket', 'c', 'etag') == b'cccc'
+    assert cache.get_stats()['evictions'] == 1
+    assert cache.size == 8
+
+
+def test_objects_bigger_than_the_cache_are_not_cached(tmp_path):
+    cache = StageObjectCache(directory=str(tmp_path), max_bytes=4)
+    cache.put('bucket', 'a', 'etag', b'too big')
+    assert cache.get_etag('bucket', 'a') is None
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_cached_objects_are_indexed_by_a_new_cache(tmp_path):
+    cache = StageObjectCache(directory=str(tmp_path), max_bytes=100)
+    cache.put('bucket', 'a', '"3858f62230ac3c915f300c664312c11f-2"', b'content')
+    (tmp_path / 'partial.tmp').write_bytes(b'partial')
+    reloaded = StageObjectCache(directory=str(tmp_path), max_bytes=100)
+    assert reloaded.get('bucket', 'a', '"3858f62230ac3c915f300c664312c11f-2"') == b'content'
+    assert reloaded.size == 7
+    assert not (tmp_path / 'partial.tmp').exists()
+
+
+def test_big_objects_are_linked_instead_of_read(tmp_path):
+    cache = StageObjectCache(directory=str(tmp_path / 'cache'), max_bytes=100, memory_max_bytes=4)
+    spooled = spool_stream(io.BytesIO(b'big content'))
+    cache.put('bucket', 'a.csv.gz', '"etag-1"', spooled)
+    spooled.discard()
+    assert cache.size == 11
+    content = cache.get('bucket', 'a.csv.gz', '"etag-1"')
+    assert isinstance(content, SpooledStageContent)
+    with open(content.path, 'rb') as f:
+        assert f.read() == b'big content'
+    content.discard()
+    cache.put('bucket', 'b.csv.gz', '"etag-1"', b'abc')
+    assert cache.get('bucket', 'b.csv.gz', '"etag-1"') == b'abc'
+    assert len(os.listdir(str(tmp_path / 'cache'))) == 2
@@ -3,17 +3,21 @@
 # 
 # Created by: Farzad Khandan (farzadkhandan@ecoation.com)
 #
+import os
+
 from base.cloud_provider import CloudProviderFactory
 from base.proxy import RecordProcessorProxy
 
 from providers.aws import aws
+from providers.local import local
 
-# System cloud provider
-CLOUD_PROVIDER_NAME = 'aws'
+# System cloud provider (aws|local)
+CLOUD_PROVIDER_NAME = os.getenv("CLOUD_PROVIDER", 'aws')
 
 # Cloud Providers
 # register new cloud providers here
 CloudProviderFactory.register('aws', aws)
+CloudProviderFactory.register('local', local)
 
 # Cloud configuration
 SYS_CLOUD_PROVIDER = CloudProviderFactory.get_provider(CLOUD_PROVIDER_NAME)
@@ -10,6 +10,8 @@ import s3fs
 
 s3_input_file_key_re =  re.compile(r'^s3://(?P<s3_bucket_name>[^/]+)/(?P<s3_file_key>(?P<base_folder>.*/datatype=(?P<file_type>\w+))/(?P<filename>[^/]+))')
 fs = s3fs.S3FileSystem()
+# With the local cloud provider the stage files are read from tests/stage_files, nothing is uploaded to S3
+LOCAL_CLOUD_PROVIDER = os.getenv("CLOUD_PROVIDER", 'aws') == 'local'
 
 
 def extract_s3_file_info(s3_file_path):
@@ -25,6 +27,8 @@ def format_local_file_name_path(base_folder, file_name):
 
 
 def upload_file(stage_file_path):
+    if LOCAL_CLOUD_PROVIDER:
+        return
     s3_file_info = extract_s3_file_info(stage_file_path)
     local_file_path = format_local_file_name_path(base_folder=(s3_file_info["file_type"] or s3_file_info["base_folder"]),
                                                   file_name=s3_file_info["filename"])
@@ -156,7 +160,7 @@ def stage_files_event_generator(only_names=False, file_type_filter=None):
     stage_files_folder = re.sub(r'^(.*/b2-record-processor)/.*$', r'\1', os.getcwd())
     stage_files_folder = Path(stage_files_folder, 'tests', 'stage_files')
     s3_stage_files_folder = f's3://eis-b2-staging-data-dev/unittest-record-processor/'
-    if not only_names:
+    if not only_names and not LOCAL_CLOUD_PROVIDER:
         subprocess.call(['aws', 's3', 'sync', stage_files_folder, s3_stage_files_folder])
     stage_file_pattern = re.compile(r'^.*/stage_files/.*datatype=(?P<file_key>(?P<file_type>[^/]+).*/[^/]+$)')
     stage_files_list = [item.as_posix() for item in stage_files_folder.glob('**/*.*') if item.as_posix().find('/.')<0]
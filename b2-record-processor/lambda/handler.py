@@ -3,20 +3,70 @@
 #
 # @author: Farzad Khandan (fazrdkhandan@ecoation.com)
 #
+import os
+
 import config
 from helpers import get_logger
 import register
+from base.proxy import RECORD_STATS_KEYS
+from base.record_executor import RecordBatchExecutor, ORDERING_KEY_PARTITION_KEY
 from models import b_log
+from models.record_processor import STAGE_FILE_WORKERS
 b_log.init(b_log.PROCESS_RECORD_PROCESSOR)
 
 register.register_processors()
 logger = get_logger(__name__)
 
+# Number of records processed at the same time, 1 processes the records sequentially
+RECORD_PROCESSOR_MAX_WORKERS = int(os.getenv("RECORD_PROCESSOR_MAX_WORKERS", 1))
+# The stage file workers are forked, which needs a single thread in the lambda process
+if STAGE_FILE_WORKERS > 1 and RECORD_PROCESSOR_MAX_WORKERS > 1:
+    logger.warning(f"RECORD_PROCESSOR_MAX_WORKERS={RECORD_PROCESSOR_MAX_WORKERS} is ignored, the records are "
+                   f"processed sequentially with STAGE_FILE_WORKERS={STAGE_FILE_WORKERS}.")
+    RECORD_PROCESSOR_MAX_WORKERS = 1
+# Records with the same key are processed in order (partition_key|tag_id)
+RECORD_PROCESSOR_ORDERING_KEY = os.getenv("RECORD_PROCESSOR_ORDERING_KEY", ORDERING_KEY_PARTITION_KEY)
+
+
+# Process a single Kinesis record (StreamEventMessage) and returns its stats
+def process_record(event_message):
+    try:
+        r = event_message.get_event_content()
+        if not r.get('kinesis',{}).get('data', ''):
+            raise KeyError("The kinesis/data was not found.")
+        return config.SYS_PROXY.process_with_stats(r, event_message=event_message)
+    except Exception as ex:
+        logger.error("An error occured while processing the event: %s", str(ex))
+        record_stats = dict.fromkeys(RECORD_STATS_KEYS, 0)
+        record_stats['error_count'] = 1
+        record_stats['exception'] = True
+        record_stats['retry'] = True
+        return record_stats
+
+
+# Returns the Kinesis sequence number of the record
+def get_sequence_number(r):
+    return r.get('kinesis', {}).get('sequenceNumber', '')
+
+
+# Returns the records that must be retried by Lambda, in the shape of a partial batch response
+# The errors already sent to the invalid stream are not retried (they would fail again), only the records
+# flagged with 'retry' and the ones without result (the batch was interrupted) are reported as failures
+def get_batch_item_failures(records, results):
+    batch_item_failures = []
+    for r, record_stats in zip(records, results):
+        if record_stats is None or record_stats.get('retry'):
+            batch_item_failures.append({'itemIdentifier': get_sequence_number(r)})
+    return batch_item_failures
+
 
 def lambda_handler(event, context):
     message = "FAILED"
     records_processed = 0
     exception_count = 0
+    records_stats = dict.fromkeys(RECORD_STATS_KEYS, 0)
+    records = []
+    results = []
 
     try:
         print(f"event: {event}")
@@ -25,22 +75,28 @@ def lambda_handler(event, context):
             logger.error("Invalid event: %s", str(event))
             return
 
-        for r in event['Records']:
+        records = event['Records']
+        results = [None] * len(records)
+        executor = RecordBatchExecutor(process_record,
+                                       max_workers=RECORD_PROCESSOR_MAX_WORKERS,
+                                       ordering_key=RECORD_PROCESSOR_ORDERING_KEY)
+        results = executor.run([config.SYS_CLOUD_PROVIDER.create_event_message(r) for r in records])
+        for record_stats in results:
             records_processed += 1
-            try:
-                if not r.get('kinesis',{}).get('data', ''):
-                    raise KeyError("The kinesis/data was not found.")
-                process_result = config.SYS_PROXY.process(r)
-            except Exception as ex:
-                process_result = 1
+            if record_stats.get('exception'):
                 exception_count += 1
-                logger.error("An error occured while processing the event: %s", str(ex))
-            exception_count += process_result
+            exception_count += record_stats['error_count']
+            for key in RECORD_STATS_KEYS:
+                records_stats[key] += record_stats[key]
         message = "OK"
     finally:
         return {
             'message': message,
             'records_processed': records_processed,
-            'exception_count': exception_count
+            'exception_count': exception_count,
+            'records_stats': records_stats,
+            'processor_pool': config.SYS_PROXY.get_pool_stats(),
+            'stage_cache': config.SYS_CLOUD_PROVIDER.get_stage_cache_stats(),
+            'batchItemFailures': get_batch_item_failures(records, results)
         }
 
@@ -1,10 +1,20 @@
+import decimal
+import json
+import math
 import traceback
 
+try:
+    import orjson
+except ImportError:  # orjson is in requirements.txt, the json module is used by an environment without it
+    orjson = None
+
 # from base.log_handler import ElasticSearchHandler
 from models import b_log
 
 UNDEFINED = '<undefined>'
 SYSTEM_LOGGER = b_log.BackendLoggerWrapper()
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY if orjson else 0
+JSON_SEPARATORS = (',', ':')
 # ELASTIC_SEARCH_HANDLER = ElasticSearchHandler()
 # ELASTIC_SEARCH_HANDLER.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
 
@@ -66,3 +76,44 @@ def json_validate(instance, schema):
 
 def cast_to_int(value):
     return int(float(str(value)))
+
+
+# Converts the values which are not JSON types: Decimal (DynamoDB), numpy scalars and arrays, sets
+def json_default(value):
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value.is_finite() and value == value.to_integral_value() else float(value)
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+
+
+# NaN and infinity are not JSON, they are encoded as null (like orjson does)
+def replace_nan(value):
+    if isinstance(value, decimal.Decimal) or hasattr(value, 'tolist'):
+        value = json_default(value)
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: replace_nan(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [replace_nan(item) for item in value]
+    return value
+
+
+def dumps_json(value):
+    """Compact JSON string of value, encoded by orjson when it is installed and by json otherwise.
+
+    Both give the same output: UTF-8 characters are not escaped, NaN is null and json_default converts the other types.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, default=json_default, option=ORJSON_OPTIONS).decode('utf-8')
+        except orjson.JSONEncodeError:
+            pass  # e.g. the integers bigger than 64 bits, the error is raised again by json if it is not supported
+    try:
+        return json.dumps(value, default=json_default, separators=JSON_SEPARATORS, ensure_ascii=False, allow_nan=False)
+    except ValueError:
+        return json.dumps(replace_nan(value), default=json_default, separators=JSON_SEPARATORS, ensure_ascii=False,
+                          allow_nan=False)
@@ -137,10 +137,18 @@ class StreamMessageExtraContent:
 class StreamEventMessage(ABC):
 
     _content = None
+    _decoded = None
 
     def __init__(self, event_content: str):
         self._content = event_content
 
+    def get_event_content(self):
+        return self._content
+
+    @abstractmethod
+    def get_event_partition_key(self):
+        """partition key of the record in the stream"""
+
     @abstractmethod
     def get_event_data_encoded(self):
         """data in the base64 format"""
@@ -354,14 +362,19 @@ class InvalidStreamMessage:
 
 class AWSKinesisEventMessage(StreamEventMessage):
 
+    def get_event_partition_key(self):
+        return self._content.get("kinesis", {}).get("partitionKey", "")
+
     def get_event_data_encoded(self):
         #logger.debug(type(self._content))
         return self._content["kinesis"]["data"]
 
     def get_event_data_decoded(self):
-        return json.loads(
-            base64.b64decode(
-                self.get_event_data_encoded()).decode('utf-8'))
+        if self._decoded is None:
+            self._decoded = json.loads(
+                base64.b64decode(
+                    self.get_event_data_encoded()).decode('utf-8'))
+        return self._decoded
 
     def get_event_timestamp_epoch(self):
         return self._content["kinesis"]["approximateArrivalTimestamp"]
@@ -5,13 +5,19 @@
 # Modified by: Fernando Mangussi <fernando@ecoation.com>
 #
 
+import collections
+import copy
 import inspect
+import itertools
 import json
+import multiprocessing
 import os
 import re
+import threading
 import traceback
 import uuid
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
 from typing import Optional
 
@@ -21,6 +27,7 @@ from dateutil import tz
 import datamodule.farm_model as farm
 import datamodule.machine_model as machine_model
 import datamodule.phase_model as phase
+from base.cloud_provider import discard_content
 from base.processor import ProcessorBase
 from helpers import (
     system_log_error,
@@ -36,7 +43,8 @@ from models.event_message import (
     StreamEventMessage,
     InvalidStreamMessage,
     RecordProcessStreamMessage)
-from models.stage_file import StageCSVReaderFile, StageCSVWriterFile
+from models.stage_file import (StageCSVReaderFile, StageCSVWriterFile, create_stage_writer, get_stage_file_extension,
+                               open_stage_reader)
 
 BASE_NAME_V1 = r"/(?P<tag_id>[^-]+)-(?P<timestamp>[^-]+)-(?P<extra_info>[^-]+)-(?P<identifier>.{6})\.(?P<fileextension>.*$)"
 BASE_NAME_V2 = r'/(?P<tag_id>[^-]+)-(?P<rsid>[^-]+)-(?P<timestamp>[^-]+)-(?P<extra_info>[^-]+)-(?P<identifier>.{6})\.(?P<fileextension>.*$)'
@@ -50,6 +58,40 @@ RE_KEY_FILENAME_V3 = re.compile(r'^.*/(?P<file_type>[\w-]+)' + BASE_NAME_V2)
 RE_KEY_FILENAME_MODELS_V1 = re.compile(
     r'/(?P<file_type>[^/]+)/(?P<phase_id>[^/]+)/(?P<row_number>[^/]+)/(?P<rsid>[^/]+)/[^.]+\.(?P<fileextension>.*$)')
 
+# Attributes of the PhaseModel holding its boto3 DynamoDB resources, kept when the phase model is reset
+PHASE_MODEL_HELPERS = ('_ph', '_sc')
+
+# Number of processes used to transform a stage file, 1 transforms the stage file in the lambda process.
+# The workers are forked, so they are only used while the lambda process runs a single thread: with more than one
+# worker the stage files are neither fetched nor prefetched ahead, the output is uploaded once it is closed and the
+# handler processes the records sequentially (STAGE_FILE_PREFETCH, STAGE_FETCH_MAX_WORKERS, STAGE_UPLOAD_PART_BYTES
+# and RECORD_PROCESSOR_MAX_WORKERS are ignored)
+STAGE_FILE_WORKERS = int(os.getenv("STAGE_FILE_WORKERS", 1))
+# Stage files with less lines than this are always transformed in the lambda process
+STAGE_FILE_PARALLEL_MIN_LINES = int(os.getenv("STAGE_FILE_PARALLEL_MIN_LINES", 5000))
+# Number of stage files downloaded and parsed ahead by a background thread, 0 opens each file when it is processed
+STAGE_FILE_PREFETCH = int(os.getenv("STAGE_FILE_PREFETCH", 0))
+# No more stage files are fetched or prefetched while the ones fetched or opened ahead use more memory than this
+# (the stage files bigger than STAGE_FILE_MEMORY_MAX_BYTES are fetched in a spool file on /tmp)
+STAGE_FILE_PREFETCH_MAX_BYTES = int(os.getenv("STAGE_FILE_PREFETCH_MAX_BYTES", 256 * 1024 * 1024))
+# Number of stage files of a message downloaded concurrently, 1 lets each stage file reader download its file
+STAGE_FETCH_MAX_WORKERS = int(os.getenv("STAGE_FETCH_MAX_WORKERS", 8))
+# Format of the stage files created by the record processor: csv or parquet (needs pyarrow)
+STAGE_OUTPUT_FORMAT = os.getenv("STAGE_OUTPUT_FORMAT", "csv")
+# Compression of the stage files created by the record processor: none, gzip or zstd (needs zstandard)
+STAGE_OUTPUT_COMPRESSION = os.getenv("STAGE_OUTPUT_COMPRESSION", "none")
+# The stage file created by the record processor rolls over to a new part after this number of lines or bytes
+# (CSV before compression), 0 for no limit
+STAGE_OUTPUT_MAX_LINES = int(os.getenv("STAGE_OUTPUT_MAX_LINES", 0))
+STAGE_OUTPUT_MAX_BYTES = int(os.getenv("STAGE_OUTPUT_MAX_BYTES", 0))
+
+
+class StageOutputError(Exception):
+    """The output stage file could not be written, closed or uploaded: the whole message fails.
+
+    It is not handled as an error of the input line or stage file being transformed.
+    """
+
 
 class RecordProcessorBase(ProcessorBase):
     """Record processor class
@@ -58,6 +100,17 @@ class RecordProcessorBase(ProcessorBase):
     """
 
     post_length = {}
+    stage_file_workers = STAGE_FILE_WORKERS
+    stage_file_parallel_min_lines = STAGE_FILE_PARALLEL_MIN_LINES
+    stage_output_format = STAGE_OUTPUT_FORMAT
+    stage_output_compression = None if STAGE_OUTPUT_COMPRESSION == "none" else STAGE_OUTPUT_COMPRESSION
+    stage_output_max_lines = STAGE_OUTPUT_MAX_LINES
+    stage_output_max_bytes = STAGE_OUTPUT_MAX_BYTES
+    stage_fetch_workers = STAGE_FETCH_MAX_WORKERS
+    stage_file_prefetch = STAGE_FILE_PREFETCH
+    stage_file_prefetch_max_bytes = STAGE_FILE_PREFETCH_MAX_BYTES
+    # When columns_to_be_read() is not None, the other columns are read as raw strings instead of being skipped
+    read_other_columns_raw = False
     # common attributes
     cartesian_location: property
     crops: property
@@ -106,8 +159,12 @@ class RecordProcessorBase(ProcessorBase):
         self.stage_files_rejected_count = 0
         self.output_lines_created = 0
         self._error_messages = []
+        self._retry_record = False
         self.update_properties()
         self._OB_PHASE = phase.PhaseModel()
+        # Attributes of a new PhaseModel, restored before each record (the DynamoDB helpers are kept)
+        self._phase_model_defaults = copy.deepcopy(
+            {key: value for key, value in vars(self._OB_PHASE).items() if key not in PHASE_MODEL_HELPERS})
         self.OB_FARM = farm.FarmModel()
         self.OB_MACHINE = machine_model.MachineModel()
         self._machine = None
@@ -131,6 +188,7 @@ class RecordProcessorBase(ProcessorBase):
         self._is_event_invalid = False
         self._invalid_event_content = None
         self._stage_file = None
+        self._stage_destination_path = None
         self._row = None
         self._farm_zone = None
         self._timestamp_conversion_cache = None
@@ -245,10 +303,12 @@ class RecordProcessorBase(ProcessorBase):
     def current_payload(self, value):
         self._current_payload = value
 
-    @staticmethod
-    def open_stage_file(filepath) -> StageCSVReaderFile:
+    def open_stage_file(self, filepath, content=None) -> StageCSVReaderFile:
         try:
-            return StageCSVReaderFile(filepath=filepath)
+            return open_stage_reader(filepath=filepath,
+                                     columns=self.columns_to_be_read(),
+                                     read_other_columns_raw=self.read_other_columns_raw,
+                                     content=content)
         except Exception as error:
             raise ValueError("Error while opening the stage file. Details %s" % error)
 
@@ -272,6 +332,18 @@ class RecordProcessorBase(ProcessorBase):
             return ["<type_of_file>"]
         """
 
+    @staticmethod
+    def columns_to_be_read():
+        """Columns of the stage files used by the record processor, the other columns are not parsed.
+
+        Returns:
+            list: list of column names, or None to read all the columns (default)
+
+        Example:
+            return ["location", "time", "image_file_path"]
+        """
+        return None
+
     def log_error(self, method, arguments, error_message):
         try:
             error_message = f"{self.__class__.__name__} - {error_message}"
@@ -321,6 +393,8 @@ class RecordProcessorBase(ProcessorBase):
             'continue': self.get_continue(),
             # Return all the error messages here, the Proxy will log them
             'errors': self.error_messages,
+            # If the errors could not be sent to the invalid stream, the record must be retried
+            'retry': self._retry_record,
             # Return all the DEBUG messages here, the Proxy will log them
             'messages': [],  # self.debug_messages
             'output_lines_created': self.output_lines_created,
@@ -333,6 +407,7 @@ class RecordProcessorBase(ProcessorBase):
 
     def clean_stats(self):
         self._is_event_invalid = False
+        self._retry_record = False
         self._error_messages = []
         self._debug_messages = []
         self._stage_files = []
@@ -349,6 +424,45 @@ class RecordProcessorBase(ProcessorBase):
         self._outgoing_timestamp = None
         self._farm_zone = None
 
+    def reset(self):
+        """Reset the per-record state.
+
+        The instances are reused across records by the RecordProcessorPool, so everything
+        collected while processing the previous record must be cleaned before processing
+        a new one. The Phase, Farm and Machine models are kept, only the phase loaded by
+        the previous record is discarded.
+        """
+        self.clean_stats()
+        self.stage_files_processed_count = 0
+        self.stage_files_total = 0
+        self.input_lines_rejected_count = 0
+        self.input_lines_tbd_rejected_count = 0
+        self.stage_files_rejected_count = 0
+        self.output_lines_created = 0
+        self._machine = None
+        self._event_message = None
+        self._stream_message = None
+        self._processed_status = False
+        self._row_session_id = None
+        self._invalid_event_content = None
+        self._stage_file = None
+        self._stage_destination_path = None
+        self._row = None
+        self._timestamp_conversion_cache = None
+        self._incoming_timestamp = None
+        self._current_payload = None
+        self._file_match = None
+        self._uuid_hash = str(uuid.uuid1())
+        self.reset_phase_model()
+
+    # Restores the phase model to the state of a new PhaseModel, without building its DynamoDB helpers again
+    def reset_phase_model(self):
+        attributes = vars(self._OB_PHASE)
+        helpers = {key: attributes[key] for key in PHASE_MODEL_HELPERS if key in attributes}
+        attributes.clear()
+        attributes.update(copy.deepcopy(self._phase_model_defaults))
+        attributes.update(helpers)
+
     def invalidate_event(self, event, error, stack):
         self._is_event_invalid = True
         if self.stream_message:
@@ -387,19 +501,41 @@ class RecordProcessorBase(ProcessorBase):
 
     def get_stage_file(self):
         if not self._stage_file:
-            self._stage_file = StageCSVWriterFile(filename=os.path.basename(self.stream_message.filename))
+            # The stage file is uploaded while it is written when the cloud provider supports it
+            self._stage_destination_path = self._get_stage_destination_path('record-processor')
+            upload = None if self.uses_stage_file_workers() else self.cloud_provider.open_stage_upload(
+                self.cloud_provider.format_stage_filename(self._stage_destination_path))
+            self._stage_file = create_stage_writer(filename=os.path.basename(self.stream_message.filename),
+                                                   file_format=self.stage_output_format,
+                                                   compression=self.stage_output_compression,
+                                                   upload=upload)
         return self._stage_file
 
+    # Aborts the upload of a stage file which will not be closed and deletes its parts already uploaded, so no part
+    # of a failed message is left in the stage bucket
+    def discard_stage_file(self):
+        if self._stage_file:
+            self._stage_file.discard()
+        for destination_path in self._stage_files:
+            cloud_filepath = self.cloud_provider.format_stage_filename(destination_path)
+            try:
+                self.cloud_provider.delete_stage_object(cloud_filepath)
+            except Exception as error:
+                self.log_warning(f"The stage file {cloud_filepath} could not be deleted. Details: {error}")
+        self._stage_files = []
+
     @property
     def uuid_hash(self):
         return self._uuid_hash
 
     def _get_stage_destination_path(self, processor_name):
-        return f'''{processor_name}/process_date={date.today().isoformat()}/datatype={self.get_record_type()}/{os.path.basename(self.stream_message.filename)}__{uuid.uuid1()}.csv'''
+        return f'''{processor_name}/process_date={date.today().isoformat()}/datatype={self.get_record_type()}/{os.path.basename(self.stream_message.filename)}__{uuid.uuid1()}.{get_stage_file_extension(self.stage_output_format, self.stage_output_compression)}'''
 
-    def close_stage_file(self, stage_writer: StageCSVWriterFile):
+    def close_stage_file(self, stage_writer: Optional[StageCSVWriterFile]):
+        if stage_writer is None:
+            return
         try:
-            destination_path = self._get_stage_destination_path('record-processor')
+            destination_path = self._stage_destination_path or self._get_stage_destination_path('record-processor')
             cloud_filepath = self.cloud_provider.format_stage_filename(destination_path)
             self.log_info(f"uploading the stage file {cloud_filepath}.")
             # print("stage_writer:", stage_writer)
@@ -407,18 +543,45 @@ class RecordProcessorBase(ProcessorBase):
                 self.log_info(f"stage file is empty.")
                 return
             stage_writer.close()
-            self._cloud_provider.upload_stage_content(data_frame=stage_writer.data_frame,
-                                                      destination_path=cloud_filepath)
+            if not stage_writer.is_uploaded:
+                self._cloud_provider.upload_stage_content(content_file=stage_writer.file,
+                                                          destination_path=cloud_filepath)
             self._stage_files.append(destination_path)
         except Exception as error:
             traceback.print_tb(error.__traceback__)
             raise
+        finally:
+            stage_writer.discard()
         return destination_path
 
     def write_to_stage(self, output):
         if output:
             stage_writer = self.get_stage_file()
-            stage_writer.write(output)
+            try:
+                stage_writer.write(output)
+            except Exception as error:
+                if stage_writer.is_upload_aborted:
+                    raise StageOutputError(f"Error while uploading the stage file. Details: {error}") from error
+                raise
+            if self.is_stage_file_full(stage_writer):
+                try:
+                    self.roll_over_stage_file()
+                except Exception as error:
+                    raise StageOutputError(f"Error while closing a part of the stage file. Details: {error}") from error
+
+    def is_stage_file_full(self, stage_writer: StageCSVWriterFile):
+        return (0 < self.stage_output_max_lines <= stage_writer.lines_count
+                or 0 < self.stage_output_max_bytes <= stage_writer.content_size)
+
+    # Closes the current part of the stage file, the next output starts a new part
+    # All the parts are listed in the payload sent to the processed data stream
+    def roll_over_stage_file(self):
+        self.log_info(f"The stage file reached {self._stage_file.lines_count} lines, starting a new part.")
+        try:
+            self.close_stage_file(self._stage_file)
+        finally:
+            self._stage_file = None
+            self._stage_destination_path = None
 
     @abstractmethod
     def create_message_payload(self, payload) -> iter:
@@ -495,6 +658,8 @@ class RecordProcessorBase(ProcessorBase):
             self.cloud_provider.put_in_invalid_data_stream(payload=content)
             self.log_info(f"send_to_invalid_data_stream: 1\n{json.dumps(content)}")
         except Exception as error:
+            # The record is retried, as its error was not recorded anywhere
+            self._retry_record = True
             traceback.print_tb(error.__traceback__)
             self.log_error(
                 method=inspect.stack()[0][3],
@@ -539,23 +704,160 @@ class RecordProcessorBase(ProcessorBase):
         self.log_info(
             f"Error while creating the output payload. Details: input_line:[{str(input_line)}] error:[{str(error)}]")
 
-    def create_output_payload(self, input_stage_file: StageCSVReaderFile, filepath):
+    def transform_input_lines(self, input_lines, write, first_line_number=0):
+        """Transform the input lines of a stage file into output lines.
+
+        :param input_lines: iter, the input lines
+        :param write: function called with each output line
+        :param first_line_number: int, number of lines of the stage file before the input lines
+        :return: (number of input lines, number of output lines, set of tag ids)
+        """
         input_lines_count = 0
         output_lines_count = 0
         tag_id_list = set()
         input_line: dict
-        for input_line in input_stage_file:
+        for input_line in input_lines:
             try:
                 self.current_payload = input_line
                 tag_id_list.add(self.get_tag_id())
                 input_lines_count += 1
-                if input_lines_count % 10000 == 0:
-                    self.log_info(f"Processing {self.get_record_type()} content: {input_lines_count} processed.")
+                if (first_line_number + input_lines_count) % 10000 == 0:
+                    self.log_info(f"Processing {self.get_record_type()} content: {first_line_number + input_lines_count} processed.")
                 for output in self.create_message_payload(input_line):
                     output_lines_count += 1
-                    self.write_to_stage(output)
+                    write(output)
+            except StageOutputError:
+                raise
             except Exception as error:
-                self.on_line_output_exception(input_line, input_lines_count, error)
+                self.on_line_output_exception(input_line, first_line_number + input_lines_count, error)
+        return input_lines_count, output_lines_count, tag_id_list
+
+    # The stage file workers are forked, so the processor starts no thread (fetch, prefetch, upload) when they are used
+    def uses_stage_file_workers(self):
+        return self.stage_file_workers > 1
+
+    def is_parallel_transformation(self, input_stage_file: StageCSVReaderFile):
+        if self.stage_file_workers <= 1 or not input_stage_file.has_lines(self.stage_file_parallel_min_lines):
+            return False
+        # A forked process only gets the calling thread, the locks held by the other threads (logging, boto3
+        # connection pools, ...) would never be released in the workers
+        if threading.active_count() > 1:
+            self.log_warning(f"The stage file is transformed in the lambda process, {threading.active_count()} "
+                             f"threads are running (STAGE_FILE_WORKERS needs a single thread).")
+            return False
+        return True
+
+    def prepare_parallel_transformation(self, input_stage_file: StageCSVReaderFile):
+        """Resolve the context of the stage file (row, phase, farm zone) before forking the workers.
+
+        The workers inherit the resolved values, so they do not query DynamoDB for each chunk.
+        Errors are ignored here, the workers raise them again for each input line like the serial mode.
+        """
+        try:
+            for input_line in input_stage_file:
+                self.current_payload = input_line
+                break
+            self.get_customer_id()
+            if self.get_tag_id().upper() != "TBD":
+                self.get_row()
+                self.get_farm_id()
+                self.get_phase_id()
+                self.get_side()
+                self.get_row_number()
+                self.get_crops()
+                self.get_farm_zone()
+        except Exception as error:
+            self.log_info(f"The stage file context could not be resolved before the transformation. Details: {error}")
+        finally:
+            self.current_payload = None
+            input_stage_file.seek(-1)
+
+    def transform_chunk(self, input_stage_file: StageCSVReaderFile, start, end, connection):
+        """Worker process: transform the input lines [start, end) (to the end of the file when end is None) and
+        send the outputs to the parent. The lines before start are skipped without being decoded.
+        """
+        try:
+            error_messages_count = len(self._error_messages)
+            input_lines_rejected_count = self.input_lines_rejected_count
+            input_lines_tbd_rejected_count = self.input_lines_tbd_rejected_count
+            outputs = []
+            input_stage_file.read_from(start)
+            input_lines_count, output_lines_count, tag_id_list = self.transform_input_lines(
+                input_lines=itertools.islice(input_stage_file, None if end is None else end - start),
+                write=outputs.append,
+                first_line_number=start)
+            connection.send({
+                'input_lines_count': input_lines_count,
+                'output_lines_count': output_lines_count,
+                'tag_id_list': tag_id_list,
+                'outputs': outputs,
+                'error_messages': [str(message) for message in self._error_messages[error_messages_count:]],
+                'input_lines_rejected': self.input_lines_rejected_count - input_lines_rejected_count,
+                'input_lines_tbd_rejected': self.input_lines_tbd_rejected_count - input_lines_tbd_rejected_count,
+            })
+        except Exception as error:
+            connection.send({'error': f"{error.__class__.__name__}: {error}"})
+        finally:
+            connection.close()
+
+    def transform_stage_file_parallel(self, input_stage_file: StageCSVReaderFile):
+        """Transform the stage file in chunks of lines using forked worker processes.
+
+        multiprocessing.Pool and Queue need /dev/shm, which is not available on AWS Lambda,
+        so each chunk has its own Process and Pipe. The outputs are written in the order of the chunks.
+        The chunks are split on the number of line breaks (the file is not parsed to count its lines), the last
+        one is read to the end of the file.
+        """
+        self.prepare_parallel_transformation(input_stage_file)
+        size = max(input_stage_file.estimate_size(), 1)
+        chunk_size = -(-size // self.stage_file_workers)
+        context = multiprocessing.get_context('fork')
+        workers = []
+        try:
+            for start in range(0, size, chunk_size):
+                end = start + chunk_size if start + chunk_size < size else None
+                receiver, sender = context.Pipe(duplex=False)
+                worker = context.Process(target=self.transform_chunk,
+                                         args=(input_stage_file, start, end, sender))
+                worker.start()
+                sender.close()
+                workers.append((worker, receiver))
+
+            input_lines_count = 0
+            output_lines_count = 0
+            tag_id_list = set()
+            for worker, receiver in workers:
+                try:
+                    result = receiver.recv()
+                except EOFError:
+                    raise Exception(f"The stage file worker exited without result. Exit code: {worker.exitcode}")
+                if 'error' in result:
+                    raise Exception(f"Error while transforming the stage file chunk. Details: {result['error']}")
+                for output in result['outputs']:
+                    self.write_to_stage(output)
+                input_lines_count += result['input_lines_count']
+                output_lines_count += result['output_lines_count']
+                tag_id_list.update(result['tag_id_list'])
+                self._error_messages.extend(result['error_messages'])
+                self.input_lines_rejected_count += result['input_lines_rejected']
+                self.input_lines_tbd_rejected_count += result['input_lines_tbd_rejected']
+        finally:
+            for worker, receiver in workers:
+                receiver.close()
+                worker.join(timeout=1)
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+        return input_lines_count, output_lines_count, tag_id_list
+
+    def create_output_payload(self, input_stage_file: StageCSVReaderFile, filepath):
+        if self.is_parallel_transformation(input_stage_file):
+            self.log_info(f"Transforming {input_stage_file.filepath} with {self.stage_file_workers} processes.")
+            input_lines_count, output_lines_count, tag_id_list = self.transform_stage_file_parallel(input_stage_file)
+        else:
+            input_lines_count, output_lines_count, tag_id_list = self.transform_input_lines(
+                input_lines=input_stage_file,
+                write=self.write_to_stage)
         self.log_info(f"Processing {self.get_record_type()} content: {input_lines_count} processed.")
 
         if "TBD" in tag_id_list:
@@ -572,11 +874,12 @@ class RecordProcessorBase(ProcessorBase):
                     f"The Tag ID <<{tag_id}>> didn't match with the same Tag ID in the filename <<{filename_tag_id}>>. Details: filepath:{filepath}")
         return output_lines_count
 
-    def process(self, event):
+    def process(self, event, event_message=None):
         """
             Process a Raw event
             Parameters:
               event: a typical Lambda Event record
+              event_message: the event message already decoded by the proxy (optional)
             Returns:
               {
                   'processed': is the event processed?,
@@ -590,7 +893,7 @@ class RecordProcessorBase(ProcessorBase):
         try:
             self.clean_stats()
             self.set_processed_status(False)
-            self.set_event_message(event)
+            self.set_event_message(event, event_message=event_message)
             if not self.event_message:
                 raise ValueError("Event Message invalid.")
             if self.record_type not in self.types_to_be_processed():
@@ -607,6 +910,7 @@ class RecordProcessorBase(ProcessorBase):
         except Exception as error:
             self.error_messages.append(error)
             traceback.print_tb(error.__traceback__)
+            self.discard_stage_file()
             b_log.blog_info(message=error,
                             operation=b_log.OPERATION_PROCESSING_A_FILE_OR_RECORD,
                             status=b_log.STATUS_IT_FAILED,
@@ -618,6 +922,7 @@ class RecordProcessorBase(ProcessorBase):
                     stack=traceback.format_tb(error.__traceback__))
                 self.send_to_invalid_data_stream()
             except Exception as invalidate_error:
+                self._retry_record = True
                 self.log_error(
                     method=inspect.stack()[0][3],
                     arguments=locals(),
@@ -651,20 +956,122 @@ class RecordProcessorBase(ProcessorBase):
         self.stage_files_rejected_count += 1
         self.log_info(f"Error while processing stage files. Details: {str(error)}. File path: {filepath}")
 
+    def fetch_stage_files(self, filepaths, held_bytes=None):
+        """Yields (filepath, content of the stage file, the exception raised while fetching it or None), in order.
+
+        The stage files are fetched by the cloud provider (and its stage cache), stage_fetch_workers downloads at
+        a time. No more files are fetched ahead while the fetched ones kept in memory, plus held_bytes() (the
+        prefetched stage files), use stage_file_prefetch_max_bytes. With stage_fetch_workers <= 1 the content is
+        None and the reader downloads the file, as with the stage file workers.
+        """
+        if self.stage_fetch_workers <= 1 or self.uses_stage_file_workers():
+            for filepath in filepaths:
+                yield filepath, None
+            return
+        stage_filenames = [self.cloud_provider.format_stage_filename(filepath) for filepath in filepaths]
+        fetched = self.cloud_provider.fetch_stage_objects(stage_filenames, max_workers=self.stage_fetch_workers,
+                                                          max_bytes=self.stage_file_prefetch_max_bytes,
+                                                          held_bytes=held_bytes)
+        for filepath, (_, content) in zip(filepaths, fetched):
+            yield filepath, content
+
+    def open_fetched_stage_file(self, filepath, content) -> StageCSVReaderFile:
+        if isinstance(content, Exception):
+            raise ValueError("Error while fetching the stage file. Details %s" % content)
+        try:
+            return self.open_stage_file(filepath=self.cloud_provider.format_stage_filename(filepath), content=content)
+        except Exception:
+            discard_content(content)
+            raise
+
+    def prefetch_stage_file(self, fetched_stage_files) -> StageCSVReaderFile:
+        input_stage_file = self.open_fetched_stage_file(*next(fetched_stage_files))
+        input_stage_file.prefetch()
+        return input_stage_file
+
+    def open_stage_files(self, filepaths):
+        """Yields (filepath, opened stage file or the exception raised while opening it), in the order of filepaths.
+
+        With stage_file_prefetch > 0, the next stage files are opened and their first chunk is parsed by a
+        background thread while the current one is transformed. Up to stage_file_prefetch files are opened ahead,
+        and no more while the opened ones use more than stage_file_prefetch_max_bytes of memory. The budget is
+        shared with the files fetched ahead. The stage files are not prefetched with the stage file workers.
+        """
+        if self.stage_file_prefetch <= 0 or self.uses_stage_file_workers():
+            for filepath, content in self.fetch_stage_files(filepaths):
+                try:
+                    yield filepath, self.open_fetched_stage_file(filepath, content)
+                except Exception as error:
+                    yield filepath, error
+            return
+
+        # Memory used by the stage files opened ahead, shared with the fetch of the next ones
+        lock = threading.Lock()
+        prefetched_bytes = 0
+
+        def get_prefetched_bytes():
+            return prefetched_bytes
+
+        def prefetch():
+            nonlocal prefetched_bytes
+            input_stage_file = self.prefetch_stage_file(fetched_stage_files)
+            with lock:
+                prefetched_bytes += input_stage_file.memory_size
+            return input_stage_file
+
+        def release(input_stage_file):
+            nonlocal prefetched_bytes
+            with lock:
+                prefetched_bytes -= input_stage_file.memory_size
+
+        fetched_stage_files = self.fetch_stage_files(filepaths, held_bytes=get_prefetched_bytes)
+        pending = collections.deque()
+        filepaths = iter(filepaths)
+        # A single thread opens the stage files, so they are taken from fetched_stage_files in the order of pending
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            try:
+                while True:
+                    while len(pending) <= self.stage_file_prefetch and (
+                            not pending or prefetched_bytes < self.stage_file_prefetch_max_bytes):
+                        filepath = next(filepaths, None)
+                        if filepath is None:
+                            break
+                        pending.append((filepath, executor.submit(prefetch)))
+                    if not pending:
+                        return
+                    filepath, future = pending.popleft()
+                    try:
+                        input_stage_file = future.result()
+                    except Exception as error:
+                        yield filepath, error
+                    else:
+                        release(input_stage_file)
+                        yield filepath, input_stage_file
+            finally:
+                for _, future in pending:
+                    if not future.cancel() and not future.exception():
+                        future.result().close()
+
     def process_stage_files(self):
         self.stage_files_total = len(self.stream_message.list_of_files)
-        for filepath in self.stream_message.list_of_files:
+        for filepath, input_stage_file in self.open_stage_files(self.stream_message.list_of_files):
             stage_output_lines_created = 0
             try:
                 self.log_info(f"Processing {self.stream_message.type} - {filepath}")
                 self.get_stage_file()
-                input_stage_file = self.open_stage_file(filepath=self.cloud_provider.format_stage_filename(filepath))
+                if isinstance(input_stage_file, Exception):
+                    raise input_stage_file
                 stage_output_lines_created = self.create_output_payload(input_stage_file=input_stage_file, filepath=filepath)
+            except StageOutputError:
+                raise
             except Exception as error:
                 self.on_process_stage_files_error(filepath, error)
             else:
                 self.output_lines_created += stage_output_lines_created
                 self.stage_files_processed_count += 1
+            finally:
+                if not isinstance(input_stage_file, Exception):
+                    input_stage_file.close()
             if stage_output_lines_created == 0:
                 self.log_warning(f"No output was created. Details: [{filepath}]")
 
@@ -686,16 +1093,19 @@ class RecordProcessorBase(ProcessorBase):
     def get_event_message(self) -> StreamEventMessage:
         return self._event_message
 
-    def set_event_message(self, value):
+    def set_event_message(self, value, event_message=None):
         try:
-            self._event_message = self.cloud_provider.create_event_message(value)
+            if event_message is None:
+                event_message = self.cloud_provider.create_event_message(value)
+            self._event_message = event_message
             self.set_stream_message(self.event_message)
         except:
             self._event_message = None
             raise
 
     def set_stream_message(self, event_message):
-        self._stream_message = RecordProcessStreamMessage(dict=event_message.get_event_data_decoded())
+        # The decoded data is shared by all the processors of the event, so each one gets its own copy
+        self._stream_message = RecordProcessStreamMessage(dict=dict(event_message.get_event_data_decoded()))
 
     def get_stream_message(self) -> RecordProcessStreamMessage:
         return self._stream_message
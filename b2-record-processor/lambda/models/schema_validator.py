@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Ecoation JSON schema validators
+#
+# The schema modules of the plugins load their validators with load_validator(). The validator is taken
+# from the module generated ahead of time by build_validators.py (generated_validators.<name>) when it
+# exists and was generated from the same schema, otherwise the schema is compiled by fastjsonschema.
+#
+import hashlib
+import importlib
+import json
+
+import fastjsonschema as fjs
+
+from helpers import get_logger
+
+logger = get_logger(__name__)
+
+GENERATED_VALIDATORS_PACKAGE = 'generated_validators'
+
+# Every schema loaded, name -> schema definition (used by build_validators.py)
+SCHEMAS = {}
+
+
+# Hash of the schema definition and the fastjsonschema version used to generate the validator
+def get_schema_hash(definition):
+    content = json.dumps(definition, sort_keys=True, default=str)
+    return hashlib.sha256(f"{fjs.VERSION}:{content}".encode('utf-8')).hexdigest()
+
+
+# Returns the source code of the module of the validator
+def generate_validator_code(definition):
+    return f"SCHEMA_HASH = '{get_schema_hash(definition)}'\n\n{fjs.compile_to_code(definition)}"
+
+
+# Returns the validator of the schema
+# Parameters:
+#   name: unique name of the schema, also the name of the generated module
+#   definition: the JSON schema
+def load_validator(name, definition):
+    if name in SCHEMAS and SCHEMAS[name] != definition:
+        raise Exception(f"Duplicate schema name: <{name}> already exists.")
+    SCHEMAS[name] = definition
+
+    try:
+        module = importlib.import_module(f"{GENERATED_VALIDATORS_PACKAGE}.{name}")
+        if module.SCHEMA_HASH == get_schema_hash(definition):
+            return module.validate
+        logger.warning(f"The generated validator <{name}> is stale, compiling the schema.")
+    except (ImportError, AttributeError):
+        # Missing, or generated by an older build_validators.py (without SCHEMA_HASH or validate)
+        pass
+    return fjs.compile(definition)
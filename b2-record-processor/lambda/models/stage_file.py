@@ -1,10 +1,30 @@
 import ast
+import bz2
 import csv
+import gzip
+import io
 import json
+import os
+import re
+import shutil
+import tempfile
 
+import fsspec
 import pandas as pd
 
-from helpers import get_logger
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is only needed by the parquet stage files
+    pa = None
+    pq = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is only needed by the zstd stage files
+    zstandard = None
+
+from helpers import dumps_json, get_logger
 
 logger = get_logger(__name__)
 
@@ -13,6 +33,34 @@ CSV_ESCAPECHAR = "\\"
 CSV_QUOTECHAR = '"'
 CSV_QUOTING = csv.QUOTE_NONNUMERIC
 CSV_STRICT = True
+CSV_LINETERMINATOR = '\n'
+
+# Number of lines parsed at once by StageCSVReaderFile
+STAGE_FILE_CHUNK_LINES = int(os.getenv("STAGE_FILE_CHUNK_LINES", 10000))
+# Stage files up to this size are downloaded (or written) in memory, the bigger ones in a spool file on /tmp
+STAGE_FILE_MEMORY_MAX_BYTES = int(os.getenv("STAGE_FILE_MEMORY_MAX_BYTES", 64 * 1024 * 1024))
+COPY_BUFFER_BYTES = 1024 * 1024
+# Number of serialized characters kept by StageCSVWriterFile before they are written in its file
+WRITE_BUFFER_CHARS = 1024 * 1024
+
+COMPRESSION_BY_EXTENSION = {'gz': 'gzip', 'bz2': 'bz2', 'zst': 'zstd'}
+EXTENSION_BY_COMPRESSION = {compression: extension for extension, compression in COMPRESSION_BY_EXTENSION.items()}
+STAGE_FILE_FORMAT_CSV = 'csv'
+STAGE_FILE_FORMAT_PARQUET = 'parquet'
+STAGE_FILE_FORMATS = [STAGE_FILE_FORMAT_CSV, STAGE_FILE_FORMAT_PARQUET]
+PARQUET_EXTENSION = 'parquet'
+STAGE_OUTPUT_COMPRESSIONS = [None, 'gzip', 'zstd']
+# Default levels of zlib and zstd, the level 9 of gzip is much slower for a few percents of size
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# Schema metadata of the parquet stage files with the columns stored as JSON strings
+PARQUET_JSON_COLUMNS_KEY = b'json_columns'
+# One line in PARQUET_SIZE_SAMPLE_LINES is measured to estimate the content size of StageParquetWriterFile
+PARQUET_SIZE_SAMPLE_LINES = 100
+DATATYPE_RE = re.compile(r'datatype=(?P<datatype>[^/]+)/')
+
+# Resolved dtype of the stage files, datatype -> (header line, dtype)
+DTYPE_CACHE = {}
 
 INPUT_DTYPES = {
     'farm_id': str,
@@ -111,45 +159,318 @@ INPUT_DTYPES = {
 }
 
 
+def decode_nested_values(values):
+    """Returns {value: decoded value} of the values that are dicts or lists.
+
+    The values are decoded as JSON or, when they were written with the python repr, by ast.literal_eval.
+    The decoder which worked for the last value is tried first for the next one.
+    """
+    result = {}
+    decoders = [json.loads, ast.literal_eval]
+    for value in values:
+        try:
+            try:
+                decoded_value = decoders[0](value)
+            except (ValueError, SyntaxError):
+                decoded_value = decoders[1](value)
+                decoders.reverse()
+            if decoded_value.__class__ in (dict, list):
+                result[value] = decoded_value
+        except Exception as error:
+            logger.error(f"Stage line is invalid. Details: {{ 'value': '{value}' }}. Details: {error}")
+    return result
+
+
+class SpooledStageContent:
+    """Content of a stage file fetched in a spool file on /tmp instead of memory (bigger than
+    STAGE_FILE_MEMORY_MAX_BYTES).
+
+    The reader opened with it reads the spool file, and removes it when it is closed if remove is True.
+    """
+
+    def __init__(self, path, remove=True):
+        self.path = path
+        self.remove = remove
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def discard(self):
+        if not self.remove:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def spool_stream(stream, suffix='') -> SpooledStageContent:
+    """Copy a binary stream to a new spool file on /tmp."""
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as spool:
+        try:
+            shutil.copyfileobj(stream, spool, COPY_BUFFER_BYTES)
+        except BaseException:
+            spool.close()
+            os.remove(spool.name)
+            raise
+    return SpooledStageContent(spool.name)
+
+
+def link_or_copy(source_path, destination_path):
+    """Hard link the file (the link survives the removal of the source), or copy it on another filesystem."""
+    try:
+        os.link(source_path, destination_path)
+    except OSError as error:
+        if isinstance(error, FileNotFoundError):
+            raise
+        shutil.copyfile(source_path, destination_path)
+
+
+def get_memory_size(content) -> int:
+    """Bytes kept in memory by the content of a fetched stage file (bytes, SpooledStageContent or an error)."""
+    return len(content) if content.__class__ is bytes else 0
+
+
+def get_datatype(filepath):
+    match = DATATYPE_RE.search(filepath)
+    return match.group('datatype') if match else None
+
+
 class StageCSVReaderFile:
+    """Stage file reader, the lines are parsed in chunks of chunk_lines and yielded one by one.
+
+    Only the current chunk is kept in memory, so the memory does not depend on the size of the file.
+    """
 
     filepath: str
-    _data_frame: pd.DataFrame
+    chunk_lines: int
+    _chunk: list
+    _chunk_start: int
+    _chunk_end: int
     _current_index: int
-    _max_index: int
-
-    def __init__(self, filepath):
+    _size: int
+
+    def __init__(self, filepath, chunk_lines=None, columns=None, read_other_columns_raw=False, content=None):
+        """
+        :param filepath: str, local path or URL of the stage file
+        :param chunk_lines: int, number of lines parsed at once (default: STAGE_FILE_CHUNK_LINES)
+        :param columns: list, columns to be read, None to read all the columns
+        :param read_other_columns_raw: bool, read the columns which are not in columns as raw strings instead of
+            skipping them
+        :param content: bytes or SpooledStageContent, content of the stage file when it was already fetched, it is
+            not downloaded again
+        """
+        self.filepath = filepath
+        self.chunk_lines = chunk_lines or STAGE_FILE_CHUNK_LINES
+        self.columns = set(columns) if columns is not None else None
+        self.read_other_columns_raw = read_other_columns_raw
+        self.compression = COMPRESSION_BY_EXTENSION.get(filepath.split('.')[-1])
+        self._content = content
+        self._local_path = None
+        self._spool_path = None
+        if content.__class__ is SpooledStageContent:
+            self._content = None
+            self._local_path = content.path
+            self._spool_path = content.path if content.remove else None
+        elif content is None:
+            self.download()
+        self._dtype = self.read_dtype()
+        if self.columns is not None and self.read_other_columns_raw:
+            self._dtype = {col_name: dtype if col_name in self.columns else str
+                           for col_name, dtype in self._dtype.items()}
+        self._size = None
+        self._current_index = -1
         try:
-            try:
-                dtype = INPUT_DTYPES.copy()
-                header = pd.read_csv(filepath, dtype=INPUT_DTYPES, nrows=1)
-                for colname in header.columns:
-                    if colname not in dtype.keys():
-                        dtype[colname] = str
-            except Exception as error:
-                logger.info('Exception while trying to process the header file on StageCSVReaderFile.__init__ method.')
-                dtype = INPUT_DTYPES
-            self.filepath = filepath
-            self._data_frame = pd.read_csv(filepath, dtype=dtype)
-            self._data_frame = self._data_frame.astype('object')
-            self._max_index = len(self.data_frame.index) - 1
-            self._current_index = -1
-
+            self.open_chunks()
+        except Exception:
+            self.close()
+            raise
+
+    def download(self):
+        """Fetch the stage file once, in memory or in a spool file when it is bigger than STAGE_FILE_MEMORY_MAX_BYTES.
+
+        The header and the chunks are read from the local copy, so a stage file is downloaded only once.
+        """
+        if '://' not in self.filepath:
+            if not os.path.isfile(self.filepath):
+                raise FileNotFoundError("The stage csv file path was not found: [%s]" % self.filepath)
+            self._local_path = self.filepath
+            return
+        try:
+            with fsspec.open(self.filepath, 'rb') as remote:
+                if (getattr(remote, 'size', None) or 0) <= STAGE_FILE_MEMORY_MAX_BYTES:
+                    self._content = remote.read()
+                    return
+                self._spool_path = self._local_path = spool_stream(remote, suffix=os.path.basename(self.filepath)).path
         except FileNotFoundError:
-            raise FileNotFoundError("The stage csv file path was not found: [%s]" % filepath)
+            self.close()
+            raise FileNotFoundError("The stage csv file path was not found: [%s]" % self.filepath)
+
+    def open_source(self):
+        """A new file object or path of the local copy, each reader has its own position."""
+        if self._content is not None:
+            return io.BytesIO(self._content)
+        return self._local_path
+
+    def open_csv_source(self):
+        """(source, compression) of the local copy for pandas.read_csv, the zstd files are decompressed here."""
+        if self.compression != 'zstd':
+            return self.open_source(), self.compression
+        return open_zstd(self.open_source()), None
+
+    def open_binary_source(self):
+        """A new binary file object of the local copy, decompressed."""
+        source = self.open_source()
+        if self.compression == 'gzip':
+            return gzip.open(source)
+        if self.compression == 'bz2':
+            return bz2.open(source)
+        if self.compression == 'zstd':
+            return io.BufferedReader(open_zstd(source))
+        if source.__class__ is str:
+            return open(source, 'rb')
+        return source
+
+    def read_header(self):
+        with self.open_binary_source() as source:
+            return source.readline().decode('utf-8').strip()
+
+    def read_dtype(self):
+        try:
+            header = self.read_header()
+            datatype = get_datatype(self.filepath)
+            cached = DTYPE_CACHE.get(datatype)
+            if cached and cached[0] == header:
+                return cached[1]
+            dtype = INPUT_DTYPES.copy()
+            for colname in next(csv.reader([header])):
+                if colname not in dtype.keys():
+                    dtype[colname] = str
+            DTYPE_CACHE[datatype] = (header, dtype)
+            return dtype
+        except Exception as error:
+            logger.info('Exception while trying to process the header file on StageCSVReaderFile.__init__ method.')
+            return INPUT_DTYPES
+
+    def open_chunks(self, first_line=0):
+        """(Re)open the file, the next chunk starts at the line first_line.
+
+        The lines before first_line are skipped by the CSV tokenizer, they are not converted nor decoded.
+        """
+        source, compression = self.open_csv_source()
+        options = {}
+        if first_line > 0:
+            options = dict(skiprows=first_line + 1, header=None, names=next(csv.reader([self.read_header()])))
+        self._chunks = pd.read_csv(source, dtype=self._dtype, compression=compression,
+                                   usecols=self.get_usecols(), chunksize=self.chunk_lines, **options)
+        # The chunks are read by the process which opened the file, a forked process opens it again
+        self._chunks_pid = os.getpid()
+        self._first_line = first_line
+        self._chunk = None
+        self._chunk_start = first_line
+        self._chunk_end = first_line
+
+    def get_usecols(self):
+        if self.columns is None or self.read_other_columns_raw:
+            return None
+        return lambda col_name: col_name in self.columns
+
+    def is_raw_column(self, col_name):
+        return self.columns is not None and col_name not in self.columns
+
+    def read_next_chunk(self):
+        """Read the next chunk, returns False at the end of the file."""
+        chunk = next(self._chunks, None)
+        # An empty chunk is read when the lines skipped reach the end of the file
+        if chunk is None or chunk.empty:
+            self._chunks.close()
+            if self._chunk_end > self._first_line or self._first_line == 0:
+                self._size = self._chunk_end
+            return False
+        self._chunk = self.create_rows(self.decode_nested_columns(chunk.astype('object')))
+        self._chunk_start = self._chunk_end
+        self._chunk_end += len(chunk.index)
+        return True
+
+    def has_lines(self, count) -> bool:
+        """True when the stage file has at least count lines, it is parsed only up to the chunk of the line count."""
+        if self._size is not None:
+            return self._size >= count
+        while self._chunk_end < count:
+            if not self.read_next_chunk():
+                return False
+        return True
+
+    def estimate_size(self) -> int:
+        """Number of lines of the stage file counted from its line breaks, without parsing it.
+
+        It is higher than the size when values contain line breaks.
+        """
+        if self._size is not None:
+            return self._size
+        line_breaks = 0
+        last_block = b''
+        with self.open_binary_source() as source:
+            for block in iter(lambda: source.read(COPY_BUFFER_BYTES), b''):
+                line_breaks += block.count(b'\n')
+                last_block = block
+        if last_block and not last_block.endswith(b'\n'):
+            line_breaks += 1
+        # Without the header
+        return max(line_breaks - 1, 0)
+
+    def read_from(self, index):
+        """Position the reader before the line index, the lines before it are skipped without being decoded."""
+        self.open_chunks(first_line=index)
+        self._current_index = index - 1
+
+    def count_lines(self):
+        source, compression = self.open_csv_source()
+        chunks = pd.read_csv(source, dtype=str, usecols=[0], compression=compression,
+                             chunksize=max(self.chunk_lines, 100000))
+        try:
+            return sum(len(chunk.index) for chunk in chunks)
+        finally:
+            chunks.close()
+
+    @property
+    def memory_size(self) -> int:
+        """Bytes of the stage file kept in memory (the spool files are on /tmp)."""
+        return len(self._content) if self._content is not None else 0
+
+    def prefetch(self):
+        """Parse the first chunk, so it is ready when the iteration starts."""
+        if self._chunk is None and self._current_index == -1:
+            self.read_next_chunk()
+
+    def close(self):
+        """Release the local copy of the stage file."""
+        self._content = None
+        if self._spool_path:
+            try:
+                os.remove(self._spool_path)
+            except FileNotFoundError:
+                pass
+            self._spool_path = None
 
     @property
     def size(self) -> int:
-        return self._max_index + 1
+        if self._size is None:
+            self._size = self.count_lines()
+        return self._size
 
     @property
-    def data_frame(self):
-        return self._data_frame
+    def rows(self):
+        """The rows of the current chunk."""
+        return self._chunk
 
     def is_index_valid(self, index, raise_exception=False):
-        if raise_exception and index > self._max_index:
-            raise IndexError("The index [%d] is out-of-bounds [%d]" % (index, self._max_index))
-        return index <= self._max_index
+        if index < self._chunk_end:
+            return True
+        if raise_exception and index >= self.size:
+            raise IndexError("The index [%d] is out-of-bounds [%d]" % (index, self.size - 1))
+        return index < self.size
 
     def seek(self, index):
         self.is_index_valid(index, raise_exception=True)
@@ -161,66 +482,127 @@ class StageCSVReaderFile:
     def __len__(self):
         return self.size
 
+    def decode_nested_columns(self, chunk: pd.DataFrame):
+        """Decode the dicts and lists of the chunk column by column.
+
+        Every chunk of the string columns is checked (a column may only have dicts and lists in the last lines).
+        Each distinct value of a column is decoded once per chunk, the rows with the same value share the decoded
+        object.
+        """
+        for col_name in chunk.columns:
+            if self._dtype.get(col_name) is not str or self.is_raw_column(col_name):
+                continue
+            values = chunk[col_name].dropna()
+            if values.empty:
+                continue
+            first_characters = values.str[:1]
+            nested_values = values[(first_characters == '{') | (first_characters == '[')]
+            if nested_values.empty:
+                continue
+            decoded_values = decode_nested_values(pd.unique(nested_values))
+            if decoded_values:
+                chunk[col_name] = chunk[col_name].map(lambda value: decoded_values.get(value, value))
+        return chunk
+
     @staticmethod
-    def eval_elements(row: pd.Series):
-        try:
-            for col_name in list(row.index):
-                if pd.isnull(row[col_name]):
-                    row[col_name] = None
-                col_value = row[col_name]
-                try:
-                    if col_value and col_value.__class__ is str and col_value[0:1] in ['{', '[']:
-                        eval_value = ast.literal_eval(col_value)  # convert string into dict
-                        if eval_value.__class__ in (dict, list):
-                            row = row.copy()
-                            row[col_name] = eval_value
-                except Exception as error:
-                    logger.error(f"Stage line is invalid. Details: {{ 'row': '{row}' }}. Details: {error}")
-            row = row.to_dict()
-            if len(row.keys()) == 1 and "payload" in row:
-                row = row["payload"]
-        except Exception as error:
-            logger.error("Error while eval_elements. Details: %s" % error)
+    def create_rows(chunk: pd.DataFrame):
+        """Returns the rows of the chunk as dicts, NaN is converted to None column by column."""
+        col_names = list(chunk.columns)
+        columns = [chunk[col_name] for col_name in col_names]
+        values = [column.where(column.notnull(), None).tolist() if column.hasnans else column.tolist()
+                  for column in columns]
+        rows = [dict(zip(col_names, row_values)) for row_values in zip(*values)]
+        return StageCSVReaderFile.unwrap_payload(rows, col_names)
 
-        finally:
-            return row
+    @staticmethod
+    def unwrap_payload(rows, col_names):
+        """The stage files with a single payload column are read as the payload itself."""
+        if col_names != ["payload"]:
+            return rows
+        # The decoded values are shared by the rows with the same content
+        return [row["payload"].copy() if row["payload"].__class__ in (dict, list) else row["payload"]
+                for row in rows]
 
     def __next__(self):
-        if not self.is_index_valid(index=self._current_index + 1, raise_exception=False):
-            raise StopIteration
-        self._current_index += 1
-        return self.eval_elements(self.data_frame.iloc[self._current_index])
+        index = self._current_index + 1
+        if self._chunks_pid != os.getpid() or index < self._chunk_start:
+            self.open_chunks(first_line=index)
+        while index >= self._chunk_end:
+            if self._size is not None and index >= self._size or not self.read_next_chunk():
+                raise StopIteration
+        self._current_index = index
+        return self._chunk[index - self._chunk_start]
 
 
 class StageCSVWriterFile:
-    _data_frame : pd.DataFrame
+    """Stage file writer, the rows are serialized in CSV as soon as they are written.
+
+    The CSV (compressed with gzip or zstd when compression is set) is written in upload, a writable file which
+    uploads the stage file while it is written (see CloudProviderBase.open_stage_upload). Without upload, it is
+    written in a spooled temporary file, kept in memory up to STAGE_FILE_MEMORY_MAX_BYTES and moved to /tmp beyond.
+    The columns are the keys of the first dict written, or col_0 when the content is a list. The dicts and lists
+    are encoded in JSON.
+    close() finalizes the file (completes the upload) and returns the number of rows, the content of the spooled
+    file is then read from the file property. discard() releases the file and aborts an upload not completed.
+    """
     type_file : str
     unique_col_name = ["col_0"]
     LIST_TYPE_FILE = 'list'
     DICT_TYPE_FILE = 'dict'
 
-    def __init__(self, filename):
+    def __init__(self, filename, compression=None, upload=None):
+        if compression not in STAGE_OUTPUT_COMPRESSIONS:
+            raise ValueError(f"Invalid stage file compression: <{compression}>. Supported: {STAGE_OUTPUT_COMPRESSIONS}")
         self.filename = filename
-        self._data_frame = None
+        self.compression = compression
+        self.upload = upload
         self.type_file = ""
-        self._list_content = []
         self.col_names = None
         self.is_closed = False
-
-    @staticmethod
-    def create_data_frame(columns: list, data=None):
-        return pd.DataFrame(data=data, columns=columns)
+        self.lines_count = 0
+        self._content_size = 0
+        self._file = None
+        self._stream = None
+        self._buffer = None
+        self._csv_writer = None
+
+    def open_file(self):
+        self._file = self.upload or tempfile.SpooledTemporaryFile(max_size=STAGE_FILE_MEMORY_MAX_BYTES)
+        self._stream = open_compressed_stream(self._file, self.compression)
+        # The rows are serialized in a text buffer, written in the file every WRITE_BUFFER_CHARS characters
+        self._buffer = io.StringIO()
+        self._csv_writer = csv.writer(self._buffer,
+                                      delimiter=CSV_DELIMITER,
+                                      escapechar=CSV_ESCAPECHAR,
+                                      quotechar=CSV_QUOTECHAR,
+                                      quoting=CSV_QUOTING,
+                                      lineterminator=CSV_LINETERMINATOR)
+        self._csv_writer.writerow(self.col_names)
+
+    def flush_buffer(self):
+        content = self._buffer.getvalue().encode('utf-8')
+        self._stream.write(content)
+        self._content_size += len(content)
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+    def write_values(self, values: list):
+        self._csv_writer.writerow([encode_value(value) for value in values])
+        self.lines_count += 1
+        if self._buffer.tell() >= WRITE_BUFFER_CHARS:
+            self.flush_buffer()
 
     def add_row(self, row: dict):
         if self.type_file is not self.DICT_TYPE_FILE:
             raise ValueError("This instance only supports %s as input content. Details: %s" % (self.type_file, row.__class__.__name__))
-        self.list_content.append(row)
+        self.write_values([row.get(col_name) for col_name in self.col_names])
         return 1
 
     def add_rows(self, rows: list):
         if self.type_file is not self.LIST_TYPE_FILE:
             raise ValueError("This instance only supports %s as input content. Details: %s" % (self.type_file, rows.__class__.__name__))
-        self.list_content = self.list_content + rows
+        for row in rows:
+            self.write_values([row])
         return len(rows)
 
     def add_content(self, content):
@@ -230,24 +612,27 @@ class StageCSVWriterFile:
             return self.add_row(row=content)
 
     @property
-    def list_content(self):
-        return self._list_content
+    def emptyfile(self):
+        return self.lines_count == 0
 
-    @list_content.setter
-    def list_content(self, value):
-        self._list_content = value
+    @property
+    def file(self):
+        """Binary file with the content of the stage file, available after close() when there is no upload."""
+        return self._file
 
     @property
-    def data_frame(self) -> pd.DataFrame:
-        return self._data_frame
+    def content_size(self):
+        """Size of the CSV written so far, before compression."""
+        return self._content_size + (self._buffer.tell() if self._buffer else 0)
 
-    @data_frame.setter
-    def data_frame(self, value):
-        self._data_frame = value
+    @property
+    def is_uploaded(self):
+        return self.is_closed and self.upload is not None and self.upload.closed
 
+    # The upload failed while the stage file was written (it aborts itself), nothing more can be written
     @property
-    def emptyfile(self):
-        return len(self.list_content) == 0
+    def is_upload_aborted(self):
+        return not self.is_closed and self.upload is not None and self.upload.closed
 
     def write(self, content):
         if not content:
@@ -255,12 +640,13 @@ class StageCSVWriterFile:
         if content.__class__ not in [dict, list]:
             raise ValueError("The class [%s] is not supported. Supported: list, dict. Content: <%s>" % (content.__class__, content))
         self.raise_if_close()
-        if self.emptyfile:
+        if not self.type_file:
             self.type_file = self.LIST_TYPE_FILE
             self.col_names = self.unique_col_name
             if content.__class__ is dict:
                 self.type_file = self.DICT_TYPE_FILE
                 self.col_names = list(content.keys())
+            self.open_file()
         self.add_content(content)
 
     def raise_if_close(self):
@@ -268,34 +654,290 @@ class StageCSVWriterFile:
             raise ValueError("I/O operation on closed file.")
 
     def close(self):
-        def convert_to_json(x):
-            try:
-                return json.dumps(x)
-            except TypeError:
-                return json.dumps(eval(str(x)))
+        self.raise_if_close()
+        self.is_closed = True
+        if self._file is None:
+            return 0
+        self.flush_buffer()
+        self._buffer = None
+        self._csv_writer = None
+        if self._stream is not self._file:
+            self._stream.close()
+        self._stream = None
+        self.finalize_file()
+        return self.lines_count
+
+    def finalize_file(self):
+        if self.upload is None:
+            self._file.seek(0)
+            return
+        self._file = None
+        self.upload.close()
+
+    # Releases the content of the stage file, once it is uploaded
+    def discard(self):
+        if self.upload is not None and not self.upload.closed:
+            self.upload.abort()
+        if self._file is not None and self._file is not self.upload:
+            self._file.close()
+        self._file = None
+
+
+class StageParquetReaderFile(StageCSVReaderFile):
+    """Parquet stage file reader, with the same interface as StageCSVReaderFile.
+
+    The dicts and lists are stored natively, except the columns listed in the json_columns metadata of the file.
+    """
+
+    def __init__(self, filepath, chunk_lines=None, columns=None, read_other_columns_raw=False, content=None):
+        require_pyarrow()
+        super().__init__(filepath, chunk_lines=chunk_lines, columns=columns,
+                         read_other_columns_raw=read_other_columns_raw, content=content)
+
+    def read_dtype(self):
+        # The types are stored in the parquet schema
+        return {}
+
+    def open_chunks(self, first_line=0):
+        parquet_file = pq.ParquetFile(self.open_source())
+        metadata = parquet_file.schema_arrow.metadata or {}
+        self._json_columns = json.loads(metadata.get(PARQUET_JSON_COLUMNS_KEY, b'[]'))
+        self._size = parquet_file.metadata.num_rows
+        col_names = None
+        if self.columns is not None and not self.read_other_columns_raw:
+            col_names = [col_name for col_name in parquet_file.schema_arrow.names if col_name in self.columns]
+        self._chunks = parquet_file.iter_batches(batch_size=self.chunk_lines, columns=col_names)
+        self._chunks_pid = os.getpid()
+        self._first_line = first_line
+        self._chunk = None
+        self._chunk_start = 0
+        self._chunk_end = 0
+
+    def read_next_chunk(self):
+        try:
+            batch = next(self._chunks)
+            # The batches before the first line are skipped without being converted
+            while self._chunk_end + batch.num_rows <= self._first_line:
+                self._chunk_end += batch.num_rows
+                batch = next(self._chunks)
+        except StopIteration:
+            return False
+        if self._chunk_end < self._first_line:
+            batch = batch.slice(self._first_line - self._chunk_end)
+            self._chunk_end = self._first_line
+        rows = batch.to_pylist()
+        for col_name in batch.schema.names:
+            if col_name in self._json_columns and not self.is_raw_column(col_name):
+                decoded_values = decode_nested_values({row[col_name] for row in rows if row[col_name]})
+                for row in rows:
+                    row[col_name] = decoded_values.get(row[col_name], row[col_name])
+        self._chunk = self.unwrap_payload(rows, batch.schema.names)
+        self._chunk_start = self._chunk_end
+        self._chunk_end += batch.num_rows
+        return True
+
+    def count_lines(self):
+        return pq.ParquetFile(self.open_source()).metadata.num_rows
+
+
+class StageParquetWriterFile(StageCSVWriterFile):
+    """Parquet stage file writer, the dicts and lists are stored natively.
+
+    The values are appended to one list per column (in the order of col_names) until close(), which converts
+    each list to a parquet column. The content size is the estimated size of the same lines in a CSV stage file,
+    so STAGE_OUTPUT_MAX_BYTES splits both formats at about the same lines.
+    """
+
+    def __init__(self, filename, compression=None, upload=None):
+        super().__init__(filename, compression=compression, upload=upload)
+        self._columns = []
+        self._sampled_lines = 0
+        self._sampled_size = 0
+
+    def open_file(self):
+        self._columns = [[] for _ in self.col_names]
+
+    @property
+    def content_size(self):
+        # The parquet size is only known once the table is written by close(), the CSV size of the sampled
+        # lines is extrapolated to all the lines
+        if self._sampled_lines == 0:
+            return 0
+        return self._sampled_size * self.lines_count // self._sampled_lines
+
+    def sample_line(self, values: list):
+        self._sampled_size += get_csv_line_size(values)
+        self._sampled_lines += 1
+
+    def write_values(self, values: list):
+        for column, value in zip(self._columns, values):
+            column.append(value)
+        if self.lines_count % PARQUET_SIZE_SAMPLE_LINES == 0:
+            self.sample_line(values)
+        self.lines_count += 1
+
+    def add_rows(self, rows: list):
+        if self.type_file is not self.LIST_TYPE_FILE:
+            raise ValueError("This instance only supports %s as input content. Details: %s" % (self.type_file, rows.__class__.__name__))
+        self._columns[0].extend(rows)
+        # Same sampled lines as write_values() with one row at a time
+        for row in rows[-self.lines_count % PARQUET_SIZE_SAMPLE_LINES::PARQUET_SIZE_SAMPLE_LINES]:
+            self.sample_line([row])
+        self.lines_count += len(rows)
+        return len(rows)
 
+    def close(self):
         self.raise_if_close()
-        if self.type_file is self.LIST_TYPE_FILE:
-            self.data_frame = self.create_data_frame(data=None, columns=self.unique_col_name)
-            self.data_frame[self.unique_col_name[0]] = self.list_content
-        if self.type_file is self.DICT_TYPE_FILE:
-            self.data_frame = self.create_data_frame(data=self.list_content, columns=self.col_names)
-        result = len(self.list_content)
-        self.list_content = []
         self.is_closed = True
-        df = self.data_frame
-        row = df.iloc[0]
-        for col_name in list(df.columns):
-            if row[col_name].__class__ in [dict, list]:
-                try:
-                    df[col_name] = df[col_name].apply(convert_to_json)
-                except Exception as error:
-                    error_message = f"Error while closing the stage file. Details: col_name is <{col_name}> row[{col_name}].class {row[col_name].__class__}"
-                    logger.error(error_message)
-                    raise
-
-
-        return result
+        if self.emptyfile:
+            return 0
+        table = create_parquet_table(dict(zip(self.col_names, self._columns)))
+        self._columns = []
+        self._file = tempfile.SpooledTemporaryFile(max_size=STAGE_FILE_MEMORY_MAX_BYTES)
+        # snappy is the default codec of pyarrow
+        pq.write_table(table, self._file, compression=self.compression or 'snappy')
+        if self.upload is not None:
+            self._file.seek(0)
+            shutil.copyfileobj(self._file, self.upload, COPY_BUFFER_BYTES)
+            self._file.close()
+        self.finalize_file()
+        return self.lines_count
+
+
+def encode_value(value):
+    """Returns the value as it is written in the CSV stage files: JSON for the dicts and lists, None for NaN.
+
+    Every value is checked, so a column is encoded even when its first values are None.
+    """
+    if value.__class__ in (dict, list):
+        return dumps_json(value)
+    if value.__class__ is float and value != value:
+        return None
+    return value
+
+
+def get_csv_line_size(values: list):
+    """Approximate size of the values written as a line of a CSV stage file (the quotes are not counted)."""
+    size = len(values)
+    for value in values:
+        value = encode_value(value)
+        if value is not None:
+            size += len(str(value))
+    return size
+
+
+def require_zstandard():
+    if zstandard is None:
+        raise Exception("The zstd stage files need zstandard, which is not installed.")
+
+
+def open_zstd(source):
+    """Binary file object with the decompressed content of a zstd file (path or file object)."""
+    require_zstandard()
+    if source.__class__ is str:
+        source = open(source, 'rb')
+    return zstandard.ZstdDecompressor().stream_reader(source, closefd=True)
+
+
+def open_compressed_stream(file, compression):
+    """Writable binary stream which compresses its content in file, close() does not close file."""
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=file, mode='wb', compresslevel=GZIP_LEVEL)
+    if compression == 'zstd':
+        require_zstandard()
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(file, closefd=False)
+    return file
+
+
+def get_stage_file_extension(file_format, compression=None):
+    """Extension of the stage files, the parquet files are compressed internally."""
+    if file_format == STAGE_FILE_FORMAT_PARQUET or compression is None:
+        return file_format
+    return f"{file_format}.{EXTENSION_BY_COMPRESSION[compression]}"
+
+
+def require_pyarrow():
+    if pa is None:
+        raise Exception("The parquet stage files need pyarrow, which is not installed.")
+
+
+def is_parquet_file(filepath):
+    return filepath.split('.')[-1] == PARQUET_EXTENSION
+
+
+def is_parquet_type_supported(data_type):
+    """Parquet cannot store the structs without fields (the columns of empty dicts)."""
+    if pa.types.is_struct(data_type):
+        return data_type.num_fields > 0 and all(is_parquet_type_supported(field.type) for field in data_type)
+    if pa.types.is_list(data_type):
+        return is_parquet_type_supported(data_type.value_type)
+    return True
+
+
+def create_parquet_array(col_name, values):
+    """Returns (array, is_json) of a column, the schema follows INPUT_DTYPES like the CSV reader.
+
+    The dicts and lists are stored natively, or as JSON strings when their types are not consistent.
+    The other columns are int64 when INPUT_DTYPES says so, strings otherwise.
+    """
+    values = [None if value.__class__ is float and value != value else value for value in values]
+    if any(value.__class__ in (dict, list) for value in values):
+        try:
+            array = pa.array(values)
+            if is_parquet_type_supported(array.type):
+                return array, False
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            pass
+        return pa.array([None if value is None else dumps_json(value) for value in values], pa.string()), True
+    if INPUT_DTYPES.get(col_name) is int:
+        try:
+            return pa.array(values, pa.int64()), False
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+    return pa.array([None if value is None else str(value) for value in values], pa.string()), False
+
+
+def create_parquet_table(columns: dict):
+    """Returns the parquet table of the columns, {column name: list of values}."""
+    require_pyarrow()
+    arrays = []
+    json_columns = []
+    for col_name, values in columns.items():
+        array, is_json = create_parquet_array(col_name, values)
+        arrays.append(array)
+        if is_json:
+            json_columns.append(col_name)
+    table = pa.Table.from_arrays(arrays, names=[str(col_name) for col_name in columns])
+    return table.replace_schema_metadata({PARQUET_JSON_COLUMNS_KEY: json.dumps(json_columns)})
+
+
+def write_parquet(data_frame: pd.DataFrame, destination_path):
+    table = create_parquet_table({col_name: data_frame[col_name].tolist() for col_name in data_frame.columns})
+    if '://' not in destination_path:
+        os.makedirs(os.path.dirname(destination_path) or '.', exist_ok=True)
+    with fsspec.open(destination_path, 'wb') as f:
+        pq.write_table(table, f)
+
+
+def open_stage_reader(filepath, **kwargs) -> StageCSVReaderFile:
+    """Returns the reader of the stage file, chosen by the file extension."""
+    if is_parquet_file(filepath):
+        return StageParquetReaderFile(filepath, **kwargs)
+    return StageCSVReaderFile(filepath, **kwargs)
+
+
+def create_stage_writer(filename, file_format=STAGE_FILE_FORMAT_CSV, compression=None,
+                        upload=None) -> StageCSVWriterFile:
+    if file_format == STAGE_FILE_FORMAT_PARQUET:
+        require_pyarrow()
+        return StageParquetWriterFile(filename=filename, compression=compression, upload=upload)
+    if file_format == STAGE_FILE_FORMAT_CSV:
+        if compression == 'zstd':
+            require_zstandard()
+        return StageCSVWriterFile(filename=filename, compression=compression, upload=upload)
+    raise ValueError(f"Invalid stage file format: <{file_format}>. Supported: {STAGE_FILE_FORMATS}")
+
+
 #
 # if __name__ == "__main__":
 #     import pprint
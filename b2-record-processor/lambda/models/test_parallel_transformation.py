@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# Unit Test for the parallel transformation of the stage files
+#
+
+import threading
+
+import pytest
+
+from models.record_processor import RecordProcessorBase, STAGE_FETCH_MAX_WORKERS
+from models.stage_file import StageCSVReaderFile, StageCSVWriterFile
+from providers.local import local
+
+
+class ParallelTestProcessor(RecordProcessorBase):
+    stage_file_parallel_min_lines = 10
+    get_row_calls = 0
+
+    @staticmethod
+    def types_to_be_processed():
+        return ["pytest"]
+
+    def get_tag_id(self):
+        return self.current_payload['tag_id']
+
+    def get_row(self):
+        if not self._row:
+            ParallelTestProcessor.get_row_calls += 1
+            self._row = {'customer_id': 'customer', 'farm_id': 'farm', 'phase_id': 'phase',
+                         'side': 'left', 'row_number': 1, 'crops': []}
+        return self._row
+
+    def get_farm_zone(self):
+        return None
+
+    def get_record_type(self):
+        return "pytest"
+
+    def create_message_payload(self, payload):
+        value = int(payload['value'])
+        if value % 7 == 0:
+            raise ValueError("invalid value")
+        yield {'value': value, 'customer_id': self.get_customer_id()}
+        if value % 2 == 0:
+            yield {'value': -value, 'customer_id': self.get_customer_id()}
+
+
+@pytest.fixture()
+def stage_file(tmp_path):
+    filepath = tmp_path / '0438763235890056-20190423-left-191134.csv'
+    lines = ['tag_id,value'] + [f'0438763235890056,{i}' for i in range(1, 101)]
+    filepath.write_text('\n'.join(lines))
+    return str(filepath)
+
+
+def transform(stage_file, workers):
+    rp = ParallelTestProcessor('pytest', None)
+    rp.stage_file_workers = workers
+    rp._stage_file = StageCSVWriterFile(filename='pytest')
+    output_lines_count = rp.create_output_payload(StageCSVReaderFile(stage_file), stage_file)
+    return rp, output_lines_count
+
+
+def test_parallel_transformation_matches_serial(stage_file):
+    serial, serial_count = transform(stage_file, workers=1)
+    parallel, parallel_count = transform(stage_file, workers=3)
+    assert parallel_count == serial_count == 100 - 14 + 50 - 7
+    serial._stage_file.close()
+    parallel._stage_file.close()
+    assert parallel._stage_file.file.read() == serial._stage_file.file.read()
+    assert parallel.input_lines_rejected_count == serial.input_lines_rejected_count == 14
+
+
+def test_parallel_transformation_splits_on_line_breaks(tmp_path):
+    filepath = tmp_path / '0438763235890056-20190423-left-191134.csv'
+    lines = ['tag_id,value,note'] + [f'0438763235890056,{i},"a\nb"' for i in range(1, 101)]
+    filepath.write_text('\n'.join(lines))
+    serial, serial_count = transform(str(filepath), workers=1)
+    parallel, parallel_count = transform(str(filepath), workers=3)
+    assert parallel_count == serial_count
+    serial._stage_file.close()
+    parallel._stage_file.close()
+    assert parallel._stage_file.file.read() == serial._stage_file.file.read()
+
+
+def test_parallel_transformation_resolves_context_in_parent(stage_file):
+    ParallelTestProcessor.get_row_calls = 0
+    parallel, _ = transform(stage_file, workers=4)
+    assert ParallelTestProcessor.get_row_calls == 1
+    assert parallel._row['customer_id'] == 'customer'
+
+
+def test_small_stage_file_is_transformed_serially(stage_file):
+    rp = ParallelTestProcessor('pytest', None)
+    rp.stage_file_workers = 4
+    rp.stage_file_parallel_min_lines = 1000
+    assert not rp.is_parallel_transformation(StageCSVReaderFile(stage_file))
+
+
+def test_stage_file_is_transformed_serially_while_other_threads_run(stage_file):
+    rp = ParallelTestProcessor('pytest', None)
+    rp.stage_file_workers = 4
+    assert rp.is_parallel_transformation(StageCSVReaderFile(stage_file))
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+    try:
+        assert not rp.is_parallel_transformation(StageCSVReaderFile(stage_file))
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_stage_files_are_transformed_in_parallel_with_the_default_fetch(tmp_path, stage_file):
+    rp = ParallelTestProcessor('pytest', local(stage_root=str(tmp_path), output_dir=str(tmp_path / 'output')))
+    rp.stage_file_workers = 3
+    # The prefetch of the template, the default fetch workers
+    rp.stage_file_prefetch = 2
+    assert rp.stage_fetch_workers == STAGE_FETCH_MAX_WORKERS > 1
+    rp._stage_file = StageCSVWriterFile(filename='pytest')
+    output_lines_count = 0
+    for _, input_stage_file in rp.open_stage_files([stage_file] * 3):
+        assert threading.active_count() == 1
+        assert rp.is_parallel_transformation(input_stage_file)
+        output_lines_count += rp.create_output_payload(input_stage_file, stage_file)
+        input_stage_file.close()
+    assert output_lines_count == 3 * (100 - 14 + 50 - 7)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# Unit Test for the fetch and the prefetch of the stage files of a message
+#
+
+import os
+import time
+
+import pytest
+
+from models.record_processor import RecordProcessorBase
+from models.stage_file import SpooledStageContent
+from providers.local import local
+from providers.local import local_cloud
+
+
+class StageFilesTestProcessor(RecordProcessorBase):
+
+    @staticmethod
+    def types_to_be_processed():
+        return ["pytest"]
+
+    def get_tag_id(self):
+        return "TBD"
+
+    def create_message_payload(self, payload):
+        yield payload
+
+
+@pytest.fixture()
+def stage_files(tmp_path):
+    filepaths = []
+    for index in range(5):
+        filepath = tmp_path / f'stage-{index}.csv'
+        filepath.write_text('\n'.join(['value'] + [str(index)] * 3))
+        filepaths.append(str(filepath))
+    return filepaths
+
+
+@pytest.fixture()
+def cloud_provider(tmp_path):
+    return local(stage_root=str(tmp_path), output_dir=str(tmp_path / 'output'))
+
+
+def open_stage_files(cloud_provider, filepaths, prefetch, fetch_workers, max_bytes=1024):
+    rp = StageFilesTestProcessor('pytest', cloud_provider)
+    rp.stage_file_prefetch = prefetch
+    rp.stage_file_prefetch_max_bytes = max_bytes
+    rp.stage_fetch_workers = fetch_workers
+    return list(rp.open_stage_files(filepaths))
+
+
+@pytest.mark.parametrize('prefetch', [0, 1, 3])
+@pytest.mark.parametrize('fetch_workers', [1, 2, 8])
+def test_open_stage_files_in_order(cloud_provider, stage_files, prefetch, fetch_workers):
+    filepaths = stage_files[:2] + ['missing.csv'] + stage_files[2:]
+    opened = open_stage_files(cloud_provider, filepaths, prefetch, fetch_workers)
+    assert [filepath for filepath, _ in opened] == filepaths
+    assert isinstance(opened[2][1], ValueError)
+    assert [next(reader)['value'] for _, reader in opened if not isinstance(reader, Exception)] == [
+        '0', '1', '2', '3', '4']
+
+
+def test_prefetch_parses_the_first_chunk(cloud_provider, stage_files):
+    rp = StageFilesTestProcessor('pytest', cloud_provider)
+    rp.stage_file_prefetch = 2
+    opened = rp.open_stage_files(stage_files)
+    next(opened)
+    _, reader = next(opened)
+    assert reader.rows == [{'value': '1'}] * 3
+    assert reader.memory_size > 0
+    opened.close()
+
+
+def test_fetch_stage_objects_in_order(cloud_provider, stage_files):
+    fetched = list(cloud_provider.fetch_stage_objects(stage_files + ['missing.csv'], max_workers=2))
+    assert [obj_name for obj_name, _ in fetched] == stage_files + ['missing.csv']
+    assert fetched[0][1] == b'value\n0\n0\n0'
+    assert isinstance(fetched[-1][1], FileNotFoundError)
+
+
+@pytest.mark.parametrize('held_bytes, fetched_ahead', [(None, 5), (lambda: 1024, 1)])
+def test_fetch_stage_objects_respects_the_byte_budget(cloud_provider, stage_files, held_bytes, fetched_ahead):
+    started = []
+
+    def fetch_stage_object(obj_name):
+        started.append(obj_name)
+        return b'value\n0'
+
+    cloud_provider.fetch_stage_object = fetch_stage_object
+    fetched = cloud_provider.fetch_stage_objects(stage_files, max_workers=8, max_bytes=1024, held_bytes=held_bytes)
+    next(fetched)
+    time.sleep(0.1)
+    assert len(started) == fetched_ahead
+    assert len(list(fetched)) == 4
+
+
+def test_big_stage_files_are_not_read_in_memory(cloud_provider, stage_files, monkeypatch):
+    monkeypatch.setattr(local_cloud, 'STAGE_FILE_MEMORY_MAX_BYTES', 4)
+    content = cloud_provider.fetch_stage_object(stage_files[0])
+    assert isinstance(content, SpooledStageContent)
+    opened = open_stage_files(cloud_provider, stage_files, prefetch=1, fetch_workers=2)
+    assert [next(reader)['value'] for _, reader in opened] == ['0', '1', '2', '3', '4']
+    assert [reader.memory_size for _, reader in opened] == [0] * 5
+    for _, reader in opened:
+        reader.close()
+    assert all(os.path.isfile(filepath) for filepath in stage_files)
@@ -91,6 +91,26 @@ def test_open_stage_file_exception(record_processor_instance):
         assert rp.open_stage_file('unittest_test_open_stage_file_exception') is None
 
 
+def test_reset_restores_the_phase_model(record_processor_instance):
+    rp = record_processor_instance
+    phase_model = rp._OB_PHASE
+    product_helper = phase_model._ph
+    phase_model.phase_id = 'phase'
+    phase_model.phase_name = 'Phase'
+    phase_model.bays = {'1': 'bay'}
+    phase_model.disabled_posts.append({'x': 1, 'y': 2})
+    phase_model.walkway_width = 120
+    phase_model._rows_changed = True
+    rp.reset()
+    assert phase_model.phase_id == ''
+    assert phase_model.phase_name == ''
+    assert phase_model.bays == {}
+    assert phase_model.disabled_posts == []
+    assert phase_model.walkway_width == 0
+    assert phase_model._rows_changed is False
+    assert phase_model._ph is product_helper
+
+
 # def test_log_error_exception(record_processor_instance):
 #     rp = record_processor_instance
 #     redirected_output = sys.stdout = StringIO()
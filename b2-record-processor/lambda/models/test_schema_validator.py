@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# Unit Test for the schema validator loader
+#
+
+import sys
+
+import fastjsonschema as fjs
+import pytest
+
+from models import schema_validator
+
+SCHEMA = {'type': 'object', 'required': ['tag_id'], 'properties': {'tag_id': {'type': 'string'}}}
+
+
+@pytest.fixture()
+def generated_package(tmp_path, monkeypatch):
+    package = tmp_path / 'pytest_generated_validators'
+    package.mkdir()
+    (package / '__init__.py').write_text('')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(schema_validator, 'GENERATED_VALIDATORS_PACKAGE', 'pytest_generated_validators')
+    monkeypatch.setattr(schema_validator, 'SCHEMAS', {})
+    yield package
+    for module in [m for m in sys.modules if m.startswith('pytest_generated_validators')]:
+        del sys.modules[module]
+
+
+def test_load_generated_validator(generated_package):
+    (generated_package / 'pytest_schema.py').write_text(schema_validator.generate_validator_code(SCHEMA))
+    validate = schema_validator.load_validator('pytest_schema', SCHEMA)
+    assert validate.__module__ == 'pytest_generated_validators.pytest_schema'
+    assert validate({'tag_id': '0438763235890056'})
+    with pytest.raises(fjs.JsonSchemaException):
+        validate({'tag_id': 1})
+
+
+def test_compile_when_generated_validator_is_stale(generated_package):
+    stale_schema = dict(SCHEMA, required=[])
+    (generated_package / 'pytest_schema.py').write_text(schema_validator.generate_validator_code(stale_schema))
+    validate = schema_validator.load_validator('pytest_schema', SCHEMA)
+    assert validate.__module__ != 'pytest_generated_validators.pytest_schema'
+    with pytest.raises(fjs.JsonSchemaException):
+        validate({})
+
+
+def test_compile_when_generated_validator_is_missing(generated_package):
+    validate = schema_validator.load_validator('pytest_schema', SCHEMA)
+    assert validate({'tag_id': '0438763235890056'})
+    assert schema_validator.SCHEMAS == {'pytest_schema': SCHEMA}
+
+
+def test_compile_when_generated_validator_has_no_hash(generated_package):
+    (generated_package / 'pytest_schema.py').write_text('def validate(data):\n    return data\n')
+    validate = schema_validator.load_validator('pytest_schema', SCHEMA)
+    assert validate.__module__ != 'pytest_generated_validators.pytest_schema'
+    with pytest.raises(fjs.JsonSchemaException):
+        validate({})
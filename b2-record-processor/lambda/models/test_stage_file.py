@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+#
+# Unit Test for the stage file reader
+#
+
+import csv
+import decimal
+import gzip
+import os
+
+import fsspec
+import pandas as pd
+import pytest
+
+from models import stage_file as stage_file_module
+from models.stage_file import StageCSVReaderFile
+
+
+@pytest.fixture()
+def stage_file(tmp_path):
+    filepath = tmp_path / '0438763235890056-20190423-left-191134.csv.gz'
+    lines = ['tag_id,value,location'] + [f'0438763235890056,{i},"{{\'x\': {i}}}"' for i in range(25)]
+    with gzip.open(filepath, 'wt') as f:
+        f.write('\n'.join(lines))
+    return str(filepath)
+
+
+def test_iterates_in_chunks(stage_file):
+    reader = StageCSVReaderFile(stage_file, chunk_lines=10)
+    rows = list(reader)
+    assert [row['value'] for row in rows] == [str(i) for i in range(25)]
+    assert rows[3]['location'] == {'x': 3}
+    assert len(reader.rows) <= 10
+    assert len(reader) == 25
+
+
+def test_len_before_iteration(stage_file):
+    assert len(StageCSVReaderFile(stage_file, chunk_lines=10)) == 25
+
+
+def test_seek(stage_file):
+    reader = StageCSVReaderFile(stage_file, chunk_lines=10)
+    reader.seek(21)
+    assert next(reader)['value'] == '22'
+    reader.seek(-1)
+    assert next(reader)['value'] == '0'
+    reader.seek(11)
+    assert [row['value'] for row in reader] == [str(i) for i in range(12, 25)]
+    with pytest.raises(IndexError):
+        reader.seek(25)
+
+
+def test_read_from_skips_the_lines_without_decoding(stage_file, monkeypatch):
+    reader = StageCSVReaderFile(stage_file, chunk_lines=10)
+    decoded_rows = []
+    create_rows = StageCSVReaderFile.create_rows
+    monkeypatch.setattr(StageCSVReaderFile, 'create_rows',
+                        staticmethod(lambda chunk: decoded_rows.extend(chunk.index) or create_rows(chunk)))
+    reader.read_from(21)
+    rows = list(reader)
+    assert [row['value'] for row in rows] == ['21', '22', '23', '24']
+    assert rows[0]['location'] == {'x': 21}
+    assert len(decoded_rows) == 4
+    assert len(reader) == 25
+
+
+def test_read_from_after_the_end(stage_file):
+    reader = StageCSVReaderFile(stage_file, chunk_lines=10)
+    reader.read_from(30)
+    assert list(reader) == []
+    assert len(reader) == 25
+
+
+def test_has_lines_parses_only_the_first_chunks(stage_file, monkeypatch):
+    reader = StageCSVReaderFile(stage_file, chunk_lines=10)
+    monkeypatch.setattr(reader, 'count_lines', None)
+    assert reader.has_lines(15)
+    assert reader._chunk_end == 20
+    assert not StageCSVReaderFile(stage_file, chunk_lines=10).has_lines(26)
+    assert [row['value'] for row in reader][:2] == ['0', '1']
+
+
+def test_estimate_size(tmp_path, stage_file):
+    assert StageCSVReaderFile(stage_file).estimate_size() == 25
+    filepath = tmp_path / 'multiline.csv'
+    filepath.write_text('tag_id,value\n1,"a\nb"\n2,c\n')
+    reader = StageCSVReaderFile(str(filepath))
+    assert reader.estimate_size() == 3
+    assert len(reader) == 2
+
+
+def test_spooled_content_is_removed_on_close(stage_file):
+    with open(stage_file, 'rb') as f:
+        content = stage_file_module.spool_stream(f)
+    reader = StageCSVReaderFile(stage_file, content=content)
+    assert reader.memory_size == 0
+    assert len(list(reader)) == 25
+    reader.close()
+    assert not os.path.exists(content.path)
+
+
+def test_file_not_found(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        StageCSVReaderFile(str(tmp_path / 'missing.csv'))
+
+
+@pytest.fixture()
+def remote_stage_file(stage_file):
+    filepath = 'memory://stage/datatype=pytest/0438763235890056-20190423-left-191134.csv.gz'
+    with open(stage_file, 'rb') as local, fsspec.open(filepath, 'wb') as remote:
+        remote.write(local.read())
+    return filepath
+
+
+def test_remote_file_is_downloaded_once(remote_stage_file, monkeypatch):
+    opened = []
+    fsspec_open = fsspec.open
+
+    def counting_open(*args, **kwargs):
+        opened.append(args)
+        return fsspec_open(*args, **kwargs)
+
+    monkeypatch.setattr(stage_file_module.fsspec, 'open', counting_open)
+    reader = StageCSVReaderFile(remote_stage_file, chunk_lines=10)
+    assert len(reader) == 25
+    assert [row['value'] for row in reader] == [str(i) for i in range(25)]
+    assert len(opened) == 1
+
+
+def test_remote_file_spooled(remote_stage_file, monkeypatch):
+    monkeypatch.setattr(stage_file_module, 'STAGE_FILE_MEMORY_MAX_BYTES', 10)
+    reader = StageCSVReaderFile(remote_stage_file, chunk_lines=10)
+    spool_path = reader._spool_path
+    assert os.path.isfile(spool_path)
+    assert len(list(reader)) == 25
+    reader.close()
+    assert not os.path.exists(spool_path)
+
+
+def test_dtype_cached_by_datatype(remote_stage_file):
+    stage_file_module.DTYPE_CACHE.pop('pytest', None)
+    dtype = StageCSVReaderFile(remote_stage_file)._dtype
+    assert dtype['location'] is str
+    assert StageCSVReaderFile(remote_stage_file)._dtype is dtype
+
+
+def test_decode_nested_values():
+    values = ['{"x": 1, "valid": true}', "{'x': 2}", '[1, 2]', "{'x': ", '{not nested}']
+    decoded = stage_file_module.decode_nested_values(values)
+    assert decoded == {'{"x": 1, "valid": true}': {'x': 1, 'valid': True}, "{'x': 2}": {'x': 2}, '[1, 2]': [1, 2]}
+
+
+def test_nested_columns_decoded_once(tmp_path):
+    filepath = tmp_path / 'nested.csv'
+    lines = ['time,crops,note'] + [f'{i},"[{{""crop"": ""TOV""}}]",' for i in range(5)] + ['5,,[text']
+    filepath.write_text('\n'.join(lines))
+    rows = list(StageCSVReaderFile(str(filepath)))
+    assert rows[0]['crops'] == [{'crop': 'TOV'}]
+    assert rows[0]['crops'] is rows[4]['crops']
+    assert rows[5]['crops'] is None
+    assert rows[5]['note'] == '[text'
+
+
+@pytest.mark.parametrize('chunk_lines', [2, 10])
+def test_nested_values_after_the_first_chunk(tmp_path, chunk_lines):
+    filepath = tmp_path / 'nested.csv'
+    filepath.write_text('a,b\n1,x\n1,x\n1,x\n2,"{""k"": 1}"\n')
+    rows = list(StageCSVReaderFile(str(filepath), chunk_lines=chunk_lines))
+    assert rows[0]['b'] == 'x'
+    assert rows[3]['b'] == {'k': 1}
+
+
+def test_create_rows():
+    chunk = pd.DataFrame({'count': [1, 2], 'label': ['healthy', float('nan')]}).astype('object')
+    assert StageCSVReaderFile.create_rows(chunk) == [{'count': 1, 'label': 'healthy'}, {'count': 2, 'label': None}]
+
+    payload = {'id': 'wave'}
+    rows = StageCSVReaderFile.create_rows(pd.DataFrame({'payload': [payload, payload]}).astype('object'))
+    assert rows == [payload, payload]
+    assert rows[0] is not payload and rows[0] is not rows[1]
+
+
+def test_columns_projection(stage_file):
+    rows = list(StageCSVReaderFile(stage_file, columns=['location', 'missing']))
+    assert rows[1] == {'location': {'x': 1}}
+
+
+def test_other_columns_read_raw(tmp_path):
+    filepath = tmp_path / 'raw.csv'
+    filepath.write_text('count,location,meta\n3,"{\'x\': 1}","{\'y\': 2}"\n')
+    rows = list(StageCSVReaderFile(str(filepath), columns=['location'], read_other_columns_raw=True))
+    assert rows == [{'count': '3', 'location': {'x': 1}, 'meta': "{'y': 2}"}]
+
+
+def test_parquet_round_trip(tmp_path):
+    pytest.importorskip('pyarrow')
+    rows = [{'count': 1, 'time': 1558550387.158523, 'location': {'x': 1, 'y': 2}, 'crops': [{'crop': 'TOV'}],
+             'value': [1, 'a']},
+            {'count': 2, 'time': None, 'location': {'x': 3, 'y': 4}, 'crops': [], 'value': None}]
+    filepath = str(tmp_path / 'datatype=pytest' / 'stage.parquet')
+    writer = stage_file_module.create_stage_writer('stage', stage_file_module.STAGE_FILE_FORMAT_PARQUET)
+    for row in rows:
+        writer.write(row)
+    assert writer.close() == 2
+    os.makedirs(os.path.dirname(filepath))
+    with open(filepath, 'wb') as f:
+        f.write(writer.file.read())
+
+    reader = stage_file_module.open_stage_reader(filepath, chunk_lines=1)
+    assert isinstance(reader, stage_file_module.StageParquetReaderFile)
+    assert len(reader) == 2
+    assert list(reader) == [dict(rows[0], time='1558550387.158523'), rows[1]]
+    reader.seek(0)
+    assert next(reader)['count'] == 2
+    reader.read_from(1)
+    assert [row['count'] for row in reader] == [2]
+    projected = stage_file_module.open_stage_reader(filepath, columns=['count'])
+    assert list(projected) == [{'count': 1}, {'count': 2}]
+
+
+def test_open_stage_reader_csv(stage_file):
+    assert type(stage_file_module.open_stage_reader(stage_file)) is StageCSVReaderFile
+    with pytest.raises(ValueError):
+        stage_file_module.create_stage_writer('stage', 'xml')
+
+
+def write_stage_file(tmp_path, filename, rows, **kwargs):
+    writer = stage_file_module.create_stage_writer('stage', **kwargs)
+    for row in rows:
+        writer.write(row)
+    assert writer.close() == sum(len(row) if row.__class__ is list else 1 for row in rows)
+    filepath = tmp_path / 'datatype=pytest' / filename
+    filepath.parent.mkdir(exist_ok=True)
+    filepath.write_bytes(writer.file.read())
+    writer.discard()
+    return str(filepath)
+
+
+def read_output_stage_file(filepath):
+    with fsspec.open(filepath, 'rt', compression='infer', newline='') as f:
+        return list(csv.reader(f, delimiter=stage_file_module.CSV_DELIMITER,
+                               escapechar=stage_file_module.CSV_ESCAPECHAR,
+                               quoting=stage_file_module.CSV_QUOTING))
+
+
+def test_csv_writer_serializes_rows(tmp_path):
+    rows = [{'tag_id': '0438763235890056', 'count': 1, 'location': {'x': 1}, 'crops': [{'crop': 'TOV'}],
+             'comment': 'a;"b"\\c'},
+            {'tag_id': '0438763235890057', 'count': 2, 'location': None, 'crops': [], 'comment': float('nan')},
+            {'tag_id': '0438763235890058', 'other': 1},
+            {'tag_id': '0438763235890059', 'location': {'x': decimal.Decimal('1.5')}, 'crops': [decimal.Decimal('2')]}]
+    filepath = write_stage_file(tmp_path, 'stage.csv', rows)
+    with open(filepath) as f:
+        assert f.readline() == '"tag_id";"count";"location";"crops";"comment"\n'
+    assert read_output_stage_file(filepath) == [
+        ['tag_id', 'count', 'location', 'crops', 'comment'],
+        ['0438763235890056', 1.0, '{"x":1}', '[{"crop":"TOV"}]', 'a;"b"\\c'],
+        ['0438763235890057', 2.0, '', '[]', ''],
+        ['0438763235890058', '', '', '', ''],
+        ['0438763235890059', '', '{"x":1.5}', '[2]', '']]
+
+
+def test_csv_writer_list_content_compressed(tmp_path, monkeypatch):
+    monkeypatch.setattr(stage_file_module, 'STAGE_FILE_MEMORY_MAX_BYTES', 64)
+    monkeypatch.setattr(stage_file_module, 'WRITE_BUFFER_CHARS', 16)
+    rows = [[f'line {i}' for i in range(100)], ['last']]
+    filepath = write_stage_file(tmp_path, 'stage.csv.gz', rows, compression='gzip')
+    assert read_output_stage_file(filepath) == [['col_0']] + [[line] for line in rows[0] + rows[1]]
+    with pytest.raises(ValueError):
+        stage_file_module.create_stage_writer('stage', compression='lzma')
+
+
+def test_parquet_writer_appends_to_columns(tmp_path):
+    pytest.importorskip('pyarrow')
+    rows = [{'count': i, 'location': {'x': i}, 'metadata': {}} for i in range(5)] + [{'location': {'x': 5}, 'other': 1}]
+    filepath = write_stage_file(tmp_path, 'stage.parquet', rows, file_format=stage_file_module.STAGE_FILE_FORMAT_PARQUET)
+    assert list(stage_file_module.open_stage_reader(filepath)) == rows[:5] + [
+        {'count': None, 'location': {'x': 5}, 'metadata': None}]
+    lists = [[f'line {i}' for i in range(3)], ['line 3']]
+    filepath = write_stage_file(tmp_path, 'list.parquet', lists, file_format=stage_file_module.STAGE_FILE_FORMAT_PARQUET)
+    assert [row['col_0'] for row in stage_file_module.open_stage_reader(filepath)] == lists[0] + lists[1]
+
+
+def test_zstd_stage_file(tmp_path, stage_file):
+    zstandard = pytest.importorskip('zstandard')
+    filepath = tmp_path / '0438763235890056-20190423-left-191134.csv.zst'
+    with gzip.open(stage_file, 'rb') as f:
+        filepath.write_bytes(zstandard.ZstdCompressor().compress(f.read()))
+    reader = StageCSVReaderFile(str(filepath), chunk_lines=10)
+    assert len(reader) == 25
+    assert list(reader) == list(StageCSVReaderFile(stage_file))
+    assert reader._dtype['location'] is str
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip', 'zstd'])
+def test_csv_writer_compression(tmp_path, compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    extension = stage_file_module.get_stage_file_extension(stage_file_module.STAGE_FILE_FORMAT_CSV, compression)
+    assert extension == {None: 'csv', 'gzip': 'csv.gz', 'zstd': 'csv.zst'}[compression]
+    rows = [{'tag_id': str(i), 'location': {'x': i}} for i in range(100)]
+    filepath = write_stage_file(tmp_path, f'stage.{extension}', rows, compression=compression)
+    reader = StageCSVReaderFile(filepath)
+    assert reader.compression == compression
+    assert reader.read_header() == '"tag_id";"location"'
+    assert len(reader) == 100
+    assert stage_file_module.get_stage_file_extension(stage_file_module.STAGE_FILE_FORMAT_PARQUET, compression) == 'parquet'
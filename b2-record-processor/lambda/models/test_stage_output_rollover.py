@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Unit Test for the rollover of the stage file created by the record processor
+#
+
+import os
+
+import pandas as pd
+import pytest
+
+from models.event_message import RecordProcessStreamMessage
+from models.record_processor import RecordProcessorBase, StageOutputError
+from providers.local import local
+from providers.local.local_cloud import LocalStageUpload
+
+
+class RolloverTestProcessor(RecordProcessorBase):
+
+    @staticmethod
+    def types_to_be_processed():
+        return ["pytest"]
+
+    def get_tag_id(self):
+        return "TBD"
+
+    def create_message_payload(self, payload):
+        yield payload
+
+
+class FailingStageUpload(LocalStageUpload):
+
+    def close(self):
+        self.abort()
+        raise ConnectionError("S3 is not available")
+
+
+def create_processor(tmp_path, max_lines=0, max_bytes=0):
+    rp = RolloverTestProcessor('pytest', local(stage_root=str(tmp_path), output_dir=str(tmp_path / 'output')))
+    rp._stream_message = RecordProcessStreamMessage(dict={'type': 'pytest', 'filename': 'pytest/stage.tar.bz2',
+                                                          'payload': []})
+    rp.stage_output_max_lines = max_lines
+    rp.stage_output_max_bytes = max_bytes
+    return rp
+
+
+def read_part(rp, part):
+    filepath = rp.cloud_provider.format_stage_filename(part)
+    if rp.stage_output_format == 'parquet':
+        return pd.read_parquet(filepath)
+    return pd.read_csv(filepath, sep=';')
+
+
+def write_outputs(rp, count):
+    for value in range(count):
+        rp.write_to_stage({'value': value, 'name': f'output {value}'})
+    rp.close_stage_file(rp._stage_file)
+    return [read_part(rp, part)['value'].tolist() for part in rp._stage_files]
+
+
+def test_stage_file_rolls_over_on_lines(tmp_path):
+    rp = create_processor(tmp_path, max_lines=4)
+    assert write_outputs(rp, 10) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert len(set(rp._stage_files)) == 3
+    assert all(os.path.basename(part).startswith('stage.tar.bz2__') for part in rp._stage_files)
+
+
+def test_stage_file_rolls_over_on_bytes(tmp_path):
+    rp = create_processor(tmp_path, max_bytes=50)
+    assert write_outputs(rp, 6) == [[0, 1, 2], [3, 4, 5]]
+
+
+def test_parquet_stage_file_rolls_over_on_bytes(tmp_path):
+    pytest.importorskip('pyarrow')
+    rp = create_processor(tmp_path, max_bytes=30)
+    rp.stage_output_format = 'parquet'
+    assert write_outputs(rp, 10) == [['0', '1', '2'], ['3', '4', '5'], ['6', '7', '8'], ['9']]
+
+
+def test_last_part_full(tmp_path):
+    rp = create_processor(tmp_path, max_lines=5)
+    assert write_outputs(rp, 10) == [[0, 1, 2, 3, 4], [5, 6, 7, 8, 9]]
+    assert rp._stage_file is None
+
+
+def test_no_rollover_by_default(tmp_path):
+    assert write_outputs(create_processor(tmp_path), 10) == [list(range(10))]
+
+
+def test_failed_rollover_fails_the_message_and_deletes_the_parts(tmp_path):
+    rp = create_processor(tmp_path, max_lines=2)
+    uploads = []
+
+    def open_stage_upload(destination_path):
+        uploads.append(destination_path)
+        return (FailingStageUpload if len(uploads) == 2 else LocalStageUpload)(destination_path)
+
+    rp.cloud_provider.open_stage_upload = open_stage_upload
+    outputs = [{'value': value} for value in range(10)]
+    with pytest.raises(StageOutputError):
+        rp.transform_input_lines(outputs, write=rp.write_to_stage)
+    assert len(uploads) == 2
+    assert os.path.isfile(uploads[0])
+    assert rp.input_lines_rejected_count == rp.input_lines_tbd_rejected_count == 0
+    rp.discard_stage_file()
+    assert rp._stage_files == []
+    assert not any(files for _, _, files in os.walk(tmp_path / 'output'))
@@ -12,6 +12,11 @@ class TemplateProcessor(RecordProcessorBase):
         # return ["tomato-count-details"] # TODO: implement this
         return None
 
+    @staticmethod
+    def columns_to_be_read():
+        # return ["tagId", "farm_id", "phase_id"]  # the columns used by the processor, None reads all the columns
+        return None
+
     @abstractmethod
     def create_message_payload(self, payload):
         # yield TemplateDatalakeRecord(record_processor=self).get_content(payload) # TODO: implement this
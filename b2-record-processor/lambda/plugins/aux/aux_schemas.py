@@ -5,10 +5,10 @@ Created on Wed Apr 10 14:30:01 2019
 @author: mandeep
 """
 
-import fastjsonschema as fjs
+from models.schema_validator import load_validator
 
 aux_json_schema = {
-  'aux_data_payload': fjs.compile({
+  'aux_data_payload': load_validator('aux_data_payload', {
     'type': 'object',
     'required': ['customer_id', 'farm_id', 'phase_id', 'capture_timestamp',
       'capture_local_datetime', 'upload_timestamp',
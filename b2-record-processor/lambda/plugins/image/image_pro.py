@@ -14,6 +14,10 @@ class ImageRecordProcessor(RecordProcessorBase):
     def types_to_be_processed():
         return ["image"]
 
+    @staticmethod
+    def columns_to_be_read():
+        return ["location", "time", "image_file_path"]
+
     def create_message_payload(self, payload):
         record = ImageDatalakeRecord(record_processor=self)
         yield record.get_content(payload)
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from math import ceil
 import datamodule.sysconfig_model as sysconfig_model
 import plugins.label.label_schemas as label_schemas
@@ -8,7 +9,11 @@ from helpers import cast_to_int
 from models.data_lake_record import DataLakeRecord
 from models.record_processor import RecordProcessorBase
 
-LABEL_CATEGORY = dict( (x,y) for x, y  in list(map(lambda x: (x.label, x.category),  sysconfig_model.SysConfigModel().labels)))
+
+# Label -> category, read from the system configuration on the first use and kept for the warm invocations
+@lru_cache(maxsize=None)
+def get_label_category():
+    return dict( (x,y) for x, y  in list(map(lambda x: (x.label, x.category),  sysconfig_model.SysConfigModel().labels)))
 
 
 class LabelRecordProcessor(RecordProcessorBase):
@@ -131,7 +136,7 @@ class LabelDatalakeRecord(DataLakeRecord):
             for key in non_meta_keys:
                 if key in self._label_meta:
                     self._label_meta.pop(key)
-            self._label_meta['category'] = LABEL_CATEGORY.get(self._label_meta['label'], self._label_meta['label'])
+            self._label_meta['category'] = get_label_category().get(self._label_meta['label'], self._label_meta['label'])
             self._label_meta['source'] = 'machine'
         return self._label_meta
 
@@ -6,11 +6,11 @@ Created on Mon Apr 17 18:28:24 2019
 @author: fernando@ecoation.com
 """
 
-import fastjsonschema as fjs
+from models.schema_validator import load_validator
 
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-schema = fjs.compile({
+schema = load_validator('label', {
     'type': 'object',
     'required': [
         'customer_id',
@@ -6,9 +6,9 @@ Created on Mon Jun 5 13:58:24 2019
 @author: fernando@ecoation.com
 """
 
-import fastjsonschema as fjs
+from models.schema_validator import load_validator
 
-schema_model_flower_count_detail = fjs.compile({
+schema_model_flower_count_detail = load_validator('model_flower_count_detail', {
     'type': 'object',
     'required': [
         'customer_id',
@@ -6,7 +6,7 @@ Created on Mon Jun 5 13:58:24 2019
 @author: fernando@ecoation.com
 """
 
-import fastjsonschema as fjs
+from models.schema_validator import load_validator
 
 
 schema_model_stress_prediction_detail_base = {
@@ -100,4 +100,4 @@ schema_model_stress_prediction_detail_base = {
     'additionalProperties': True,
     }
 
-schema_model_stress_prediction_detail = fjs.compile(schema_model_stress_prediction_detail_base)
+schema_model_stress_prediction_detail = load_validator('model_stress_prediction_detail', schema_model_stress_prediction_detail_base)
@@ -1,7 +1,7 @@
 from helpers import cast_to_int
 from plugins.label import label_schemas
 
-from plugins.label.label_pro import LABEL_CATEGORY
+from plugins.label.label_pro import get_label_category
 
 from plugins.model_stress_prediction_detail.model_stress_prediction_detail import ModelStressPredictionDetailProcessor, \
     ModelStressPredictionDetailDatalakeRecord
@@ -61,6 +61,6 @@ class ModelStressPredictionSummaryDatalakeRecord(ModelStressPredictionDetailData
         label_meta["startTime"] = self.get_capture_local_datetime()
         label_meta["endTime"] = self.get_capture_local_datetime()
         label_meta["endDistance"] = self.get_distance_cm()
-        label_meta["category"] = LABEL_CATEGORY.get(self.json_line["label"], self.json_line["label"])
+        label_meta["category"] = get_label_category().get(self.json_line["label"], self.json_line["label"])
 
         return dict(label_meta=label_meta)
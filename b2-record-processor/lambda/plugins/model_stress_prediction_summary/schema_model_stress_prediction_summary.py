@@ -6,9 +6,9 @@ Created on Mon Jun 5 13:58:24 2019
 @author: fernando@ecoation.com
 """
 
-import fastjsonschema as fjs
+from models.schema_validator import load_validator
 
-schema_model_stress_prediction_summary = fjs.compile({
+schema_model_stress_prediction_summary = load_validator('model_stress_prediction_summary', {
     'type': 'object',
     'required': [
         'customer_id',
@@ -15,6 +15,10 @@ class VideoRecordProcessor(RecordProcessorBase):
     def types_to_be_processed():
         return ["video"]
 
+    @staticmethod
+    def columns_to_be_read():
+        return ["id", "location", "frames", "time", "video_file_path"]
+
     def create_message_payload(self, payload):
         for frame in payload["frames"]:
             json_line = payload.copy()
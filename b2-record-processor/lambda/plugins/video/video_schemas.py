@@ -5,9 +5,9 @@ Created on Wed Apr 10 14:30:01 2019
 @author: mandeep
 """
 
-import fastjsonschema as fjs
+from models.schema_validator import load_validator
 
-video_json_schema = {'video_data_payload': fjs.compile({
+video_json_schema = {'video_data_payload': load_validator('video_data_payload', {
     'type': 'object',
     'required': [
         'customer_id',
@@ -28,6 +28,17 @@ class WaveRecordProcessor(RecordProcessorBase):
     def types_to_be_processed():
         return ["wave"]
 
+    def reset(self):
+        super().reset()
+        self._capture_local_datetime = None
+        self._capture_timestamp = None
+        self._direction = None
+        self._distance_cm = None
+        self._height_cm = None
+        self._sensor_recipe = None
+        self._tag_id = None
+        self._wave_filename = None
+
     def on_line_output_exception(self, input_line: dict, payload_count: int, error: Exception):
         super().on_line_output_exception(input_line, payload_count, error)
         raise error
@@ -6,9 +6,9 @@ Created on Wed Apr 10 14:30:01 2019
 @author: mandeep
 """
 
-import fastjsonschema as fjs
+from models.schema_validator import load_validator
 
-wave_json_schema = {'wave_data_payload': fjs.compile({
+wave_json_schema = {'wave_data_payload': load_validator('wave_data_payload', {
     'type': 'object',
     'required': [
         'customer_id',
@@ -16,12 +16,16 @@ from datetime import datetime
 import boto3
 from botocore.exceptions import ClientError
 import botocore
+import botocore.config
 import s3fs
 
 from base.cloud_provider import CloudProviderBase
+from base.stage_object_cache import StageObjectCache
 from helpers import (
     get_logger)
 from models.event_message import AWSKinesisEventMessage
+from models.stage_file import STAGE_FILE_MEMORY_MAX_BYTES, spool_stream
+from providers.aws.s3_multipart_upload import S3MultipartUpload
 
 logger = get_logger(__name__)
 
@@ -40,19 +44,69 @@ class AwsCloudProvider(CloudProviderBase):
     S3_FILE_PATH_RE = re.compile(r'^s3://(?P<bucket_name>[^/]+)/(?P<file_key>.*$)')
     s3fs = s3fs.S3FileSystem()
 
+    _STAGE_FETCH_MAX_WORKERS = int(os.getenv("STAGE_FETCH_MAX_WORKERS", 8))
+    # Cache of the stage objects on /tmp, STAGE_CACHE_MAX_BYTES=0 disables it
+    _STAGE_CACHE_DIR = os.getenv("STAGE_CACHE_DIR", "/tmp/stage-object-cache")
+    _STAGE_CACHE_MAX_BYTES = int(os.getenv("STAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+    _STAGE_CACHE_MIN_FREE_BYTES = int(os.getenv("STAGE_CACHE_MIN_FREE_BYTES", 128 * 1024 * 1024))
+
+    # Size of the parts of the stage files uploaded while they are written, STAGE_UPLOAD_PART_BYTES=0 uploads
+    # the stage files once they are closed
+    _STAGE_UPLOAD_PART_BYTES = int(os.getenv("STAGE_UPLOAD_PART_BYTES", 8 * 1024 * 1024))
+
     def __init__(self):
         super().__init__()
         self.session = boto3.Session()
-        self.s3 = self.session.resource('s3')
+        # The records are processed by several threads: the clients are thread safe (unlike the resources),
+        # the pool allows one connection per fetch worker
+        self.s3_client = self.session.client('s3', config=botocore.config.Config(
+            max_pool_connections=max(10, self._STAGE_FETCH_MAX_WORKERS)))
+        if self._STAGE_CACHE_MAX_BYTES > 0:
+            self.stage_cache = StageObjectCache(directory=self._STAGE_CACHE_DIR,
+                                                max_bytes=self._STAGE_CACHE_MAX_BYTES,
+                                                min_free_bytes=self._STAGE_CACHE_MIN_FREE_BYTES,
+                                                memory_max_bytes=STAGE_FILE_MEMORY_MAX_BYTES)
         self.kinesis_client = self.session.client('kinesis')
 
     def download_object(self, obj_address, obj_name, local_file_location):
         try:
-            self.s3.Bucket(obj_address).download_file(obj_name, local_file_location)
+            self.s3_client.download_file(obj_address, obj_name, local_file_location)
         except ClientError as e:
             if e.response['Error']['Code'] == "404":
                 logger.info("The object does not exist.")
 
+    def fetch_stage_object(self, obj_name):
+        bucket = self.extract_bucket_name(obj_path=obj_name, default_bucket=self._S3_STAGE_BUCKET_NAME)
+        key = self.extract_file_key(obj_path=obj_name)
+        if not self.stage_cache:
+            return self.read_stage_object(self.s3_client.get_object(Bucket=bucket, Key=key), key)
+
+        # The cached version is downloaded again only when the object changed (HTTP 304 otherwise)
+        cached_etag = self.stage_cache.get_etag(bucket, key)
+        try:
+            if cached_etag:
+                response = self.s3_client.get_object(Bucket=bucket, Key=key, IfNoneMatch=cached_etag)
+            else:
+                response = self.s3_client.get_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('304', 'NotModified'):
+                raise
+            content = self.stage_cache.get(bucket, key, cached_etag)
+            if content is not None:
+                return content
+            # Evicted after the request
+            response = self.s3_client.get_object(Bucket=bucket, Key=key)
+        content = self.read_stage_object(response, key)
+        self.stage_cache.put(bucket, key, response["ETag"], content)
+        return content
+
+    # The objects bigger than STAGE_FILE_MEMORY_MAX_BYTES are streamed to a spool file on /tmp
+    @staticmethod
+    def read_stage_object(response, key):
+        if response.get("ContentLength", 0) > STAGE_FILE_MEMORY_MAX_BYTES:
+            return spool_stream(response["Body"], suffix=os.path.basename(key))
+        return response["Body"].read()
+
     def send_to_stream(self, stream_name, stream_payload):
         put_response = self.kinesis_client.put_record(
             StreamName=stream_name,
@@ -61,8 +115,7 @@ class AwsCloudProvider(CloudProviderBase):
         logger.debug(put_response)
 
     def put_object(self, obj_address, obj_name, obj_content):
-        s3_object = self.s3.Object(obj_address, obj_name)
-        s3_object.put(Body=json.dumps(obj_content))
+        self.s3_client.put_object(Bucket=obj_address, Key=obj_name, Body=json.dumps(obj_content))
 
     def extract_bucket_name(self, obj_path, default_bucket=None):
         s3_match = self.S3_FILE_PATH_RE.match(obj_path)
@@ -80,30 +133,30 @@ class AwsCloudProvider(CloudProviderBase):
     def format_stage_filename(self, filepath):
         return f's3://{self._S3_STAGE_BUCKET_NAME}/{self.extract_file_key(obj_path=filepath)}'
 
-    @staticmethod
-    def upload_stage_content(data_frame, destination_path):
-        data_frame.to_csv(
-            path_or_buf=destination_path,
-            sep=CSV_DELIMITER,
-            escapechar=CSV_ESCAPECHAR,
-            quotechar=CSV_QUOTECHAR,
-            quoting=CSV_QUOTING,
-            index=False
-        )
-        # with self.s3fs.open(destination_path, 'wb') as s3f:
-        #     with gzip.GzipFile(fileobj=s3f) as gz_file:
-        #         output = data_frame.to_csv(index=False,
-        #                                    sep=CSV_DELIMITER,
-        #                                    escapechar=CSV_ESCAPECHAR,
-        #                                    quotechar=CSV_QUOTECHAR,
-        #                                    quoting=CSV_QUOTING
-        #                                    )
-        #         gz_file.write(output.encode('UTF-8'))
+    # Uploads the content of a stage file writer (multipart upload for the big files)
+    def upload_stage_content(self, content_file, destination_path):
+        self.s3_client.upload_fileobj(
+            content_file,
+            self.extract_bucket_name(obj_path=destination_path, default_bucket=self._S3_STAGE_BUCKET_NAME),
+            self.extract_file_key(obj_path=destination_path))
+
+    def delete_stage_object(self, destination_path):
+        self.s3_client.delete_object(
+            Bucket=self.extract_bucket_name(obj_path=destination_path, default_bucket=self._S3_STAGE_BUCKET_NAME),
+            Key=self.extract_file_key(obj_path=destination_path))
+
+    def open_stage_upload(self, destination_path):
+        if self._STAGE_UPLOAD_PART_BYTES <= 0:
+            return None
+        return S3MultipartUpload(
+            self.s3_client,
+            bucket=self.extract_bucket_name(obj_path=destination_path, default_bucket=self._S3_STAGE_BUCKET_NAME),
+            key=self.extract_file_key(obj_path=destination_path),
+            part_size=self._STAGE_UPLOAD_PART_BYTES)
 
     def get_object(self, obj_address, obj_name):
-        content_object = self.s3.Object(obj_address, obj_name)
         extension = obj_name.split('.')[-1]
-        file_content = content_object.get()["Body"].read()
+        file_content = self.s3_client.get_object(Bucket=obj_address, Key=obj_name)["Body"].read()
         if len(file_content) == 0:
             raise Exception(f"The object [{obj_address}/{obj_name}] has 0 bytes length.")
         if extension in ('bz2', 'gz'):
@@ -118,8 +171,7 @@ class AwsCloudProvider(CloudProviderBase):
 
     def upload_file(self, filename, obj_address, obj_name):
         try:
-            s3_object = self.s3.Object(obj_address, obj_name)
-            s3_object.upload_file(filename)
+            self.s3_client.upload_file(filename, obj_address, obj_name)
         except Exception as error:
             traceback.print_tb(error.__traceback__)
             logger.error(f"Debug: {locals()}")
@@ -130,7 +182,7 @@ class AwsCloudProvider(CloudProviderBase):
             'Bucket': source_obj_address,
             'Key': source_obj_name
         }
-        self.s3.meta.client.copy(copy_source, dest_obj_address, dest_obj_name)
+        self.s3_client.copy(copy_source, dest_obj_address, dest_obj_name)
 
     def put_in_saved_data_stream(self, payload):
         self.send_to_stream(
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Ecoation S3MultipartUpload
+#
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers import get_logger
+
+logger = get_logger(__name__)
+
+# S3 rejects the parts smaller than 5MB, except the last one
+S3_MIN_PART_BYTES = 5 * 1024 * 1024
+
+
+class S3MultipartUpload:
+    """
+    Writable binary file which uploads its content to an S3 object while it is written.
+
+    Each part_size bytes written become a part of a multipart upload, sent by a background thread with at most
+    max_pending_parts parts waiting, so the upload overlaps the writing and the memory stays bounded.
+    close() completes the upload, or sends the content with a single put_object when it is smaller than a part.
+    A failed upload is aborted: the object is only visible once the upload is completed, never partially.
+    Usage:
+        upload = S3MultipartUpload(s3_client, bucket, key)
+        upload.write(content)
+        upload.close()  # or upload.abort()
+    """
+
+    def __init__(self, s3_client, bucket, key, part_size=S3_MIN_PART_BYTES, max_pending_parts=2):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, S3_MIN_PART_BYTES)
+        self.max_pending_parts = max_pending_parts
+        self.closed = False
+        self._buffer = bytearray()
+        self._size = 0
+        self._upload_id = None
+        self._executor = None
+        self._pending = collections.deque()
+        self._parts = []
+
+    @property
+    def parts_count(self):
+        return len(self._parts) + len(self._pending)
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._size
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        self._buffer += data
+        self._size += len(data)
+        try:
+            while len(self._buffer) >= self.part_size:
+                part = bytes(self._buffer[:self.part_size])
+                del self._buffer[:self.part_size]
+                self.upload_part(part)
+        except Exception:
+            self.abort()
+            raise
+        return len(data)
+
+    def upload_part(self, body):
+        if self._upload_id is None:
+            self._upload_id = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        while len(self._pending) >= self.max_pending_parts:
+            self._parts.append(self._pending.popleft().result())
+        self._pending.append(self._executor.submit(self.send_part, self.parts_count + 1, body))
+
+    def send_part(self, part_number, body):
+        response = self.s3_client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                              PartNumber=part_number, Body=body)
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+            else:
+                if self._buffer:
+                    self.upload_part(bytes(self._buffer))
+                while self._pending:
+                    self._parts.append(self._pending.popleft().result())
+                self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                         MultipartUpload={'Parts': self._parts})
+        except Exception:
+            self.abort()
+            raise
+        self.closed = True
+        self._buffer = bytearray()
+        if self._executor:
+            self._executor.shutdown()
+
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._buffer = bytearray()
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        if self._executor:
+            self._executor.shutdown()
+        if self._upload_id is not None:
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except Exception as error:
+                logger.error(f"Error while aborting the multipart upload of s3://{self.bucket}/{self.key}. Details: {error}")
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Unit Test for the S3MultipartUpload
+#
+
+import pytest
+
+from providers.aws.s3_multipart_upload import S3MultipartUpload, S3_MIN_PART_BYTES
+
+
+class FakeS3Client:
+
+    def __init__(self, failing_part=None):
+        self.failing_part = failing_part
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = f'upload-{len(self.uploads)}'
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.failing_part:
+            raise Exception("upload_part failed")
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'"etag-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        assert [part['PartNumber'] for part in MultipartUpload['Parts']] == sorted(parts)
+        self.objects[(Bucket, Key)] = b''.join(parts[number] for number in sorted(parts))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+        self.aborted.append(UploadId)
+
+
+def test_small_content_is_put_at_once():
+    s3_client = FakeS3Client()
+    upload = S3MultipartUpload(s3_client, 'bucket', 'key.csv')
+    upload.write(b'a;b\n')
+    upload.write(b'1;2\n')
+    upload.close()
+    assert s3_client.objects == {('bucket', 'key.csv'): b'a;b\n1;2\n'}
+    assert upload.closed and upload.parts_count == 0
+
+
+def test_parts_are_uploaded_while_writing():
+    s3_client = FakeS3Client()
+    upload = S3MultipartUpload(s3_client, 'bucket', 'key.csv', max_pending_parts=1)
+    content = bytes(range(256)) * (S3_MIN_PART_BYTES // 100)
+    for start in range(0, len(content), 1024 * 1024):
+        upload.write(content[start:start + 1024 * 1024])
+    assert upload.parts_count == len(content) // S3_MIN_PART_BYTES
+    assert ('bucket', 'key.csv') not in s3_client.objects
+    upload.close()
+    assert s3_client.objects[('bucket', 'key.csv')] == content
+    assert upload.parts_count == len(content) // S3_MIN_PART_BYTES + 1
+
+
+def test_failed_upload_is_aborted():
+    s3_client = FakeS3Client(failing_part=2)
+    upload = S3MultipartUpload(s3_client, 'bucket', 'key.csv')
+    with pytest.raises(Exception, match="upload_part failed"):
+        for _ in range(4):
+            upload.write(b'0' * S3_MIN_PART_BYTES)
+        upload.close()
+    assert s3_client.objects == {} and s3_client.uploads == {}
+    assert s3_client.aborted == ['upload-0']
+    with pytest.raises(ValueError):
+        upload.write(b'0')
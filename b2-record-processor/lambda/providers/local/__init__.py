@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+# Ecoation Local export
+#
+
+from .local_cloud import LocalCloudProvider as local
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Local cloud provider, backed by the filesystem
+#
+# Used to run the record processor offline (tests and benchmarks):
+#   - stage files are read from LOCAL_STAGE_ROOT (default: b2-record-processor/tests/stage_files)
+#   - stage files created by the record processor are written to LOCAL_OUTPUT_DIR (default: /tmp/b2-record-processor)
+#   - stream messages are appended to LOCAL_OUTPUT_DIR/streams/<stream name>.jsonl
+#
+import io
+import json
+import os
+import re
+import shutil
+import threading
+
+from base.cloud_provider import CloudProviderBase
+from helpers import (
+    get_logger)
+from models.event_message import AWSKinesisEventMessage
+from models.stage_file import STAGE_FILE_MEMORY_MAX_BYTES, SpooledStageContent
+
+logger = get_logger(__name__)
+
+DEFAULT_STAGE_ROOT = os.path.realpath(
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', '..', 'tests', 'stage_files'))
+DEFAULT_OUTPUT_DIR = '/tmp/b2-record-processor'
+
+
+class LocalStageUpload:
+    """Writable binary file of a stage file, written next to its destination and renamed to it by close()."""
+
+    def __init__(self, destination_path):
+        self.destination_path = destination_path
+        self.temporary_path = f"{destination_path}.upload"
+        self.closed = False
+        self._file = None
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.destination_path), exist_ok=True)
+            self._file = open(self.temporary_path, 'wb')
+        return self._file.write(data)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        if self._file is None:
+            self.write(b'')
+        self.closed = True
+        self._file.close()
+        os.replace(self.temporary_path, self.destination_path)
+
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._file is not None:
+            self._file.close()
+            os.remove(self.temporary_path)
+
+
+class LocalCloudProvider(CloudProviderBase):
+    _KINESIS_INVALID_DATASTREAM = os.getenv("INVALID_DATASTREAM_NAME", "eis-b2-invalid-stream")
+    _KINESIS_PROCESSED_DATA_STREAM = os.getenv("PROCESSED_DATA_STREAM_NAME", "eis-b2-processed-stream")
+    _KINESIS_SAVED_DATA_STREAM = os.getenv("SAVED_DATA_STREAM_NAME", "eis-b2-saved-stream")
+    S3_FILE_PATH_RE = re.compile(r'^s3://(?P<bucket_name>[^/]+)/(?P<file_key>.*$)')
+
+    def __init__(self, stage_root=None, output_dir=None):
+        super().__init__()
+        self.stage_root = stage_root or os.getenv("LOCAL_STAGE_ROOT", DEFAULT_STAGE_ROOT)
+        self.output_dir = output_dir or os.getenv("LOCAL_OUTPUT_DIR", DEFAULT_OUTPUT_DIR)
+        self._stream_lock = threading.Lock()
+        self._stage_files_by_name = None
+
+    @property
+    def streams_dir(self):
+        return os.path.join(self.output_dir, 'streams')
+
+    @property
+    def stage_output_dir(self):
+        return os.path.join(self.output_dir, 'stage')
+
+    def extract_file_key(self, obj_path):
+        s3_match = self.S3_FILE_PATH_RE.match(obj_path)
+        return s3_match.groupdict()["file_key"] if s3_match else obj_path
+
+    def get_stage_files_by_name(self):
+        if self._stage_files_by_name is None:
+            self._stage_files_by_name = {}
+            for folder, _, filenames in os.walk(self.stage_root):
+                for filename in filenames:
+                    self._stage_files_by_name.setdefault(filename, os.path.join(folder, filename))
+        return self._stage_files_by_name
+
+    def find_stage_file(self, file_key):
+        """Returns the local path of a stage file key, or None when it does not exist.
+
+        The key is looked up in the output folder (files created by the record processor), then in the stage root
+        by the key itself, by the part starting at "datatype=" (the layout of tests/stage_files) and by the filename.
+        """
+        candidates = [os.path.join(self.stage_output_dir, file_key), os.path.join(self.stage_root, file_key)]
+        if 'datatype=' in file_key:
+            candidates.append(os.path.join(self.stage_root, file_key[file_key.index('datatype='):]))
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                return candidate
+        return self.get_stage_files_by_name().get(os.path.basename(file_key))
+
+    def format_stage_filename(self, filepath):
+        file_key = self.extract_file_key(obj_path=filepath)
+        return self.find_stage_file(file_key) or os.path.join(self.stage_output_dir, file_key)
+
+    @staticmethod
+    def open_stage_upload(destination_path):
+        return LocalStageUpload(destination_path)
+
+    @staticmethod
+    def upload_stage_content(content_file, destination_path):
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        with open(destination_path, 'wb') as f:
+            shutil.copyfileobj(content_file, f)
+
+    @staticmethod
+    def delete_stage_object(destination_path):
+        if os.path.isfile(destination_path):
+            os.remove(destination_path)
+
+    def get_object_path(self, obj_address, obj_name):
+        return os.path.join(self.output_dir, 'objects', obj_address, obj_name)
+
+    def get_object(self, obj_address, obj_name):
+        filepath = self.find_stage_file(obj_name) or self.get_object_path(obj_address, obj_name)
+        with open(filepath, 'rb') as f:
+            file_content = f.read()
+        if len(file_content) == 0:
+            raise Exception(f"The object [{obj_address}/{obj_name}] has 0 bytes length.")
+        if obj_name.split('.')[-1] in ('bz2', 'gz'):
+            file_content = io.BytesIO(file_content)
+        return file_content
+
+    def get_stage_object(self, obj_name):
+        return self.get_object(obj_address='stage', obj_name=self.extract_file_key(obj_path=obj_name))
+
+    def fetch_stage_object(self, obj_name):
+        filepath = obj_name if os.path.isfile(obj_name) else self.find_stage_file(self.extract_file_key(obj_name))
+        if not filepath:
+            raise FileNotFoundError(f"The stage object was not found: [{obj_name}]")
+        if os.path.getsize(filepath) > STAGE_FILE_MEMORY_MAX_BYTES:
+            # Read in place by the stage file reader
+            return SpooledStageContent(filepath, remove=False)
+        with open(filepath, 'rb') as f:
+            return f.read()
+
+    def download_object(self, obj_address, obj_name, local_file_location):
+        filepath = self.find_stage_file(obj_name) or self.get_object_path(obj_address, obj_name)
+        if not os.path.isfile(filepath):
+            logger.info("The object does not exist.")
+            return
+        shutil.copyfile(filepath, local_file_location)
+
+    def put_object(self, obj_address, obj_name, obj_content):
+        filepath = self.get_object_path(obj_address, obj_name)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'w') as f:
+            json.dump(obj_content, f)
+
+    def upload_file(self, filename, obj_address, obj_name):
+        filepath = self.get_object_path(obj_address, obj_name)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        shutil.copyfile(filename, filepath)
+
+    def upload_stage_file(self, filename, obj_name):
+        filepath = os.path.join(self.stage_output_dir, obj_name)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        shutil.copyfile(filename, filepath)
+
+    def copy_object(self, source_obj_address, source_obj_name, dest_obj_address, dest_obj_name):
+        filepath = self.get_object_path(dest_obj_address, dest_obj_name)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        shutil.copyfile(self.find_stage_file(source_obj_name) or self.get_object_path(source_obj_address, source_obj_name),
+                        filepath)
+
+    def send_to_stream(self, stream_name, stream_payload):
+        line = json.dumps(stream_payload)
+        with self._stream_lock:
+            os.makedirs(self.streams_dir, exist_ok=True)
+            with open(os.path.join(self.streams_dir, f"{stream_name}.jsonl"), 'a') as f:
+                f.write(line + '\n')
+
+    def read_stream(self, stream_name):
+        filepath = os.path.join(self.streams_dir, f"{stream_name}.jsonl")
+        if not os.path.isfile(filepath):
+            return []
+        with open(filepath) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def put_in_saved_data_stream(self, payload):
+        self.send_to_stream(
+            stream_name=self._KINESIS_SAVED_DATA_STREAM,
+            stream_payload=payload)
+
+    def put_in_invalid_data_stream(self, payload):
+        self.send_to_stream(
+            stream_name=self._KINESIS_INVALID_DATASTREAM,
+            stream_payload=payload)
+
+    def put_in_processed_data_stream(self, payload):
+        self.send_to_stream(
+            stream_name=self._KINESIS_PROCESSED_DATA_STREAM,
+            stream_payload=payload)
+
+    def create_event_message(self, event):
+        return AWSKinesisEventMessage(event_content=event)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# Unit Test for the LocalCloudProvider
+#
+
+import os
+
+import pandas as pd
+import pytest
+
+from models.stage_file import StageCSVReaderFile, StageCSVWriterFile
+from providers.local.local_cloud import LocalCloudProvider, DEFAULT_STAGE_ROOT
+
+AUX_STAGE_FILE = 'datatype=aux/0548207774491915-1558550387142-20190522-auxsensorbox_co2-184951.tar.bz2__184092f6-8d6e-11e9-9a2c-8e806d2bbd6d.csv.gz'
+
+
+@pytest.fixture()
+def provider(tmp_path):
+    return LocalCloudProvider(stage_root=DEFAULT_STAGE_ROOT, output_dir=str(tmp_path))
+
+
+def test_format_stage_filename_finds_fixture(provider):
+    filepath = provider.format_stage_filename(
+        f's3://eis-b2-staging-data-dev/raw-processor/process_date=2019-06-09/{AUX_STAGE_FILE}')
+    assert filepath == os.path.join(DEFAULT_STAGE_ROOT, AUX_STAGE_FILE)
+    assert len(StageCSVReaderFile(filepath)) > 0
+
+
+def test_stage_output_is_written_and_read_back(provider):
+    destination_path = provider.format_stage_filename('record-processor/datatype=aux/pytest__1234.csv')
+    assert destination_path.startswith(provider.stage_output_dir)
+    writer = StageCSVWriterFile(filename='pytest')
+    writer.write({'a': 1, 'b': 'x'})
+    writer.close()
+    provider.upload_stage_content(writer.file, destination_path)
+    assert provider.format_stage_filename('record-processor/datatype=aux/pytest__1234.csv') == destination_path
+    assert pd.read_csv(destination_path, sep=';').to_dict('records') == [{'a': 1, 'b': 'x'}]
+
+
+def test_streams_are_appended_to_jsonl_files(provider):
+    provider.put_in_processed_data_stream({'type': 'aux', 'payload': ['a']})
+    provider.put_in_processed_data_stream({'type': 'aux', 'payload': ['b']})
+    provider.put_in_invalid_data_stream({'type': 'event'})
+    assert [m['payload'] for m in provider.read_stream(provider._KINESIS_PROCESSED_DATA_STREAM)] == [['a'], ['b']]
+    assert provider.read_stream(provider._KINESIS_INVALID_DATASTREAM) == [{'type': 'event'}]
+    assert provider.read_stream(provider._KINESIS_SAVED_DATA_STREAM) == []
+
+
+def test_stage_upload_is_visible_once_closed(provider):
+    destination_path = provider.format_stage_filename('record-processor/datatype=aux/pytest__5678.csv')
+    writer = StageCSVWriterFile(filename='pytest', upload=provider.open_stage_upload(destination_path))
+    writer.write({'a': 1, 'b': 'x'})
+    assert not os.path.exists(destination_path)
+    writer.close()
+    assert writer.is_uploaded
+    assert pd.read_csv(destination_path, sep=';').to_dict('records') == [{'a': 1, 'b': 'x'}]
+
+    aborted_path = provider.format_stage_filename('record-processor/datatype=aux/pytest__9012.csv')
+    writer = StageCSVWriterFile(filename='pytest', upload=provider.open_stage_upload(aborted_path))
+    writer.write({'a': 1, 'b': 'x'})
+    writer.flush_buffer()
+    writer.discard()
+    assert os.listdir(os.path.dirname(aborted_path)) == [os.path.basename(destination_path)]
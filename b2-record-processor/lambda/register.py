@@ -5,29 +5,31 @@
 #
 
 from config import SYS_PROXY
-import plugins.wave
-import plugins.video
-import plugins.label
-import plugins.aux
-import plugins.image
-import plugins.model_fruit_count_detail
-import plugins.model_fruit_count_summary
-import plugins.model_flower_count_detail
-import plugins.model_flower_count_summary
-import plugins.model_stress_prediction_detail
-import plugins.model_stress_prediction_summary
 
+# Processor manifest: RawDataType -> plugin module and the types of record it processes
+# The plugin module is only imported by the proxy the first time a record of one of its types arrives,
+# the types must match the types_to_be_processed() of the plugin RecordProcessor.
+PROCESSOR_MANIFEST = {
+    'wave': {'module': 'plugins.wave', 'types': ["wave"]},
+    'video': {'module': 'plugins.video', 'types': ["video"]},
+    'label': {'module': 'plugins.label', 'types': ["label"]},
+    'aux': {'module': 'plugins.aux', 'types': ["aux"]},
+    'image': {'module': 'plugins.image', 'types': ["image"]},
+    'model_fruit_count_detail': {'module': 'plugins.model_fruit_count_detail',
+                                 'types': ["model-fruit-count-detail"]},
+    'model_fruit_count_summary': {'module': 'plugins.model_fruit_count_summary',
+                                  'types': ["model-fruit-count-summary"]},
+    'model_flower_count_detail': {'module': 'plugins.model_flower_count_detail',
+                                  'types': ["model-flower-count-detail"]},
+    'model_flower_count_summary': {'module': 'plugins.model_flower_count_summary',
+                                   'types': ["model-flower-count-summary"]},
+    'model_stress_prediction_detail': {'module': 'plugins.model_stress_prediction_detail',
+                                       'types': ["model-stress-prediction-detail"]},
+    'model_stress_prediction_summary': {'module': 'plugins.model_stress_prediction_summary',
+                                        'types': ["model-stress-prediction-summary"]},
+}
 
-def register_processors():
-    SYS_PROXY.register_processor(plugins.wave.RawDataType, plugins.wave.RecordProcessor)
-    SYS_PROXY.register_processor(plugins.video.RawDataType, plugins.video.RecordProcessor)
-    SYS_PROXY.register_processor(plugins.label.RawDataType, plugins.label.RecordProcessor)
-    SYS_PROXY.register_processor(plugins.aux.RawDataType, plugins.aux.RecordProcessor)
-    SYS_PROXY.register_processor(plugins.image.RawDataType, plugins.image.RecordProcessor)
-    SYS_PROXY.register_processor(plugins.model_fruit_count_detail.RawDataType, plugins.model_fruit_count_detail.RecordProcessor)
-    SYS_PROXY.register_processor(plugins.model_fruit_count_summary.RawDataType, plugins.model_fruit_count_summary.RecordProcessor)
-    SYS_PROXY.register_processor(plugins.model_flower_count_detail.RawDataType, plugins.model_flower_count_detail.RecordProcessor)
-    SYS_PROXY.register_processor(plugins.model_flower_count_summary.RawDataType, plugins.model_flower_count_summary.RecordProcessor)
-    SYS_PROXY.register_processor(plugins.model_stress_prediction_detail.RawDataType, plugins.model_stress_prediction_detail.RecordProcessor)
-    SYS_PROXY.register_processor(plugins.model_stress_prediction_summary.RawDataType, plugins.model_stress_prediction_summary.RecordProcessor)
 
+def register_processors():
+    for data_type, plugin in PROCESSOR_MANIFEST.items():
+        SYS_PROXY.register_lazy_processor(data_type, plugin['module'], plugin['types'])
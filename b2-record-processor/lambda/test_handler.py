@@ -24,4 +24,11 @@ def test__parametrize(event, exception_expected, result_expected):
 #     with exception_handler:
 #         if callable(event_factory):
 #             event = event_factory()
-#         assert lambda_handler(event, '')["exception_count"] == except_output
\ No newline at end of file
+#         assert lambda_handler(event, '')["exception_count"] == except_output
+
+
+def test_get_batch_item_failures():
+    records = [{'kinesis': {'sequenceNumber': str(i)}} for i in range(4)]
+    results = [{'error_count': 0, 'retry': False}, {'error_count': 2, 'retry': True},
+               {'error_count': 1, 'retry': False}, None]
+    assert handler.get_batch_item_failures(records, results) == [{'itemIdentifier': '1'}, {'itemIdentifier': '3'}]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+#
+# Unit Test for the JSON encoding of the helpers
+#
+
+import decimal
+import json
+
+import numpy as np
+import pytest
+
+import helpers
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def encoder(request, monkeypatch):
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(helpers, 'orjson', None)
+    return helpers.dumps_json
+
+
+def test_dumps_json_converts_the_other_types(encoder):
+    value = {'crops': [{'crop': 'TOV', 'height': decimal.Decimal('1.5'), 'count': decimal.Decimal('2')}],
+             'value': np.float64(0.25), 'count': np.int64(3), 'values': np.array([1, 2]), 'ids': {4},
+             'name': 'tomate été', 'level': {1: True, 2: None}}
+    assert encoder(value) == ('{"crops":[{"crop":"TOV","height":1.5,"count":2}],"value":0.25,"count":3,'
+                              '"values":[1,2],"ids":[4],"name":"tomate été","level":{"1":true,"2":null}}')
+
+
+def test_dumps_json_encodes_nan_as_null(encoder):
+    value = [float('nan'), {'x': np.float64('inf')}, decimal.Decimal('NaN'), 1.5, 2 ** 70]
+    assert json.loads(encoder(value)) == [None, {'x': None}, None, 1.5, 2 ** 70]
+
+
+def test_dumps_json_raises_on_unknown_types(encoder):
+    with pytest.raises(TypeError):
+        encoder({'value': object()})
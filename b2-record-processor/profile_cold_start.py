@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Cold start profiler for the record processor lambda package
+#
+# Measures, in fresh interpreters, the import cost of handler.py module by module (python -X importtime)
+# and the time of each cold start phase: third party libraries, b_log.init, cloud provider registration,
+# register_processors and the import of each plugin (schema compilation included).
+#
+# Usage:
+#   python profile_cold_start.py                          # text report on the stdout
+#   python profile_cold_start.py --format json -o report.json
+#   python profile_cold_start.py --top 50
+#
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+LAMBDA_FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'lambda')
+
+# Modules always reported in the import time section, even if they are not in the top list
+TRACKED_MODULES = ['pandas', 's3fs', 'boto3', 'botocore', 'datamodule', 'fastjsonschema', 'numpy',
+                   'config', 'register', 'handler']
+TRACKED_PREFIXES = ['plugins.', 'providers.']
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)')
+
+
+# Parse the output of python -X importtime
+# Returns a list of {'module', 'self_ms', 'cumulative_ms', 'depth'}
+def parse_import_time(output):
+    modules = []
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        modules.append({
+            'module': match.group(4),
+            'self_ms': int(match.group(1)) / 1000,
+            'cumulative_ms': int(match.group(2)) / 1000,
+            'depth': (len(match.group(3)) - 1) // 2
+        })
+    return modules
+
+
+def is_tracked(module):
+    return module in TRACKED_MODULES or any(module.startswith(prefix) for prefix in TRACKED_PREFIXES)
+
+
+# Import handler.py in a fresh interpreter with -X importtime
+def profile_imports(top):
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import handler'],
+                               cwd=LAMBDA_FOLDER, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True)
+    wall_ms = (time.perf_counter() - started) * 1000
+    modules = parse_import_time(completed.stderr)
+    if completed.returncode:
+        errors = [line for line in completed.stderr.splitlines() if not IMPORT_TIME_LINE.match(line)]
+        raise Exception(f"Error importing handler.py: {os.linesep.join(errors[-20:])}")
+
+    by_cumulative = sorted(modules, key=lambda m: m['cumulative_ms'], reverse=True)
+    top_modules = by_cumulative[:top]
+    tracked = [m for m in by_cumulative if is_tracked(m['module']) and m not in top_modules]
+    return {
+        'wall_ms': wall_ms,
+        'modules_imported': len(modules),
+        'top_modules': top_modules,
+        'tracked_modules': tracked
+    }
+
+
+# Runs the cold start phases, one after the other, in the current interpreter (called in a child process)
+def run_phases():
+    sys.path.insert(0, LAMBDA_FOLDER)
+    os.chdir(LAMBDA_FOLDER)
+    phases = []
+
+    def measure(name, function):
+        started = time.perf_counter()
+        function()
+        phases.append({'phase': name, 'ms': (time.perf_counter() - started) * 1000})
+
+    def import_module(module_name):
+        return lambda: __import__(module_name)
+
+    for module_name in ['numpy', 'pandas', 'boto3', 's3fs', 'fastjsonschema', 'datamodule']:
+        measure(f"import {module_name}", import_module(module_name))
+
+    def init_log():
+        from models import b_log
+        b_log.init(b_log.PROCESS_RECORD_PROCESSOR)
+
+    measure("b_log.init", init_log)
+    measure("config (cloud provider registration)", import_module('config'))
+
+    def register_processors():
+        import register
+        register.register_processors()
+
+    measure("register_processors", register_processors)
+
+    import register
+    from config import SYS_PROXY
+    for data_type in register.PROCESSOR_MANIFEST:
+        measure(f"plugin {data_type}", lambda: SYS_PROXY.get_processor(data_type))
+
+    print(json.dumps(phases))
+
+
+# Run the phases in a fresh interpreter
+def profile_phases():
+    completed = subprocess.run([sys.executable, os.path.realpath(__file__), '--run-phases'],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if completed.returncode:
+        raise Exception(f"Error running the cold start phases: {completed.stderr[-2000:]}")
+    phases = json.loads(completed.stdout.strip().splitlines()[-1])
+    return {
+        'total_ms': sum(p['ms'] for p in phases),
+        'phases': sorted(phases, key=lambda p: p['ms'], reverse=True)
+    }
+
+
+def format_text(report):
+    lines = [
+        f"Python: {report['python']}",
+        "",
+        f"Cold start phases (total {report['phases']['total_ms']:.1f} ms)",
+        f"{'ms':>10}  phase"
+    ]
+    for phase in report['phases']['phases']:
+        lines.append(f"{phase['ms']:>10.1f}  {phase['phase']}")
+
+    imports = report['imports']
+    lines += [
+        "",
+        f"Import of handler.py: {imports['wall_ms']:.1f} ms wall, {imports['modules_imported']} modules",
+        f"{'cumulative':>12}{'self':>10}  module"
+    ]
+    for module in imports['top_modules']:
+        lines.append(f"{module['cumulative_ms']:>12.1f}{module['self_ms']:>10.1f}  {module['module']}")
+    if imports['tracked_modules']:
+        lines += ["", "Tracked modules out of the top list"]
+        for module in imports['tracked_modules']:
+            lines.append(f"{module['cumulative_ms']:>12.1f}{module['self_ms']:>10.1f}  {module['module']}")
+    return os.linesep.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start profiler for the record processor lambda")
+    parser.add_argument('--format', choices=['text', 'json'], default='text')
+    parser.add_argument('-o', '--output', help="write the report to this file instead of the stdout")
+    parser.add_argument('--top', type=int, default=30, help="number of modules listed by cumulative import time")
+    parser.add_argument('--run-phases', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_phases:
+        run_phases()
+        return
+
+    report = {
+        'python': sys.version.split()[0],
+        'phases': profile_phases(),
+        'imports': profile_imports(args.top)
+    }
+    content = json.dumps(report, indent=4) if args.format == 'json' else format_text(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(content + os.linesep)
+    else:
+        print(content)
+
+
+if __name__ == "__main__":
+    main()